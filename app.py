@@ -1,47 +1,37 @@
-import pandas as pd
-from functions.helper_functions import (
-    get_coordinates,
-    get_total_n_earthquakes,
-    extract_data_return_df,
-    combine_transform_data,
-)
-from functions.bigquery_functions import push_data_to_bigquery
-from functions.logger import get_logger
+"""Extracts the earthquakes around the offices from USGS and loads them.
+
+    python app.py                               # every job of config.json
+    python app.py --config other.json --dry-run # print the plan, no request
+    python app.py --only-location pleo_dk --only-location pleo_de
+    python app.py --job europe --job americas --parallel 2
+    python app.py --backfill --workers 4        # resumable, see run_backfill
+    python app.py --realtime --job europe       # poll the USGS real-time feed
+
+The locations, date range, radius and destinations are read from the config
+file, see functions/config.py for every setting. Only the standard library is
+imported at startup: every step imports the modules it needs when it runs, so
+--help and --dry-run start in a fraction of a second without pandas, geopy
+or the Google clients.
+"""
+
+import argparse
+import datetime
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import quote
+
+from functions.config import group_jobs, load_jobs, select_locations
+from functions.logger import configure_logging, get_logger
 
 logger = get_logger("main-script")
 
-# Addresses used for finding the earthquakes
-locations = {
-    "pleo_dk": "Sortedam Dossering 7 - 4th floor  2200 Copenhagen N",
-    "pleo_uk": "Techspace Shoreditch South, Pleo, 32-38 Scrutton street, Buzzer 20, 1st floor, rear unit, EC2A 4RQ",
-    "pleo_de": "Karl-Marx-Allee 3, 10178 Berlin",
-    "pleo_es": "Calle Gran Via, 39 6th floor 28013 Madrid",
-    "pleo_pt": "DP11, Rua Duque de Palmela, 11 1250-096 Lisbon",
-    "pleo_ca": "4 Place Ville Marie, 2e+3e étage",
-    "pleo_se": "Kungsgatan 49, 111 22",
-}
-
-# Define constraints
-file_format = "csv"
-start_time = "2020-01-01"  # Date format in ISO8601 (YYY-MM-DD)
-end_time = "2023-12-31"
-maxradiuskm = 500
-limit = 20000
-
-# Define the URL template
-url_template = "https://earthquake.usgs.gov/fdsnws/event/1/query?format={file_format}&starttime={start_time}&endtime={end_time}&latitude={latitude}&longitude={longitude}&maxradiuskm={maxradiuskm}&limit={limit}"
-count_earthquakes = "https://earthquake.usgs.gov/fdsnws/event/1/count?starttime={start_time}&endtime={end_time}&latitude={latitude}&longitude={longitude}&maxradiuskm={maxradiuskm}"
-
-# BigQuery parameters
-project_id = "project-earthquake-432716"
-dataset_raw = "raw_data"
-dataset_curated = "curated_data"
-# Initialize a list to hold the objects
-dic_addresses = {}
-combined_df = pd.DataFrame()
+DEFAULT_CONFIG_PATH = "config.json"
+
 # Define the columns to keep in the combined dataset
-columns_to_keep_combined_dataset = [
+COLUMNS_TO_KEEP_COMBINED_DATASET = [
     "hashed_id",
+    "id",
     "time",
     "latitude",
     "longitude",
@@ -49,76 +39,849 @@ columns_to_keep_combined_dataset = [
     "location",
     "inserted_at",
 ]
-total_number_earthquakes = 0  # total data equals total extracted rows
 
-logger.info("Starting the extraction process.")
-# loop through this disctionary and extract both values dic_addresses
-dic_addresses = get_coordinates(locations)
 
-logger.info(f"Total number of locations to extract data: {len(dic_addresses)}.")
+def url_templates(job):
+    """Query and count url templates of the job's USGS server."""
+    query = (
+        job.usgs_base_url
+        + "/fdsnws/event/1/query?format={file_format}&starttime={start_time}&endtime={end_time}&latitude={latitude}&longitude={longitude}&maxradiuskm={maxradiuskm}&limit={limit}"
+    )
+    count = (
+        job.usgs_base_url
+        + "/fdsnws/event/1/count?starttime={start_time}&endtime={end_time}&latitude={latitude}&longitude={longitude}&maxradiuskm={maxradiuskm}"
+    )
+    return query, count
+
+
+def spatial_index_path(job):
+    """Index file next to the local curated data, None when disabled."""
+    if not job.spatial_index:
+        return None
+    return os.path.join(
+        job.local_sink_path, job.dataset_curated, "earthquakes_index.parquet"
+    )
+
+
+def destination_root(job):
+    """Parquet root or GCP project of the job's destination."""
+    return job.local_sink_path if job.sink_kind == "parquet" else job.project_id
+
 
-for location_name, coordinates in dic_addresses.items():
+def destination_state_path(job, path):
+    """Local state of the job's destination under path, None when disabled."""
+    if path is None:
+        return None
+    return os.path.join(path, job.sink_kind, quote(destination_root(job), safe=""))
 
-    latitude = coordinates[0]
-    longitude = coordinates[1]
 
-    """ add check to see the number of earthquakes per query and add a section that splits the limit above 20000 results"""
-    # Format the URL to verify the number of extractions to be done
-    url_counts = count_earthquakes.format(
-        file_format=file_format,
-        start_time=start_time,
-        end_time=end_time,
-        latitude=latitude,
-        longitude=longitude,
-        maxradiuskm=maxradiuskm,
+def dedup_index_path(job):
+    """Directory of the dedup index of the job's destination, None when disabled."""
+    return destination_state_path(job, job.dedup_index_path)
+
+
+def rollup_path(job):
+    """Rollup state of the job's destination, None when disabled."""
+    directory = destination_state_path(job, job.rollup_path)
+    if directory is None:
+        return None
+    return os.path.join(directory, f"{job.dataset_curated}.npz")
+
+
+def open_destination(job, location_names, write_lock=None):
+    """Creates the sink of the job and opens its local state.
+    Args:
+        job: JobConfig
+        location_names: locations loaded
+        write_lock: optional function returning a context manager held during
+            the writes to the destination and to its local state, when several
+            processes write to it
+    Returns:
+        Destination: see functions/destination.py
+    """
+    from functions import sinks
+    from functions.destination import Destination
+
+    sink = sinks.build_sink(
+        job.sink_kind,
+        project_id=job.project_id,
+        local_path=job.local_sink_path,
+        duckdb_path=job.duckdb_path,
+        loader_options={
+            "max_workers": job.load_max_workers,
+            "chunk_rows": job.load_chunk_rows,
+            "schema_path": job.bigquery_schema_path,
+        },
+    )
+    if write_lock is not None:
+        sink = sinks.LockedSink(sink, write_lock)
+
+    return Destination(
+        sink,
+        job.dataset_raw,
+        job.dataset_curated,
+        location_names,
+        dedup_index_path=dedup_index_path(job),
+        rollup_path=rollup_path(job),
+        spatial_index_path=spatial_index_path(job),
+        local_tables=job.sink_kind == "parquet",
+        write_lock=write_lock,
     )
 
-    dic_number_earthquakes = get_total_n_earthquakes(
-        url=url_counts, location_name=location_name
-    )  # TODO, see what to do with this, maybe it's useless
 
-    # Format the URL to extract data
-    url_earthquakes = url_template.format(
-        file_format=file_format,
-        start_time=start_time,
-        end_time=end_time,
-        latitude=latitude,
-        longitude=longitude,
-        maxradiuskm=maxradiuskm,
-        limit=limit,
+def plan_job(job):
+    """Prints what run_job would extract and load, without any request and
+    without writing anything. Addresses missing in the geocoding cache are
+    listed, they are geocoded by the run.
+    Args:
+        job: JobConfig
+    """
+    from functions.geocoding_cache import GeocodingCache
+    from functions.region_planner import QueryRegion, plan_query_regions
+    from functions.state_store import WatermarkStore, watermark_key
+
+    if job.sink_kind == "parquet":
+        destination = f"parquet files under {job.local_sink_path}"
+    else:
+        destination = f"BigQuery project {job.project_id}"
+    print(
+        f"job {job.name}: {job.start_time} to {job.end_time}, "
+        f"{job.maxradiuskm} km, to {destination} "
+        f"(raw: {job.dataset_raw}, curated: {job.dataset_curated}.earthquakes)"
     )
 
-    # Extract raw data from source
-    extracted_data = extract_data_return_df(
-        url=url_earthquakes, location_name=location_name
+    watermarks = {}
+    if os.path.exists(job.state_store_path):
+        state_store = WatermarkStore(job.state_store_path)
+        watermarks = {
+            location_name: state_store.get(
+                watermark_key(
+                    location_name, job.maxradiuskm, job.start_time, job.end_time
+                )
+            )
+            for location_name in job.locations
+        }
+        state_store.close()
+
+    cache = GeocodingCache(path=job.geocoding_cache_path, ttl=job.geocoding_cache_ttl)
+    dic_addresses = {}
+    for location_name, address in job.locations.items():
+        coordinates = cache.get(address)
+        if coordinates is None:
+            where = "not in the geocoding cache, geocoded by the run"
+        else:
+            dic_addresses[location_name] = coordinates
+            where = f"{coordinates[0]:.4f}, {coordinates[1]:.4f}"
+        watermark = watermarks.get(location_name)
+        print(
+            f"  {location_name}: {where}, "
+            + (f"events updated after {watermark}" if watermark else "full extraction")
+        )
+
+    if job.merge_regions:
+        regions = plan_query_regions(dic_addresses, job.maxradiuskm)
+    else:
+        regions = [
+            QueryRegion(coordinates[0], coordinates[1], job.maxradiuskm, [name])
+            for name, coordinates in dic_addresses.items()
+        ]
+    _, count_url_template = url_templates(job)
+    for region in regions:
+        print(
+            f"  region {region.latitude:.4f}, {region.longitude:.4f}, "
+            f"{region.radiuskm:.0f} km: {', '.join(region.location_names)}"
+        )
+        print(
+            "    "
+            + count_url_template.format(
+                start_time=job.start_time,
+                end_time=job.end_time,
+                latitude=region.latitude,
+                longitude=region.longitude,
+                maxradiuskm=region.radiuskm,
+            )
+        )
+
+
+def run_job(job, incremental=True, write_lock=None):
+    """Extracts, loads and transforms the locations of one job.
+    Args:
+        job: JobConfig
+        incremental: extract the events updated since the watermark of every
+            location and move it, False for a unit of a backfill
+        write_lock: optional function returning a context manager held during
+            the writes to the destination and to its local state, when several
+            processes write to it
+    Returns:
+        int: number of curated rows loaded
+    """
+    from functions import helper_functions, extraction_engine
+    from functions.curated_collector import CuratedCollector, SpillingCollector
+    from functions.geocoding_cache import GeocodingCache
+    from functions.logger import log_summary, metrics, span
+    from functions.pipeline import Stage, run_pipeline
+    from functions.response_cache import ResponseCache, set_default_cache
+    from functions.state_store import WatermarkStore, watermark_key
+    from functions.usgs_schema import memory_report
+
+    configure_logging(log_format=job.log_format, trace_spans=job.trace_spans)
+    metrics.reset()
+    url_template, count_url_template = url_templates(job)
+
+    logger.info(f"Starting the extraction process of job {job.name}.")
+    set_default_cache(
+        ResponseCache(
+            root=job.response_cache_path,
+            max_bytes=job.response_cache_max_bytes,
+            immutable_after=datetime.timedelta(
+                days=job.response_cache_immutable_after_days
+            ),
+        )
     )
+    with span("stage", stage="geocode"):
+        dic_addresses = helper_functions.get_coordinates(
+            job.locations,
+            cache=GeocodingCache(
+                path=job.geocoding_cache_path, ttl=job.geocoding_cache_ttl
+            ),
+        )
+
+    logger.info(f"Total number of locations to extract data: {len(dic_addresses)}.")
+
+    # Only the events updated since the last load of every location are extracted
+    watermarks = {}
+    if incremental:
+        state_store = WatermarkStore(job.state_store_path)
+        run_started_at = datetime.datetime.now(datetime.timezone.utc).strftime(
+            "%Y-%m-%dT%H:%M:%S"
+        )
+        watermarks = {
+            location_name: state_store.get(
+                watermark_key(
+                    location_name, job.maxradiuskm, job.start_time, job.end_time
+                )
+            )
+            for location_name in dic_addresses
+        }
+
+    # Destination of the raw and curated loads. Only the rows new or revised
+    # since the last load are loaded, and the daily rollups are updated with
+    # every curated batch and written after the load
+    destination = open_destination(job, dic_addresses, write_lock=write_lock)
+
+    if job.spill:
+        # The curated batches go to disk, or to the sink when spill_load is
+        # progressive, and the extraction yields every window on its own
+        curated_collector = SpillingCollector(
+            columns_to_keep=COLUMNS_TO_KEEP_COMBINED_DATASET,
+            spill_path=os.path.join(job.spill_path, job.name),
+            max_memory_bytes=job.spill_memory_bytes,
+            key_columns=["id", "location"],
+            on_spill=(
+                destination.load_curated if job.spill_load == "progressive" else None
+            ),
+            row_filter=destination.row_filter,
+            rollup=destination.rollup,
+        )
+    else:
+        curated_collector = CuratedCollector(
+            columns_to_keep=COLUMNS_TO_KEEP_COMBINED_DATASET,
+            row_filter=destination.row_filter,
+            rollup=destination.rollup,
+        )
+
+    def load_raw(item):
+        """Loads the raw data of a location. The whole extracted data goes on
+        to the transform, the curated table has its own dedup index."""
+        destination.load_raw(*item)
+        return item
+
+    def transform(item):
+        """Transforms raw to curated and stores it to load on next step."""
+        location_name, extracted_data = item
+        curated_collector.add(location_name=location_name, df=extracted_data)
 
-    # Load raw data to destination
-    push_data_to_bigquery(
-        project_id=project_id,
-        dataset_id=dataset_raw,
-        table_name=location_name,
-        df=extracted_data,
+    # Extract raw data from source, the next regions are downloaded while the
+    # previous ones are loaded and transformed
+    with span("stage", stage="extract_load_transform"):
+        run_pipeline(
+            extraction_engine.iter_extract_locations(
+                dic_addresses=dic_addresses,
+                url_template=url_template,
+                count_url_template=count_url_template,
+                start_time=job.start_time,
+                end_time=job.end_time,
+                maxradiuskm=job.maxradiuskm,
+                limit=job.limit,
+                file_format=job.file_format,
+                max_workers=job.max_workers,
+                requests_per_second=job.requests_per_second,
+                merge_regions=job.merge_regions,
+                watermarks=watermarks,
+                max_pending_units=job.max_pending_windows,
+                stream_windows=job.spill,
+            ),
+            [
+                Stage("load_raw", load_raw, workers=job.load_max_workers),
+                Stage("transform", transform, workers=1),
+            ],
+            queue_size=job.pipeline_queue_size,
+        )
+
+    logger.info(
+        "Push of combined data to the storage, containing the altered dataset with the location"
     )
 
-    # Transform, combine raw to curated and store to load on next step
-    combined_df = combine_transform_data(
-        location_name=location_name,
-        df=extracted_data,
-        columns_to_keep=columns_to_keep_combined_dataset,
-        end_combined_df=combined_df,
+    # Load curated data to destination
+    if job.spill:
+        with span("stage", stage="load_curated"):
+            for df in curated_collector.iter_chunks(chunk_rows=job.load_chunk_rows):
+                destination.load_curated(df)
+        n_rows = len(curated_collector)
+        curated_collector.close()
+    else:
+        with span("stage", stage="combine"):
+            combined_df = curated_collector.result()
+        logger.info(f"Memory used by the curated data:\n{memory_report(combined_df)}")
+        with span("stage", stage="load_curated"):
+            destination.load_curated(combined_df)
+        n_rows = len(combined_df)
+
+    destination.save()
+
+    # Every location is loaded, the next run starts from here
+    if incremental:
+        for location_name in dic_addresses:
+            state_store.set(
+                watermark_key(
+                    location_name, job.maxradiuskm, job.start_time, job.end_time
+                ),
+                run_started_at,
+            )
+
+    logger.info(f"Total rows extracted: {n_rows}.\nExtraction process finished.")
+    log_summary(logger)
+    if job.metrics_path is not None:
+        metrics.write_prometheus(job.metrics_path)
+
+    return n_rows
+
+
+def run_realtime(job, stop=None, max_polls=None):
+    """Polls the real-time feed of the job and loads its new events around
+    the locations in micro-batches, until stop is set. An unchanged feed costs
+    one conditional request, nothing is parsed or written, and the process
+    sleeps between two polls.
+    Args:
+        job: JobConfig
+        stop: optional threading.Event ending the polling, the events already
+            received are loaded first
+        max_polls: optional number of polls after which the polling ends
+    Returns:
+        int: number of curated rows loaded
+    """
+    import threading
+    import time
+
+    import pandas as pd
+    import requests
+    from functions import helper_functions
+    from functions.curated_collector import CuratedCollector
+    from functions.geocoding_cache import GeocodingCache
+    from functions.logger import log_summary, metrics
+    from functions.realtime_feed import FeedPoller, feed_url, locate_events
+    from functions.usgs_schema import restore_categories
+
+    configure_logging(log_format=job.log_format, trace_spans=job.trace_spans)
+    metrics.reset()
+    stop = stop or threading.Event()
+    dic_addresses = helper_functions.get_coordinates(
+        job.locations,
+        cache=GeocodingCache(
+            path=job.geocoding_cache_path, ttl=job.geocoding_cache_ttl
+        ),
     )
+    # Events loaded before a restart are in the dedup index, the first poll
+    # returns the whole feed and only the missing ones are loaded
+    destination = open_destination(job, dic_addresses)
+    poller = FeedPoller(feed_url(job.usgs_base_url, job.realtime_feed))
+    logger.info(
+        f"Polling {poller.url} every {job.realtime_poll_seconds} s for "
+        f"{len(dic_addresses)} locations."
+    )
+
+    def load(batch):
+        """Loads the events of several polls, their last version per location."""
+        frames = {}
+        for location_name, df in batch:
+            frames.setdefault(location_name, []).append(df)
+        collector = CuratedCollector(
+            columns_to_keep=COLUMNS_TO_KEEP_COMBINED_DATASET,
+            row_filter=destination.row_filter,
+            rollup=destination.rollup,
+        )
+        latency = 0.0
+        for location_name, location_frames in frames.items():
+            df = restore_categories(pd.concat(location_frames, ignore_index=True))
+            df = df.drop_duplicates(subset=["id"], keep="last", ignore_index=True)
+            destination.load_raw(location_name, df)
+            collector.add(location_name=location_name, df=df)
+            latency = max(
+                latency,
+                (pd.Timestamp.now(tz="UTC") - df["updated"].min()).total_seconds(),
+            )
+        curated = collector.result()
+        destination.load_curated(curated)
+        # The spatial index is rewritten in full, it is updated on a timer
+        destination.save(spatial_index=False)
+
+        # Time from the publication of the oldest event of the batch to its load
+        metrics.record_span("publication_to_load", latency)
+        logger.info(
+            f"{len(curated)} curated rows loaded, {latency:.1f} s after the "
+            "publication of their events."
+        )
+        if job.metrics_path is not None:
+            metrics.write_prometheus(job.metrics_path)
+        return len(curated)
+
+    pending = []
+    pending_since = None
+    index_saved_at = time.monotonic()
+    n_rows = 0
+    n_polls = 0
+    while not stop.is_set() and (max_polls is None or n_polls < max_polls):
+        started_at = time.monotonic()
+        try:
+            events = poller.poll()
+        except (requests.RequestException, ValueError) as ex:
+            logger.error(f"Polling {poller.url} failed: {ex}")
+            events = None
+        n_polls += 1
+        if events is not None and len(events):
+            located = locate_events(events, dic_addresses, job.maxradiuskm)
+            if located and pending_since is None:
+                pending_since = started_at
+            pending.extend(located.items())
+
+        if pending and time.monotonic() - pending_since >= job.realtime_batch_seconds:
+            try:
+                n_rows += load(pending)
+                pending, pending_since = [], None
+            except Exception:
+                logger.exception("Micro-batch not loaded, it is tried again.")
+        if time.monotonic() - index_saved_at >= job.realtime_index_seconds:
+            try:
+                destination.save_spatial_index()
+                index_saved_at = time.monotonic()
+            except Exception:
+                logger.exception("Spatial index not saved, it is tried again.")
+        if max_polls is None or n_polls < max_polls:
+            stop.wait(
+                max(0, job.realtime_poll_seconds - (time.monotonic() - started_at))
+            )
+
+    if pending:
+        n_rows += load(pending)
+    destination.save_spatial_index()
+    logger.info(f"Real-time polling stopped after {n_polls} polls, {n_rows} rows.")
+    log_summary(logger)
+
+    return n_rows
+
+
+def run_reassign(job):
+    """Loads the curated rows of the locations of a job from the local spatial
+    index instead of USGS, e.g. for a new office or another maxradiuskm. The
+    index holds the events of the earlier runs of the destination. Nothing is
+    requested: the locations missing in the geocoding cache are skipped, and
+    the watermarks are left as they are.
+    Args:
+        job: JobConfig
+    Returns:
+        int: number of curated rows loaded
+    Raises:
+        ValueError: if the job has no spatial index
+    """
+    from functions.geocoding_cache import GeocodingCache
+    from functions.logger import log_summary, metrics, span
+    from functions.spatial_index import SpatialIndex
+
+    configure_logging(log_format=job.log_format, trace_spans=job.trace_spans)
+    metrics.reset()
+    path = spatial_index_path(job)
+    if path is None or not os.path.exists(path):
+        raise ValueError(f"Job {job.name} has no spatial index to assign from.")
+
+    cache = GeocodingCache(path=job.geocoding_cache_path, ttl=job.geocoding_cache_ttl)
+    dic_addresses = {}
+    for location_name, address in job.locations.items():
+        coordinates = cache.get(address)
+        if coordinates is None:
+            logger.warning(
+                f"{location_name} is not in the geocoding cache, it is skipped."
+            )
+            continue
+        dic_addresses[location_name] = coordinates
+    if not dic_addresses:
+        return 0
+
+    destination = open_destination(job, dic_addresses)
+    with span("stage", stage="reassign"):
+        curated = SpatialIndex.load(path).assign_locations(
+            dic_addresses, job.maxradiuskm, job.start_time, job.end_time
+        )
+        if destination.row_filter is not None:
+            curated = destination.row_filter(curated)
+        if destination.rollup is not None:
+            destination.rollup.add(curated)
+    with span("stage", stage="load_curated"):
+        destination.load_curated(curated[COLUMNS_TO_KEEP_COMBINED_DATASET])
+    destination.save()
+
+    logger.info(f"{len(curated)} curated rows assigned from {path}.")
+    log_summary(logger)
+    if job.metrics_path is not None:
+        metrics.write_prometheus(job.metrics_path)
+
+    return len(curated)
+
+
+def run_jobs(jobs):
+    """Runs jobs one after the other, a failed job does not stop the next ones.
+    Args:
+        jobs: JobConfig list
+    Returns:
+        list: names of the failed jobs
+    """
+    failed = []
+    for job in jobs:
+        try:
+            run_job(job)
+        except Exception:
+            logger.exception(f"Job {job.name} failed.")
+            failed.append(job.name)
+
+    return failed
+
+
+def backfill_units(job):
+    """Splits a job in units of one location and backfill_window_days.
+    Args:
+        job: JobConfig
+    Returns:
+        list: (key, settings) of every unit, the settings are the ones of the
+            job with one location and the unit's date range
+    """
+    from functions.query_planner import TIME_FORMAT
+
+    start_time = datetime.datetime.fromisoformat(job.start_time)
+    end_time = datetime.datetime.fromisoformat(job.end_time)
+    step = datetime.timedelta(days=job.backfill_window_days)
+    units = []
+    for location_name, address in job.locations.items():
+        window_start = start_time
+        while window_start < end_time:
+            window_end = min(window_start + step, end_time)
+            unit_job = job._replace(
+                name=f"{job.name}-{location_name}-{window_start:%Y%m%d}",
+                locations={location_name: address},
+                start_time=window_start.strftime(TIME_FORMAT),
+                end_time=window_end.strftime(TIME_FORMAT),
+            )
+            key = (
+                f"{job.name}|{location_name}|{unit_job.start_time}|{unit_job.end_time}"
+            )
+            units.append((key, unit_job._asdict()))
+            window_start = window_end
+
+    return units
+
+
+def work(queue_path, lease_seconds, max_attempts, n_workers=1):
+    """Runs the units of a queue until every one is done or failed. The
+    lease of the running unit is renewed in the background, and the writes
+    to a destination are locked across the workers.
+    Args:
+        queue_path: SQLite file of the queue
+        lease_seconds, max_attempts: settings of the queue
+        n_workers: workers of this host, they share the USGS request rate
+    Returns:
+        int: number of units done by this worker
+    """
+    import threading
+    import time
+
+    from functions.config import DEFAULTS, JobConfig
+    from functions.work_queue import LEASED, WorkQueue, worker_name
+
+    queue = WorkQueue(
+        queue_path, lease_seconds=lease_seconds, max_attempts=max_attempts
+    )
+    owner = worker_name()
+    n_done = 0
+    while True:
+        unit = queue.claim(owner)
+        if unit is None:
+            # Units leased by other workers are claimed again if they fail
+            if not queue.counts().get(LEASED):
+                break
+            time.sleep(min(5, lease_seconds / 10))
+            continue
+
+        job = JobConfig(**{**DEFAULTS, **unit.payload})
+        job = job._replace(requests_per_second=job.requests_per_second / n_workers)
+        logger.info(f"Unit {unit.key}, attempt {unit.attempt}, claimed by {owner}.")
+        stop = threading.Event()
+
+        def renew_lease():
+            while not stop.wait(lease_seconds / 3):
+                if not queue.heartbeat(unit.id, owner):
+                    logger.warning(f"Lease of unit {unit.key} lost.")
+
+        heartbeat = threading.Thread(target=renew_lease, daemon=True)
+        heartbeat.start()
+        started_at = time.perf_counter()
+        try:
+            n_rows = run_job(
+                job,
+                incremental=False,
+                write_lock=lambda: queue.lock(
+                    f"{job.sink_kind}:{destination_root(job)}", owner
+                ),
+            )
+        except KeyboardInterrupt:
+            queue.release(unit.id, owner)
+            raise
+        except Exception as ex:
+            logger.exception(f"Unit {unit.key} failed.")
+            queue.fail(unit.id, owner, error=repr(ex))
+        else:
+            queue.complete(
+                unit.id,
+                owner,
+                checkpoint={
+                    "rows": n_rows,
+                    "seconds": round(time.perf_counter() - started_at, 1),
+                    "owner": owner,
+                },
+            )
+            n_done += 1
+        finally:
+            stop.set()
+            heartbeat.join()
+
+    queue.close()
+    return n_done
+
+
+def run_backfill(jobs, n_workers=1, enqueue=True):
+    """Queues the units of the jobs and runs them with n_workers processes.
+    A backfill started again only runs the units not done yet. Once every
+    unit of a job is done, its incremental runs start from the backfill.
+    Args:
+        jobs: JobConfig list
+        n_workers: number of worker processes of this host
+        enqueue: False to only run the units already queued, e.g. on another
+            host sharing the queue
+    Returns:
+        list: keys of the failed units
+    """
+    from functions.state_store import WatermarkStore, watermark_key
+    from functions.work_queue import DONE, FAILED, WorkQueue
+
+    failed = []
+    for queue_path in dict.fromkeys(job.work_queue_path for job in jobs):
+        queue_jobs = [job for job in jobs if job.work_queue_path == queue_path]
+        settings = queue_jobs[0].lease_seconds, queue_jobs[0].max_attempts
+        queue = WorkQueue(queue_path, *settings)
+        if enqueue:
+            queue.enqueue(unit for job in queue_jobs for unit in backfill_units(job))
+
+        if n_workers <= 1:
+            work(queue_path, *settings)
+        else:
+            with ProcessPoolExecutor(max_workers=n_workers) as pool:
+                futures = [
+                    pool.submit(work, queue_path, *settings, n_workers)
+                    for _ in range(n_workers)
+                ]
+                for future in futures:
+                    future.result()
+
+        logger.info(f"Units of {queue_path}: {queue.counts()}")
+        for job in queue_jobs:
+            units = queue.units(key_prefix=f"{job.name}|")
+            failed.extend(unit["key"] for unit in units if unit["status"] == FAILED)
+            if not units or any(unit["status"] != DONE for unit in units):
+                continue
+            # The events updated after the backfill was queued are extracted
+            # by the next incremental run
+            queued_at = min(unit["created_at"] for unit in units)
+            state_store = WatermarkStore(job.state_store_path)
+            for location_name in job.locations:
+                key = watermark_key(
+                    location_name, job.maxradiuskm, job.start_time, job.end_time
+                )
+                if state_store.get(key) is None:
+                    state_store.set(
+                        key,
+                        datetime.datetime.fromisoformat(queued_at).strftime(
+                            "%Y-%m-%dT%H:%M:%S"
+                        ),
+                    )
+            state_store.close()
+        queue.close()
+
+    return failed
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Extract the earthquakes around the offices and load them."
+    )
+    parser.add_argument(
+        "--config",
+        default=DEFAULT_CONFIG_PATH,
+        help=f"JSON config file (default: {DEFAULT_CONFIG_PATH})",
+    )
+    parser.add_argument(
+        "--job",
+        action="append",
+        dest="job_names",
+        metavar="NAME",
+        help="only run this job of the config, repeatable",
+    )
+    parser.add_argument(
+        "--only-location",
+        action="append",
+        dest="location_names",
+        metavar="NAME",
+        help="only extract this location, repeatable",
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="print the planned queries and destinations, without any request",
+    )
+    parser.add_argument(
+        "--parallel",
+        type=int,
+        default=1,
+        metavar="N",
+        help="number of jobs run at once, jobs writing the same tables still "
+        "run one after the other (default: 1)",
+    )
+    parser.add_argument(
+        "--backfill",
+        action="store_true",
+        help="split the jobs in units of one location and backfill_window_days, "
+        "queue them in work_queue_path and run them, a backfill started again "
+        "only runs the units not done",
+    )
+    parser.add_argument(
+        "--worker",
+        action="store_true",
+        help="only run the units already queued, e.g. on another host sharing "
+        "work_queue_path",
+    )
+    parser.add_argument(
+        "--realtime",
+        action="store_true",
+        help="poll the USGS real-time feed of the job and load its new events "
+        "until interrupted, see the realtime_ settings",
+    )
+    parser.add_argument(
+        "--reassign",
+        action="store_true",
+        help="load the curated rows of the locations from the local spatial "
+        "index of earlier runs, without any USGS request",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        metavar="N",
+        help="number of worker processes of --backfill and --worker (default: 1)",
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    # USGS_BASE_URL points the extraction to another server, e.g. the
+    # benchmark stub of bench/stub_usgs.py
+    overrides = {}
+    if os.environ.get("USGS_BASE_URL"):
+        overrides["usgs_base_url"] = os.environ["USGS_BASE_URL"]
+    jobs = load_jobs(args.config, overrides=overrides)
+
+    if args.job_names:
+        unknown = sorted(set(args.job_names) - {job.name for job in jobs})
+        if unknown:
+            raise SystemExit(f"Unknown jobs in {args.config}: {', '.join(unknown)}")
+        jobs = [job for job in jobs if job.name in args.job_names]
+    if args.location_names:
+        try:
+            jobs = select_locations(jobs, args.location_names)
+        except ValueError as ex:
+            raise SystemExit(str(ex))
+
+    if args.dry_run:
+        for job in jobs:
+            plan_job(job)
+        return 0
+
+    configure_logging(log_format=jobs[0].log_format, trace_spans=jobs[0].trace_spans)
+    if args.realtime:
+        import signal
+        import threading
+
+        if len(jobs) != 1:
+            raise SystemExit("--realtime runs a single job, select it with --job")
+        # Ctrl-C and SIGTERM load the events received and stop
+        stop = threading.Event()
+        for signal_number in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signal_number, lambda *_: stop.set())
+        run_realtime(jobs[0], stop=stop)
+        return 0
+
+    if args.reassign:
+        try:
+            for job in jobs:
+                run_reassign(job)
+        except ValueError as ex:
+            raise SystemExit(str(ex))
+        return 0
+
+    if args.backfill or args.worker:
+        failed = run_backfill(jobs, n_workers=args.workers, enqueue=args.backfill)
+        if failed:
+            logger.error(f"Failed units: {', '.join(failed)}")
+            return 1
+        return 0
+
+    groups = group_jobs(jobs)
+    if args.parallel <= 1 or len(groups) == 1:
+        failed = run_jobs(jobs)
+    else:
+        logger.info(
+            f"Running {len(jobs)} jobs in {len(groups)} groups, "
+            f"{args.parallel} at once."
+        )
+        with ProcessPoolExecutor(max_workers=min(args.parallel, len(groups))) as pool:
+            failed = [
+                name
+                for group_failed in pool.map(run_jobs, groups)
+                for name in group_failed
+            ]
 
-logger.info(
-    "Push of combined data to the storage, containing the altered dataset with the location"
-)
+    if failed:
+        logger.error(f"Failed jobs: {', '.join(failed)}")
+        return 1
+    return 0
 
-# Load curated data to destination
-push_data_to_bigquery(
-    project_id=project_id,
-    dataset_id=dataset_curated,
-    table_name="earthquakes",
-    df=combined_df,
-)
 
-logger.info(f"Total rows extracted: {len(combined_df)}.\nExtraction process finished.")
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,80 @@
+"""Benchmark of the hashed_id computation.
+
+Run from the repository root:
+    python -m bench.bench_hashed_id --rows 1000000
+"""
+
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+from functions.helper_functions import compute_hashed_id
+
+
+def synthetic_frame(n_rows, seed=0):
+    """Creates a frame shaped like a curated USGS extraction."""
+    rng = np.random.default_rng(seed)
+    times = pd.Timestamp("2020-01-01", tz="UTC") + pd.to_timedelta(
+        rng.integers(0, 4 * 365 * 86400, n_rows), unit="s"
+    )
+    return pd.DataFrame(
+        {
+            "id": [f"us{i:010d}" for i in range(n_rows)],
+            "time": times,
+            "updated": times + pd.Timedelta(days=1),
+            "latitude": rng.uniform(-90, 90, n_rows),
+            "longitude": rng.uniform(-180, 180, n_rows),
+            "depth": rng.uniform(0, 700, n_rows),
+            "mag": rng.uniform(0, 8, n_rows).round(1),
+            "magType": pd.Categorical(rng.choice(["ml", "mb", "mw", "md"], n_rows)),
+            "place": rng.choice(["10 km N of A", "5 km S of B", "Somewhere"], n_rows),
+            "type": pd.Categorical(["earthquake"] * n_rows),
+            "status": pd.Categorical(rng.choice(["reviewed", "automatic"], n_rows)),
+            "location": "pleo_dk",
+        }
+    )
+
+
+def legacy_hashed_id(df):
+    """Row by row hash used before compute_hashed_id."""
+    return df.apply(
+        lambda x: hash(tuple(x[col] for col in df.columns if col != "id")), axis=1
+    )
+
+
+def measure(function, df):
+    started_at = time.perf_counter()
+    function(df)
+    elapsed = time.perf_counter() - started_at
+    return elapsed, len(df) / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument(
+        "--legacy-rows",
+        type=int,
+        default=50_000,
+        help="rows used for the row by row hash, which is too slow for --rows",
+    )
+    args = parser.parse_args()
+
+    df = synthetic_frame(args.rows)
+    elapsed, rows_per_sec = measure(compute_hashed_id, df)
+    print(
+        f"compute_hashed_id  {args.rows:>10,} rows  {elapsed:8.3f} s  {rows_per_sec:>14,.0f} rows/s"
+    )
+
+    legacy_df = df.head(args.legacy_rows)
+    elapsed, legacy_rows_per_sec = measure(legacy_hashed_id, legacy_df)
+    print(
+        f"legacy apply(hash) {len(legacy_df):>10,} rows  {elapsed:8.3f} s  {legacy_rows_per_sec:>14,.0f} rows/s"
+    )
+
+    print(f"speedup: {rows_per_sec / legacy_rows_per_sec:,.0f}x")
+
+
+if __name__ == "__main__":
+    main()
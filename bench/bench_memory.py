@@ -0,0 +1,60 @@
+"""Memory used by the extracted and curated frames, per column.
+
+Compares the frames read with pandas' inferred dtypes, as the extraction did
+originally, with the compact USGS_DTYPES schema. Run from the repository root:
+    python -m bench.bench_memory --events 1000000
+"""
+
+import argparse
+import datetime
+import io
+
+import pandas as pd
+from bench.stub_usgs import Catalog
+from functions.helper_functions import transform_data
+from functions.usgs_schema import USGS_DTYPES, memory_report, parse_time_columns
+
+
+def legacy_frame(csv, location_name):
+    """Frame as built by the original extraction and combine_transform_data."""
+    df = pd.read_csv(io.StringIO(csv))
+    df["location"] = location_name
+    df["inserted_at"] = [datetime.datetime.now()] * len(df)
+    return df
+
+
+def compact_frame(csv, location_name):
+    df = parse_time_columns(pd.read_csv(io.StringIO(csv), dtype=USGS_DTYPES))
+    return transform_data(location_name, df).drop(columns="hashed_id")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--events", type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    catalog = Catalog(args.events)
+    csv = catalog.header + "".join(catalog.lines)
+
+    legacy = memory_report(legacy_frame(csv, "pleo_dk"))
+    compact = memory_report(compact_frame(csv, "pleo_dk"))
+    report = pd.DataFrame(
+        {
+            "legacy dtype": legacy["dtype"],
+            "legacy B/row": legacy["bytes_per_row"],
+            "compact dtype": compact["dtype"],
+            "compact B/row": compact["bytes_per_row"],
+        }
+    ).sort_values("legacy B/row", ascending=False)
+
+    with pd.option_context("display.float_format", "{:,.1f}".format):
+        print(report.to_string())
+    ratio = legacy.loc["total", "bytes"] / compact.loc["total", "bytes"]
+    print(
+        f"{args.events:,} events: {legacy.loc['total', 'bytes'] / 1024**2:,.0f} MB "
+        f"-> {compact.loc['total', 'bytes'] / 1024**2:,.0f} MB ({ratio:.1f}x smaller)"
+    )
+
+
+if __name__ == "__main__":
+    main()
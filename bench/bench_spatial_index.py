@@ -0,0 +1,74 @@
+"""Build and query times of the spatial index of the curated events.
+
+Run from the repository root:
+    python -m bench.bench_spatial_index --events 1000000
+"""
+
+import argparse
+import io
+import time
+
+import numpy as np
+import pandas as pd
+from bench.stub_usgs import Catalog
+from functions.spatial_index import SpatialIndex
+from functions.usgs_schema import USGS_DTYPES, parse_time_columns
+
+OFFICES = {
+    "pleo_dk": [55.69, 12.56],
+    "pleo_de": [52.52, 13.41],
+    "pleo_es": [40.42, -3.70],
+    "pleo_pt": [38.71, -9.14],
+    "pleo_ca": [45.50, -73.57],
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--events", type=int, default=1_000_000)
+    parser.add_argument("--radiuskm", type=float, default=500)
+    parser.add_argument("--cell-degrees", type=float, default=1.0)
+    parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+
+    catalog = Catalog(args.events)
+    events = parse_time_columns(
+        pd.read_csv(
+            io.StringIO(catalog.header + "".join(catalog.lines)), dtype=USGS_DTYPES
+        )
+    )
+
+    started_at = time.perf_counter()
+    index = SpatialIndex(events, cell_degrees=args.cell_degrees)
+    print(f"build: {time.perf_counter() - started_at:.2f} s for {len(index):,} events")
+
+    rng = np.random.default_rng(0)
+    latencies, n_rows = [], 0
+    for _ in range(args.queries):
+        name = rng.choice(list(OFFICES))
+        start = pd.Timestamp("2020-01-01") + pd.Timedelta(
+            days=int(rng.integers(0, 1000))
+        )
+        started_at = time.perf_counter()
+        result = index.query(
+            *OFFICES[name], args.radiuskm, start, start + pd.Timedelta(days=365)
+        )
+        latencies.append(time.perf_counter() - started_at)
+        n_rows += len(result)
+    latencies = np.array(latencies) * 1000
+    print(
+        f"query: p50 {np.percentile(latencies, 50):.1f} ms, "
+        f"p95 {np.percentile(latencies, 95):.1f} ms, "
+        f"{n_rows / args.queries:,.0f} events per query"
+    )
+
+    started_at = time.perf_counter()
+    curated = index.assign_locations(OFFICES, args.radiuskm)
+    print(
+        f"assign_locations: {time.perf_counter() - started_at:.2f} s for "
+        f"{len(curated):,} rows of {len(OFFICES)} locations"
+    )
+
+
+if __name__ == "__main__":
+    main()
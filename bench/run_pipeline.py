@@ -0,0 +1,366 @@
+"""End to end benchmark of app.py against the stub USGS server.
+
+Every run executes app.py in a fresh process and working directory, with the
+fake geocoder and the chosen sink, and reports the wall time, peak RSS and
+per-stage throughput. The stages overlap, the time of a stage is the time
+spent in it, so the stage times may add up to more than the wall time.
+Results are compared to bench/baselines.json.
+
+Run from the repository root:
+    python -m bench.run_pipeline --events 200000
+    python -m bench.run_pipeline --events 200000 --save-baseline
+"""
+
+import argparse
+import json
+import os
+import resource
+import runpy
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_PATH = os.path.join(REPO_ROOT, "app.py")
+CONFIG_PATH = os.path.join(REPO_ROOT, "config.json")
+BASELINES_PATH = os.path.join(REPO_ROOT, "bench", "baselines.json")
+STAGES = ["geocode", "extract", "transform", "load"]
+MIN_STAGE_SECONDS = 0.05
+
+
+def app_locations():
+    """Reads the locations of the default config of app.py."""
+    with open(CONFIG_PATH) as file:
+        return json.load(file)["locations"]
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def frame_mb(frames):
+    return sum(df.memory_usage(deep=True).sum() for df in frames if df is not None) / (
+        1024**2
+    )
+
+
+class StageRecorder:
+    """Accumulates the time, rows and bytes of every stage."""
+
+    def __init__(self):
+        # The stages run in parallel, the load one in several threads
+        self._lock = threading.Lock()
+        self.stages = {
+            stage: {"seconds": 0.0, "rows": 0, "mb": 0.0, "peak_rss_mb": 0.0}
+            for stage in STAGES
+        }
+
+    def timed(self, stage, function, measure=None):
+        """Wraps function so that its calls are accounted to stage.
+        Args:
+            stage: name of the stage
+            function: function to wrap
+            measure: optional function of (args, kwargs, result) returning the
+                (rows, mb) processed by the call, run outside of the timing
+        """
+
+        def wrapper(*args, **kwargs):
+            started_at = time.perf_counter()
+            result = function(*args, **kwargs)
+            elapsed = time.perf_counter() - started_at
+            rows, mb = measure(args, kwargs, result) if measure else (0, 0.0)
+            self.add(stage, rows, mb, elapsed)
+            return result
+
+        return wrapper
+
+    def add(self, stage, rows, mb, seconds=0.0):
+        """Adds rows and mb processed in seconds to stage."""
+        with self._lock:
+            record = self.stages[stage]
+            record["seconds"] += seconds
+            record["rows"] += rows
+            record["mb"] += mb
+            record["peak_rss_mb"] = peak_rss_mb()
+
+    def summary(self):
+        summary = {}
+        for stage, record in self.stages.items():
+            seconds = record["seconds"]
+            summary[stage] = {
+                **record,
+                "rows_per_sec": record["rows"] / seconds if seconds else 0.0,
+                "mb_per_sec": record["mb"] / seconds if seconds else 0.0,
+            }
+        return summary
+
+
+class TimedSink:
+    """Accounts the writes of a sink to the load stage."""
+
+    def __init__(self, sink, recorder):
+        self.sink = sink
+        self.write = recorder.timed(
+            "load",
+            sink.write,
+            lambda call_args, _, __: (len(call_args[0]), frame_mb(call_args[:1])),
+        )
+
+
+def run_app(args):
+    """Runs the jobs of config.json through app.py in this process with the
+    benchmark doubles, then writes the metrics to args.metrics_out."""
+    from bench.fakes import FakeGeocoder, NullSink
+    from functions import curated_collector, extraction_engine, helper_functions
+    from functions import sinks
+
+    recorder = StageRecorder()
+    helper_functions.ArcGIS = FakeGeocoder
+
+    helper_functions.get_coordinates = recorder.timed(
+        "geocode",
+        helper_functions.get_coordinates,
+        lambda _, __, result: (len(result), 0.0),
+    )
+
+    iter_extract_locations = extraction_engine.iter_extract_locations
+
+    def extract(**kwargs):
+        """Accounts the time spent waiting for every extracted location, which
+        leaves out the time the pipeline holds the extraction back."""
+        if args.requests_per_second:
+            kwargs["requests_per_second"] = args.requests_per_second
+        # The stub counts the bytes of every run, keep the ones of this one
+        bytes_before = stub_stats(args.base_url)["bytes"]
+        locations = iter_extract_locations(**kwargs)
+        next_location = recorder.timed(
+            "extract",
+            lambda: next(locations, None),
+            lambda _, __, item: (len(item[1]) if item is not None else 0, 0.0),
+        )
+        while (item := next_location()) is not None:
+            yield item
+        recorder.add(
+            "extract",
+            0,
+            (stub_stats(args.base_url)["bytes"] - bytes_before) / (1024**2),
+        )
+
+    extraction_engine.iter_extract_locations = extract
+
+    collector = curated_collector.CuratedCollector
+    collector.add = recorder.timed(
+        "transform",
+        collector.add,
+        lambda call_args, kwargs, _: (
+            len(kwargs["df"]) if kwargs.get("df") is not None else 0,
+            frame_mb([kwargs.get("df")]),
+        ),
+    )
+    collector.result = recorder.timed("transform", collector.result)
+
+    def build_sink(*_, **__):
+        if args.sink == "parquet":
+            sink = sinks.ParquetSink(root=os.path.join(args.workdir, "data"))
+        else:
+            sink = NullSink(latency=args.load_latency)
+        return TimedSink(sink, recorder)
+
+    sinks.build_sink = build_sink
+
+    os.environ["USGS_BASE_URL"] = args.base_url
+    os.chdir(args.workdir)
+    started_at = time.perf_counter()
+    # config.json with the settings of the scenario
+    with open(CONFIG_PATH) as file:
+        config = json.load(file)
+    config.update(parse_settings(args.setting))
+    config_path = os.path.join(args.workdir, "config.json")
+    with open(config_path, "w") as file:
+        json.dump(config, file)
+    exit_code = runpy.run_path(APP_PATH)["main"](["--config", config_path])
+    wall = time.perf_counter() - started_at
+    if exit_code != 0:
+        raise RuntimeError(f"app.py failed with exit code {exit_code}")
+
+    with open(args.metrics_out, "w") as file:
+        json.dump(
+            {
+                "wall_s": wall,
+                "peak_rss_mb": peak_rss_mb(),
+                "stages": recorder.summary(),
+            },
+            file,
+        )
+
+
+def parse_settings(settings):
+    """Parses KEY=VALUE settings, VALUE being JSON or a plain string."""
+    parsed = {}
+    for setting in settings or []:
+        key, _, value = setting.partition("=")
+        try:
+            parsed[key] = json.loads(value)
+        except json.JSONDecodeError:
+            parsed[key] = value
+    return parsed
+
+
+def stub_stats(base_url):
+    return requests.get(f"{base_url}/stats", timeout=10).json()
+
+
+def scenario_name(args):
+    return (
+        f"events={args.events},latency={args.latency},"
+        f"error_rate={args.error_rate},sink={args.sink}"
+        + (f",load_latency={args.load_latency}" if args.load_latency else "")
+        + "".join(f",{setting}" for setting in args.setting or [])
+    )
+
+
+def compare(metrics, baseline, tolerance):
+    """Lists the metrics worse than the baseline by more than tolerance."""
+    regressions = []
+    for key in ("wall_s", "peak_rss_mb"):
+        if metrics[key] > baseline[key] * (1 + tolerance):
+            regressions.append(f"{key}: {metrics[key]:.2f} vs {baseline[key]:.2f}")
+    for stage, record in metrics["stages"].items():
+        expected = baseline["stages"].get(stage, {})
+        # Stages faster than MIN_STAGE_SECONDS are too noisy to compare
+        if expected.get("seconds", 0) < MIN_STAGE_SECONDS:
+            continue
+        expected = expected["rows_per_sec"]
+        if record["rows_per_sec"] < expected * (1 - tolerance):
+            regressions.append(
+                f"{stage} rows/s: {record['rows_per_sec']:,.0f} vs {expected:,.0f}"
+            )
+    return regressions
+
+
+def report(run, metrics):
+    print(
+        f"run {run}: wall {metrics['wall_s']:.2f} s, "
+        f"peak RSS {metrics['peak_rss_mb']:.0f} MB"
+    )
+    for stage, record in metrics["stages"].items():
+        print(
+            f"  {stage:<10}{record['seconds']:8.2f} s{record['rows']:>12,} rows"
+            f"{record['rows_per_sec']:>14,.0f} rows/s{record['mb_per_sec']:>10.1f} MB/s"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--events", type=int, default=200_000)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--sink", choices=["null", "parquet"], default="null")
+    parser.add_argument(
+        "--load-latency",
+        type=float,
+        default=0.0,
+        help="seconds taken by every write of the null sink",
+    )
+    parser.add_argument(
+        "--requests-per-second",
+        type=float,
+        default=1000,
+        help="overrides the USGS rate limit of app.py, 0 keeps it",
+    )
+    parser.add_argument(
+        "--runs",
+        type=int,
+        default=1,
+        help="runs sharing a working directory, the later ones are warm",
+    )
+    parser.add_argument(
+        "--setting",
+        action="append",
+        metavar="KEY=VALUE",
+        help="overrides a setting of config.json, e.g. spill=true, repeatable",
+    )
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    parser.add_argument("--save-baseline", action="store_true")
+    # Internal, used by the child processes running app.py
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--base-url", help=argparse.SUPPRESS)
+    parser.add_argument("--workdir", help=argparse.SUPPRESS)
+    parser.add_argument("--metrics-out", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_app(args)
+        return
+
+    from bench.fakes import FakeGeocoder
+    from bench.stub_usgs import start_in_process
+
+    geocoder = FakeGeocoder()
+    centers = [tuple(geocoder.geocode(address)) for address in app_locations().values()]
+    base_url, server = start_in_process(
+        {"n_events": args.events, "centers": centers, "seed": args.seed},
+        latency=args.latency,
+        error_rate=args.error_rate,
+        seed=args.seed,
+    )
+
+    results = []
+    try:
+        with tempfile.TemporaryDirectory() as workdir:
+            for run in range(1, args.runs + 1):
+                metrics_out = os.path.join(workdir, f"metrics-{run}.json")
+                child = [
+                    sys.executable,
+                    "-m",
+                    "bench.run_pipeline",
+                    "--child",
+                    f"--base-url={base_url}",
+                    f"--workdir={workdir}",
+                    f"--metrics-out={metrics_out}",
+                    f"--sink={args.sink}",
+                    f"--load-latency={args.load_latency}",
+                    f"--requests-per-second={args.requests_per_second}",
+                    *(f"--setting={setting}" for setting in args.setting or []),
+                ]
+                subprocess.run(
+                    child, cwd=REPO_ROOT, check=True, stdout=subprocess.DEVNULL
+                )
+                with open(metrics_out) as file:
+                    metrics = json.load(file)
+                report(run, metrics)
+                results.append(metrics)
+    finally:
+        server.terminate()
+
+    name = scenario_name(args)
+    baselines = {}
+    if os.path.exists(BASELINES_PATH):
+        with open(BASELINES_PATH) as file:
+            baselines = json.load(file)
+
+    # The first run is cold, it is the one compared to the baseline
+    if args.save_baseline:
+        baselines[name] = results[0]
+        with open(BASELINES_PATH, "w") as file:
+            json.dump(baselines, file, indent=2, sort_keys=True)
+            file.write("\n")
+        print(f"Saved baseline {name}")
+    elif name in baselines:
+        regressions = compare(results[0], baselines[name], args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+        print(f"No regression against baseline {name}")
+    else:
+        print(f"No baseline for {name}, save one with --save-baseline")
+
+
+if __name__ == "__main__":
+    main()
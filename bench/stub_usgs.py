@@ -0,0 +1,457 @@
+"""Local HTTP server imitating the USGS query and count endpoints and the
+real-time summary feeds.
+
+It serves a seeded synthetic catalog, so every run with the same arguments
+returns the same events. The feeds serve the events published to the
+server's LiveFeed, e.g. one every --feed-interval seconds. Run it alone from
+the repository root with:
+    python -m bench.stub_usgs --events 200000 --port 8080
+    python -m bench.stub_usgs --events 1000 --feed-interval 5
+"""
+
+import argparse
+import gzip
+import json
+import multiprocessing
+import random
+import threading
+import time
+from email.utils import formatdate, parsedate_to_datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+import numpy as np
+import pandas as pd
+
+# Column order of https://earthquake.usgs.gov/fdsnws/event/1/query?format=csv
+USGS_COLUMNS = [
+    "time",
+    "latitude",
+    "longitude",
+    "depth",
+    "mag",
+    "magType",
+    "nst",
+    "gap",
+    "dmin",
+    "rms",
+    "net",
+    "id",
+    "updated",
+    "place",
+    "type",
+    "horizontalError",
+    "depthError",
+    "magError",
+    "magNst",
+    "status",
+    "locationSource",
+    "magSource",
+]
+
+EARTH_RADIUS_KM = 6371.0
+
+
+class Catalog:
+    """Synthetic events sorted by time descending, like the USGS answers.
+    Args:
+        n_events: number of events
+        start_time, end_time: ISO8601 range of the event times
+        centers: (latitude, longitude) around which hotspot_share of the
+            events are drawn, the rest is spread over the globe
+        hotspot_share: share of the events drawn around the centers
+        seed: seed of the random generator
+    """
+
+    def __init__(
+        self,
+        n_events,
+        start_time="2020-01-01",
+        end_time="2024-01-01",
+        centers=(),
+        hotspot_share=0.7,
+        seed=0,
+    ):
+        rng = np.random.default_rng(seed)
+        start = np.datetime64(start_time, "s").astype("int64")
+        end = np.datetime64(end_time, "s").astype("int64")
+        times = np.sort(rng.integers(start, end, n_events))[::-1]
+
+        latitudes = rng.uniform(-90, 90, n_events)
+        longitudes = rng.uniform(-180, 180, n_events)
+        if centers:
+            hotspot = rng.random(n_events) < hotspot_share
+            picked = np.asarray(centers)[rng.integers(0, len(centers), n_events)]
+            latitudes = np.where(
+                hotspot,
+                np.clip(picked[:, 0] + rng.normal(0, 3, n_events), -90, 90),
+                latitudes,
+            )
+            longitudes = np.where(
+                hotspot,
+                (picked[:, 1] + rng.normal(0, 3, n_events) + 180) % 360 - 180,
+                longitudes,
+            )
+        updated = times + rng.exponential(30 * 86400, n_events).astype("int64")
+
+        self.times = times
+        self.updated = updated
+        self.radians = np.radians(np.column_stack([latitudes, longitudes]))
+        self.lines = self._render(rng, times, updated, latitudes, longitudes)
+        self.header = ",".join(USGS_COLUMNS) + "\n"
+
+    @staticmethod
+    def _render(rng, times, updated, latitudes, longitudes):
+        """Formats every event once as a csv line, the requests only select them."""
+        n_events = len(times)
+
+        def iso(seconds):
+            millis = rng.integers(0, 1000, n_events)
+            return pd.Series(
+                pd.to_datetime(seconds, unit="s").strftime("%Y-%m-%dT%H:%M:%S")
+            ) + pd.Series(millis).map(".{:03d}Z".format)
+
+        df = pd.DataFrame(
+            {
+                "time": iso(times),
+                "latitude": latitudes.round(4),
+                "longitude": longitudes.round(4),
+                "depth": rng.uniform(0, 700, n_events).round(2),
+                "mag": rng.uniform(0, 8, n_events).round(1),
+                "magType": rng.choice(["ml", "mb", "mww", "md"], n_events),
+                "nst": rng.integers(0, 200, n_events),
+                "gap": rng.uniform(0, 360, n_events).round(0),
+                "dmin": rng.uniform(0, 20, n_events).round(3),
+                "rms": rng.uniform(0, 2, n_events).round(2),
+                "net": rng.choice(["us", "ci", "ak", "nc"], n_events),
+                "id": [f"bench{i:09d}" for i in range(n_events)],
+                "updated": iso(updated),
+                "place": rng.choice(
+                    ["10 km N of Alpha", "25 km SSW of Beta, Gamma", "Delta region"],
+                    n_events,
+                ),
+                "type": "earthquake",
+                "horizontalError": rng.uniform(0, 10, n_events).round(2),
+                "depthError": rng.uniform(0, 10, n_events).round(3),
+                "magError": rng.uniform(0, 1, n_events).round(3),
+                "magNst": rng.integers(0, 100, n_events),
+                "status": rng.choice(["reviewed", "automatic"], n_events),
+                "locationSource": "us",
+                "magSource": "us",
+            },
+            columns=USGS_COLUMNS,
+        )
+
+        return np.array(df.to_csv(index=False, header=False).splitlines(True))
+
+    def select(self, params):
+        """Returns the positions of the events matching the query parameters."""
+
+        def seconds(value):
+            return np.datetime64(value.rstrip("Z"), "s").astype("int64")
+
+        mask = np.ones(len(self.times), dtype=bool)
+        if "starttime" in params:
+            mask &= self.times >= seconds(params["starttime"])
+        if "endtime" in params:
+            mask &= self.times <= seconds(params["endtime"])
+        if "updatedafter" in params:
+            mask &= self.updated > seconds(params["updatedafter"])
+        if "latitude" in params and "maxradiuskm" in params:
+            latitude, longitude = np.radians(
+                [float(params["latitude"]), float(params["longitude"])]
+            )
+            # Haversine distance to the center of the circle
+            a = (
+                np.sin((self.radians[:, 0] - latitude) / 2) ** 2
+                + np.cos(latitude)
+                * np.cos(self.radians[:, 0])
+                * np.sin((self.radians[:, 1] - longitude) / 2) ** 2
+            )
+            distances = 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+            mask &= distances <= float(params["maxradiuskm"])
+
+        return np.flatnonzero(mask)
+
+
+class LiveFeed:
+    """Events of the real-time summary feeds, served as GeoJSON with an ETag
+    and a Last-Modified date, both changed by every publish(). Every feed
+    name serves the same events.
+    Args:
+        window_seconds: events older than this leave the feed, like all_hour
+        seed: seed of random_events
+    """
+
+    def __init__(self, window_seconds=3600, seed=0):
+        self.window_seconds = window_seconds
+        self.random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._features = {}
+        self._version = 0
+        self._render()
+
+    def publish(self, events):
+        """Adds events to the feed, an event with the id of a published one
+        replaces it, like a revision.
+        Args:
+            events: dicts with id, latitude, longitude, depth and mag, and
+                optionally time and updated in epoch seconds, now by default
+        """
+        now = time.time()
+        with self._lock:
+            for event in events:
+                event_time = event.get("time", now)
+                self._features[event["id"]] = {
+                    "type": "Feature",
+                    "id": event["id"],
+                    "properties": {
+                        "mag": event["mag"],
+                        "place": event.get("place", "10 km N of Alpha"),
+                        "time": int(event_time * 1000),
+                        "updated": int(event.get("updated", now) * 1000),
+                        "status": event.get("status", "automatic"),
+                        "net": event["id"][:2],
+                        "nst": None,
+                        "dmin": None,
+                        "rms": 0.5,
+                        "gap": None,
+                        "magType": "ml",
+                        "type": "earthquake",
+                    },
+                    "geometry": {
+                        "type": "Point",
+                        "coordinates": [
+                            event["longitude"],
+                            event["latitude"],
+                            event["depth"],
+                        ],
+                    },
+                }
+            self._features = {
+                key: feature
+                for key, feature in self._features.items()
+                if feature["properties"]["time"] >= (now - self.window_seconds) * 1000
+            }
+            self._version += 1
+            self._render()
+
+    def random_events(self, n_events, centers=((50.0, 10.0),), spread=3.0):
+        """Draws n_events events happening now around the centers."""
+        events = []
+        for _ in range(n_events):
+            latitude, longitude = self.random.choice(centers)
+            events.append(
+                {
+                    "id": f"us{self.random.getrandbits(40):010x}",
+                    "latitude": round(latitude + self.random.gauss(0, spread), 4),
+                    "longitude": round(longitude + self.random.gauss(0, spread), 4),
+                    "depth": round(self.random.uniform(0, 100), 2),
+                    "mag": round(self.random.uniform(0, 6), 1),
+                }
+            )
+        return events
+
+    def _render(self):
+        features = sorted(
+            self._features.values(), key=lambda feature: -feature["properties"]["time"]
+        )
+        self.body = json.dumps(
+            {
+                "type": "FeatureCollection",
+                "metadata": {"generated": int(time.time() * 1000)},
+                "features": features,
+            }
+        ).encode()
+        self.etag = f'"{self._version}"'
+        self.modified_at = time.time()
+        self.last_modified = formatdate(self.modified_at, usegmt=True)
+
+    def response(self, headers):
+        """Status, body and headers of a request with the given headers."""
+        with self._lock:
+            if headers.get("If-None-Match") == self.etag or (
+                headers.get("If-None-Match") is None
+                and headers.get("If-Modified-Since")
+                and parsedate_to_datetime(headers["If-Modified-Since"]).timestamp()
+                >= int(self.modified_at)
+            ):
+                return 304, b"", {"ETag": self.etag}
+            return (
+                200,
+                self.body,
+                {
+                    "Content-Type": "application/json",
+                    "ETag": self.etag,
+                    "Last-Modified": self.last_modified,
+                },
+            )
+
+
+class StubUsgsHandler(BaseHTTPRequestHandler):
+    """Answers /fdsnws/event/1/query, /fdsnws/event/1/count, the summary feeds
+    under /earthquakes/feed/v1.0/summary/ and /stats."""
+
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        server = self.server
+        parts = urlsplit(self.path)
+        if parts.path == "/stats":
+            with server.stats_lock:
+                self._send(200, json.dumps(server.stats).encode(), count=False)
+            return
+
+        time.sleep(server.latency)
+        with server.stats_lock:
+            failed = server.random.random() < server.error_rate
+        if failed:
+            self._send(503, b"Service Unavailable", headers={"Retry-After": "0"})
+            return
+
+        if parts.path.startswith("/earthquakes/feed/v1.0/summary/"):
+            status, body, headers = server.feed.response(self.headers)
+            self._send(status, body, headers=headers)
+            return
+
+        params = dict(parse_qsl(parts.query))
+        selected = server.catalog.select(params)
+        if parts.path.endswith("/count"):
+            self._send(200, str(len(selected)).encode())
+        elif parts.path.endswith("/query"):
+            limit = int(params.get("limit", 20000))
+            if len(selected) > limit:
+                message = (
+                    f"Error 400: Bad Request\n\n{len(selected)} matching events "
+                    f"exceeds search limit of {limit}. Modify the search to match "
+                    "fewer events.\n"
+                )
+                self._send(400, message.encode())
+                return
+            if not len(selected):
+                # As USGS, nodata sets the status of a query without any event
+                self._send(int(params.get("nodata", 204)), b"")
+                return
+            body = server.catalog.header + "".join(server.catalog.lines[selected])
+            self._send(200, body.encode(), rows=len(selected))
+        else:
+            self._send(404, b"Not Found")
+
+    def _send(self, status, body, headers=None, rows=0, count=True):
+        if body and "gzip" in (self.headers.get("Accept-Encoding") or ""):
+            body = gzip.compress(body, compresslevel=5)
+            headers = {**(headers or {}), "Content-Encoding": "gzip"}
+        # Counted before the response is sent, the stats are final once the
+        # client has it
+        if count:
+            with self.server.stats_lock:
+                stats = self.server.stats
+                stats["requests"] += 1
+                stats["errors"] += status >= 400
+                stats["not_modified"] += status == 304
+                stats["rows"] += rows
+                stats["bytes"] += len(body)
+        self.send_response(status)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        if status != 204:  # a 204 has neither a body nor a length
+            self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def build_server(catalog, port=0, latency=0.0, error_rate=0.0, seed=0, feed=None):
+    """Creates the stub server, not started yet.
+    Args:
+        catalog: Catalog served
+        feed: LiveFeed of the summary feeds, an empty one by default
+        port: port to listen on, 0 for any free port
+        latency: seconds slept before answering every request
+        error_rate: share of the requests answered with a 503
+        seed: seed of the error draws
+    Returns:
+        Object: a ThreadingHTTPServer
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", port), StubUsgsHandler)
+    server.daemon_threads = True
+    server.catalog = catalog
+    server.feed = feed if feed is not None else LiveFeed(seed=seed)
+    server.latency = latency
+    server.error_rate = error_rate
+    server.random = random.Random(seed)
+    server.stats = {
+        "requests": 0,
+        "errors": 0,
+        "not_modified": 0,
+        "rows": 0,
+        "bytes": 0,
+    }
+    server.stats_lock = threading.Lock()
+
+    return server
+
+
+def _serve(ready, catalog_options, server_options):
+    server = build_server(Catalog(**catalog_options), **server_options)
+    ready.put(server.server_port)
+    server.serve_forever()
+
+
+def start_in_process(catalog_options, **server_options):
+    """Builds the catalog and runs the server in a child process, so that it
+    does not weigh on the memory and the CPU of the measured pipeline.
+    Args:
+        catalog_options: Catalog arguments
+        server_options: build_server arguments, except catalog
+    Returns:
+        tuple: (base url, Process)
+    """
+    ready = multiprocessing.Queue()
+    process = multiprocessing.Process(
+        target=_serve, args=(ready, catalog_options, server_options), daemon=True
+    )
+    process.start()
+    port = ready.get(timeout=600)
+
+    return f"http://127.0.0.1:{port}", process
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--events", type=int, default=200_000)
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--feed-interval",
+        type=float,
+        default=0.0,
+        help="seconds between two events published to the feeds, 0 for none",
+    )
+    args = parser.parse_args()
+
+    server = build_server(
+        Catalog(args.events, seed=args.seed),
+        port=args.port,
+        latency=args.latency,
+        error_rate=args.error_rate,
+        seed=args.seed,
+    )
+    print(f"Serving {args.events:,} events on http://127.0.0.1:{server.server_port}")
+    if args.feed_interval > 0:
+
+        def publish():
+            while True:
+                time.sleep(args.feed_interval)
+                server.feed.publish(server.feed.random_events(1))
+
+        threading.Thread(target=publish, daemon=True).start()
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
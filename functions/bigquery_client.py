@@ -1,16 +1,19 @@
 from google.cloud import bigquery
 import os
+from functools import lru_cache
 from functions.logger import get_logger
 
 logger = get_logger("bigquery-client")
 
 
+@lru_cache(maxsize=None)
 def bigquery_client():
+    """Creates the BigQuery client on first call, later calls reuse it."""
     # Path to the service account key file
     key_path = "/Users/nikolas.artadi/Documents/personal/Project Earthquake/bigquery-project-earthquake-secrets.json"
     logger.info("Create  BigQuery client.")
-    # Set the environment variable for authentication
-    os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = key_path
+    # Set the environment variable for authentication, unless it is already set
+    os.environ.setdefault("GOOGLE_APPLICATION_CREDENTIALS", key_path)
 
     # Create a BigQuery client
     client = bigquery.Client()
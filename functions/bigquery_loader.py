@@ -0,0 +1,287 @@
+"""Bulk loads of DataFrames to BigQuery through Parquet load jobs"""
+
+import io
+import threading
+import uuid
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+import pyarrow.parquet as pq
+from functions.schema_registry import SchemaRegistry, coerce_to_schema, schema_of
+from functions.usgs_schema import to_arrow_table
+from functions.logger import count, get_logger, span
+
+logger = get_logger("bigquery-loader")
+
+
+def to_parquet_buffer(df):
+    """Serializes a frame to an in-memory Parquet file. The numeric columns are
+    handed to Arrow without copying.
+    Args:
+        df: DataFrame to serialize
+    Returns:
+        BytesIO: Parquet file, positioned at the start
+    """
+    buffer = io.BytesIO()
+    pq.write_table(to_arrow_table(df), buffer)
+    buffer.seek(0)
+
+    return buffer
+
+
+def build_merge_query(table_id, staging_table_id, columns, key_columns):
+    """Builds the MERGE statement upserting the staging table into the target."""
+    condition = " AND ".join(f"T.`{col}` = S.`{col}`" for col in key_columns)
+    updates = ", ".join(
+        f"`{col}` = S.`{col}`" for col in columns if col not in key_columns
+    )
+    column_list = ", ".join(f"`{col}`" for col in columns)
+    values = ", ".join(f"S.`{col}`" for col in columns)
+
+    return (
+        f"MERGE `{table_id}` T USING `{staging_table_id}` S ON {condition} "
+        f"WHEN MATCHED THEN UPDATE SET {updates} "
+        f"WHEN NOT MATCHED THEN INSERT ({column_list}) VALUES ({values})"
+    )
+
+
+class BigQueryBackend(ABC):
+    """Operations the loader needs from BigQuery. GoogleBigQueryBackend talks to
+    the real service, FakeBigQueryBackend keeps the tables in memory."""
+
+    @abstractmethod
+    def table_exists(self, table_id):
+        """Returns True if the table exists."""
+
+    @abstractmethod
+    def get_schema(self, table_id):
+        """Returns the column -> type schema of the table, None if it does not
+        exist."""
+
+    @abstractmethod
+    def load_parquet(self, table_id, buffer, truncate=False):
+        """Runs a load job of the Parquet buffer to the table, creating it if
+        needed. Existing rows are replaced when truncate is True."""
+
+    @abstractmethod
+    def merge(self, table_id, staging_table_id, columns, key_columns):
+        """Upserts the rows of the staging table into the table."""
+
+    @abstractmethod
+    def delete_table(self, table_id):
+        """Deletes the table, if it exists."""
+
+
+class GoogleBigQueryBackend(BigQueryBackend):
+    """Backend using one google.cloud.bigquery client.
+    Args:
+        client: BigQuery client, the process wide one by default
+    """
+
+    def __init__(self, client=None):
+        if client is None:
+            from functions.bigquery_client import bigquery_client
+
+            client = bigquery_client()
+        self.client = client
+
+    def table_exists(self, table_id):
+        from google.api_core.exceptions import NotFound
+
+        try:
+            self.client.get_table(table_id)
+        except NotFound:
+            return False
+        return True
+
+    def get_schema(self, table_id):
+        from google.api_core.exceptions import NotFound
+
+        try:
+            table = self.client.get_table(table_id)
+        except NotFound:
+            return None
+        return {field.name: field.field_type for field in table.schema}
+
+    def load_parquet(self, table_id, buffer, truncate=False):
+        from google.cloud import bigquery
+
+        job_config = bigquery.LoadJobConfig(
+            source_format=bigquery.SourceFormat.PARQUET,
+            write_disposition=(
+                bigquery.WriteDisposition.WRITE_TRUNCATE
+                if truncate
+                else bigquery.WriteDisposition.WRITE_APPEND
+            ),
+        )
+        self.client.load_table_from_file(
+            buffer, table_id, job_config=job_config
+        ).result()
+
+    def merge(self, table_id, staging_table_id, columns, key_columns):
+        self.client.query(
+            build_merge_query(table_id, staging_table_id, columns, key_columns)
+        ).result()
+
+    def delete_table(self, table_id):
+        self.client.delete_table(table_id, not_found_ok=True)
+
+
+class FakeBigQueryBackend(BigQueryBackend):
+    """In-memory backend for offline runs and tests. tables maps the table ids
+    to DataFrames."""
+
+    def __init__(self):
+        self.tables = {}
+        self.load_jobs = []
+        self._lock = threading.Lock()
+
+    def table_exists(self, table_id):
+        return table_id in self.tables
+
+    def get_schema(self, table_id):
+        with self._lock:
+            df = self.tables.get(table_id)
+        return schema_of(df) if df is not None else None
+
+    def load_parquet(self, table_id, buffer, truncate=False):
+        df = pq.read_table(buffer).to_pandas()
+        with self._lock:
+            self._append(table_id, df, truncate)
+
+    def _append(self, table_id, df, truncate):
+        self.load_jobs.append((table_id, len(df)))
+        if truncate or table_id not in self.tables:
+            self.tables[table_id] = df
+        else:
+            self.tables[table_id] = pd.concat(
+                [self.tables[table_id], df], ignore_index=True
+            )
+
+    def merge(self, table_id, staging_table_id, columns, key_columns):
+        with self._lock:
+            self._merge(table_id, staging_table_id, columns, key_columns)
+
+    def _merge(self, table_id, staging_table_id, columns, key_columns):
+        target = self.tables[table_id]
+        staging = self.tables[staging_table_id][list(columns)]
+        staging_keys = pd.MultiIndex.from_frame(staging[key_columns])
+        kept = ~pd.MultiIndex.from_frame(target[key_columns]).isin(staging_keys)
+        self.tables[table_id] = pd.concat([target[kept], staging], ignore_index=True)
+
+    def delete_table(self, table_id):
+        with self._lock:
+            self.tables.pop(table_id, None)
+
+
+class BigQueryLoader:
+    """Loads frames with Parquet load jobs, the chunks of a frame in parallel.
+    Every frame is converted to the schema of its target table before the load.
+    Args:
+        backend: BigQueryBackend, a GoogleBigQueryBackend by default
+        max_workers: maximum number of concurrent load jobs
+        chunk_rows: maximum number of rows of one load job
+        schema_registry: SchemaRegistry, one fetching from backend by default
+        schema_path: optional schema file of the default SchemaRegistry
+    """
+
+    def __init__(
+        self,
+        backend=None,
+        max_workers=4,
+        chunk_rows=500_000,
+        schema_registry=None,
+        schema_path=None,
+    ):
+        self.backend = backend if backend is not None else GoogleBigQueryBackend()
+        self.max_workers = max_workers
+        self.chunk_rows = chunk_rows
+        self.schema_registry = (
+            schema_registry
+            if schema_registry is not None
+            else SchemaRegistry(self.backend, schema_path=schema_path)
+        )
+
+    def _chunks(self, df):
+        for start in range(0, len(df), self.chunk_rows):
+            yield df.iloc[start : start + self.chunk_rows]
+
+    def _load_chunk(self, table_id, chunk, truncate=False):
+        with span("parquet_serialize"):
+            buffer = to_parquet_buffer(chunk)
+        count("load_bytes", buffer.getbuffer().nbytes)
+        with span("load_job"):
+            self.backend.load_parquet(table_id, buffer, truncate)
+
+    def _load_chunks(self, table_id, df, truncate, executor):
+        """Loads the first chunk, replacing the table if truncate is True, and
+        the remaining chunks in parallel."""
+        chunks = self._chunks(df)
+        self._load_chunk(table_id, next(chunks), truncate)
+        futures = [
+            executor.submit(self._load_chunk, table_id, chunk) for chunk in chunks
+        ]
+        for future in futures:
+            future.result()
+
+    def load(self, df, table_id, key_columns=None, executor=None):
+        """Appends df to the table, or upserts it on key_columns through a
+        staging table and a MERGE.
+        Args:
+            df: DataFrame to load
+            table_id: project.dataset.table
+            key_columns: optional columns identifying a row
+            executor: optional thread pool running the chunk loads
+        Raises:
+            ValueError: if df does not fit the schema of the table
+        """
+        if df is None or df.empty:
+            logger.info(f"Empty DataFrame received for {table_id}, nothing to load.")
+            return
+        if executor is None:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                return self.load(df, table_id, key_columns, executor)
+
+        with span("bigquery_load", table=table_id):
+            self._load(df, table_id, key_columns, executor)
+        count("rows_loaded", len(df), table=table_id)
+
+    def _load(self, df, table_id, key_columns, executor):
+        schema = self.schema_registry.get(table_id)
+        if schema is not None:
+            df = coerce_to_schema(df, schema)
+
+        if not self.schema_registry.exists(table_id):
+            logger.info(f"Creating {table_id} with {len(df)} rows")
+            self._load_chunks(table_id, df, truncate=False, executor=executor)
+            self.schema_registry.set(table_id, schema or schema_of(df))
+            return
+
+        if key_columns is None:
+            logger.info(f"Sending {len(df)} rows to {table_id}")
+            self._load_chunks(table_id, df, truncate=False, executor=executor)
+            return
+
+        # Unique per load, two loads of the same table never share one
+        staging_table_id = f"{table_id}__staging_{uuid.uuid4().hex}"
+        logger.info(f"Merging {len(df)} rows into {table_id}")
+        self._load_chunks(staging_table_id, df, truncate=True, executor=executor)
+        try:
+            with span("merge"):
+                self.backend.merge(table_id, staging_table_id, df.columns, key_columns)
+        finally:
+            self.backend.delete_table(staging_table_id)
+
+
+_default_loader = None
+_default_loader_lock = threading.Lock()
+
+
+def get_default_loader():
+    """Returns the loader shared by the whole process, creating it on first use."""
+    global _default_loader
+    with _default_loader_lock:
+        if _default_loader is None:
+            _default_loader = BigQueryLoader()
+        return _default_loader
@@ -0,0 +1,240 @@
+"""Settings of the pipeline jobs, read from a JSON config file.
+
+Only the standard library is imported here, reading and checking a config
+must not wait for pandas or the Google clients.
+"""
+
+import json
+from collections import namedtuple
+
+from functions.state_store import watermark_key
+
+# Settings of a job and their default values, a config file overrides any of them
+DEFAULTS = {
+    # Addresses used for finding the earthquakes, location name -> address
+    "locations": {},
+    # Query constraints, dates in ISO8601 (YYYY-MM-DD)
+    "file_format": "csv",
+    "start_time": "2020-01-01",
+    "end_time": "2023-12-31",
+    "maxradiuskm": 500,
+    "limit": 20000,
+    "usgs_base_url": "https://earthquake.usgs.gov",
+    "max_workers": 8,  # maximum number of concurrent requests to USGS
+    "requests_per_second": 5,
+    "merge_regions": True,  # query the overlapping locations together
+    "pipeline_queue_size": 2,  # extracted locations waiting for the load
+    # Windows requested and not yet handed to the load, 2 * max_workers by
+    # default. With spill, every window holds at most limit rows, so this
+    # bounds the memory of the extraction.
+    "max_pending_windows": None,
+    # Geocoded addresses are cached on disk, entries older than the ttl (seconds)
+    # are refreshed
+    "geocoding_cache_path": ".cache/geocoding.json",
+    "geocoding_cache_ttl": 30 * 24 * 3600,
+    # Watermarks of the last successful load, later runs only extract the updates
+    "state_store_path": ".cache/state.sqlite",
+    # USGS responses are cached on disk, windows older than immutable_after_days
+    # are never requested again and the recent ones are revalidated on every run
+    "response_cache_path": ".cache/usgs",
+    "response_cache_max_bytes": 2 * 1024**3,
+    "response_cache_immutable_after_days": 30,
+    # Destination of the loads: "bigquery", or "parquet" to run offline
+    "sink_kind": "bigquery",
+    "local_sink_path": "data",  # root of the parquet datasets
+    "duckdb_path": None,  # optional DuckDB file with a view per parquet table
+    "project_id": "project-earthquake-432716",
+    "dataset_raw": "raw_data",
+    "dataset_curated": "curated_data",
+    "load_max_workers": 4,  # maximum number of concurrent load jobs
+    "load_chunk_rows": 500_000,  # maximum number of rows of one load job
+    "bigquery_schema_path": None,  # optional JSON file with the table schemas
+    # Out of core mode for large backfills: every extracted window is handled
+    # on its own and the curated rows above spill_memory_bytes are spilled to
+    # Parquet chunks under spill_path. spill_load "end" loads the chunks after
+    # the extraction, "progressive" loads every chunk as soon as it is spilled.
+    # The local state held in memory per event, see SPILL_DISABLED, is turned
+    # off in spill mode, a config enabling it together with spill is rejected.
+    "spill": False,
+    "spill_path": ".cache/spill",
+    "spill_memory_bytes": 256 * 1024**2,
+    "spill_load": "end",
+    # Key, updated time and content hash of the rows loaded to every table, kept
+    # under dedup_index_path/<sink_kind>/<root>. Only the new and revised rows
+    # are loaded. None loads every extracted row. Remove the index of a
+    # BigQuery table dropped or truncated, or its rows are not loaded again,
+    # the index of a missing Parquet table is reset by the run.
+    "dedup_index_path": ".cache/dedup",
+    # Daily rollups of the curated events per location and magnitude bucket,
+    # see functions/rollups.py. They are written to the table
+    # <dataset_curated>.earthquakes_daily and their state is kept in
+    # rollup_path/<sink_kind>/<root>, about 32 bytes per event. They aggregate
+    # the events extracted since they were enabled. None disables them.
+    "rollup_path": ".cache/rollups",
+    # Local spatial index of the curated events, see functions/spatial_index.py.
+    # It is held in memory, about 80 bytes per event.
+    "spatial_index": True,
+    # Backfills (app.py --backfill): the jobs are split in units of one location
+    # and backfill_window_days, queued in work_queue_path and run by workers
+    # that lease them for lease_seconds. A unit is tried max_attempts times.
+    "work_queue_path": ".cache/queue.sqlite",
+    "backfill_window_days": 90,
+    "lease_seconds": 900,
+    "max_attempts": 3,
+    # Real-time mode (app.py --realtime): the USGS summary feed realtime_feed,
+    # e.g. all_hour or 2.5_day, is polled every realtime_poll_seconds with
+    # conditional requests and its new events within maxradiuskm of the
+    # locations are loaded in micro-batches, every realtime_batch_seconds at
+    # most, 0 loads every poll with events. The feeds only hold the recent
+    # events, the revisions of older events are loaded by the batch runs.
+    # Their events are added to the spatial index every realtime_index_seconds
+    # and when the polling stops, the index file is rewritten in full.
+    "realtime_feed": "all_hour",
+    "realtime_poll_seconds": 10,
+    "realtime_batch_seconds": 0,
+    "realtime_index_seconds": 600,
+    # Logging: "text" or "json" lines, trace_spans logs every timed step
+    "log_format": "text",
+    "trace_spans": False,
+    # Optional Prometheus text file with the metrics of the run
+    "metrics_path": None,
+}
+
+# One pipeline run, name plus every setting of DEFAULTS
+JobConfig = namedtuple("JobConfig", ["name", *DEFAULTS])
+
+# Settings of the local state growing with the number of events in memory,
+# the dedup index, the rollups and the spatial index, and their value in
+# spill mode, whose memory must not grow with the date range
+SPILL_DISABLED = {"dedup_index_path": None, "rollup_path": None, "spatial_index": False}
+
+
+def _check_settings(settings, source):
+    unknown = sorted(set(settings) - set(DEFAULTS))
+    if unknown:
+        raise ValueError(f"Unknown settings in {source}: {', '.join(unknown)}")
+
+
+def load_jobs(path, overrides=None):
+    """Reads the jobs of a config file. The top level settings apply to every
+    job, and the optional "jobs" object maps job names to the settings they
+    change, e.g. another date range or destination. A file without "jobs"
+    defines a single job named default.
+    Args:
+        path: JSON config file
+        overrides: settings replacing the ones of the file in every job
+    Returns:
+        list: JobConfig of every job, in the order of the file
+    Raises:
+        ValueError: a setting or a spill_load is unknown, or a job enables
+            spill and a setting of SPILL_DISABLED
+    """
+    with open(path) as file:
+        config = json.load(file)
+
+    job_settings = config.pop("jobs", None) or {"default": {}}
+    _check_settings(config, path)
+    jobs = []
+    for name, settings in job_settings.items():
+        _check_settings(settings, f"{path}, job {name}")
+        changed = {**config, **settings, **(overrides or {})}
+        job = JobConfig(name=name, **{**DEFAULTS, **changed})
+        if job.spill_load not in ("end", "progressive"):
+            raise ValueError(
+                f"Unknown spill_load in {path}, job {name}: {job.spill_load}"
+            )
+        if job.spill:
+            enabled = sorted(
+                setting
+                for setting, value in SPILL_DISABLED.items()
+                if changed.get(setting, value) != value
+            )
+            if enabled:
+                raise ValueError(
+                    f"Settings holding every event in memory, not allowed with "
+                    f"spill in {path}, job {name}: {', '.join(enabled)}"
+                )
+            job = job._replace(**SPILL_DISABLED)
+        jobs.append(job)
+
+    return jobs
+
+
+def select_locations(jobs, location_names):
+    """Restricts the jobs to some locations, the jobs left without any
+    location are dropped.
+    Args:
+        jobs: JobConfig list
+        location_names: names of the locations to keep
+    Returns:
+        list: JobConfig with only the selected locations
+    Raises:
+        ValueError: a location is not in any job
+    """
+    known = {name for job in jobs for name in job.locations}
+    missing = [name for name in location_names if name not in known]
+    if missing:
+        raise ValueError(f"Unknown locations: {', '.join(missing)}")
+
+    selected = []
+    for job in jobs:
+        locations = {
+            name: address
+            for name, address in job.locations.items()
+            if name in location_names
+        }
+        if locations:
+            selected.append(job._replace(locations=locations))
+
+    return selected
+
+
+def job_outputs(job):
+    """Tables and files written by the job."""
+    root = job.local_sink_path if job.sink_kind == "parquet" else job.project_id
+    outputs = {
+        (job.sink_kind, root, job.dataset_raw, location_name)
+        for location_name in job.locations
+    }
+    outputs.add((job.sink_kind, root, job.dataset_curated, "earthquakes"))
+    outputs.update(
+        (
+            "watermark",
+            job.state_store_path,
+            watermark_key(location_name, job.maxradiuskm, job.start_time, job.end_time),
+        )
+        for location_name in job.locations
+    )
+    if job.spatial_index:
+        outputs.add(("spatial_index", job.local_sink_path, job.dataset_curated))
+
+    return outputs
+
+
+def group_jobs(jobs):
+    """Groups the jobs writing the same tables or files, the jobs of a group
+    run one after the other and the groups run in parallel.
+    Args:
+        jobs: JobConfig list
+    Returns:
+        list: lists of JobConfig, in the order of jobs
+    """
+    # Union-find over the jobs sharing an output
+    parents = list(range(len(jobs)))
+
+    def find(i):
+        while parents[i] != i:
+            parents[i] = parents[parents[i]]
+            i = parents[i]
+        return i
+
+    writers = {}
+    for i, job in enumerate(jobs):
+        for output in job_outputs(job):
+            parents[find(i)] = find(writers.setdefault(output, i))
+
+    groups = {}
+    for i, job in enumerate(jobs):
+        groups.setdefault(find(i), []).append(job)
+
+    return list(groups.values())
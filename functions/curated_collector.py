@@ -0,0 +1,198 @@
+"""Accumulate the curated dataset batch by batch and concatenate it once"""
+
+import os
+import shutil
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from functions.helper_functions import transform_data
+from functions.usgs_schema import from_arrow_table, restore_categories, to_arrow_table
+from functions.logger import count, get_logger, span
+
+logger = get_logger("curated-collector")
+
+
+class CuratedCollector:
+    """Collects the transformed batches of every location.
+    Every batch is projected to columns_to_keep when it is added, so the raw
+    columns are released right away, and the batches are concatenated once in
+    result() instead of once per location.
+    Args:
+        columns_to_keep: columns of the curated dataset
+        inserted_at: UTC Timestamp of the run, shared by every batch
+        row_filter: optional function returning the transformed rows of a batch
+            to keep, e.g. DedupIndex.new_rows to drop the rows already loaded
+        rollup: optional EarthquakeRollup updated with the rows of every batch,
+            before they are projected to columns_to_keep
+    """
+
+    def __init__(self, columns_to_keep, inserted_at=None, row_filter=None, rollup=None):
+        self.columns_to_keep = columns_to_keep
+        self.inserted_at = (
+            inserted_at if inserted_at is not None else pd.Timestamp.now(tz="UTC")
+        )
+        self.row_filter = row_filter
+        self.rollup = rollup
+        self._batches = []
+
+    def add(self, location_name, df):
+        """Transforms the raw data of a location and keeps the curated columns.
+        Args:
+            location_name: name of the location
+            df: raw DataFrame of the location
+        Returns:
+            DataFrame: the curated batch kept, None if every row was dropped
+        """
+        logger.info(f"Combining and transforming data for location: {location_name}")
+        if df is None or df.empty:
+            logger.info(f"Empty response received for location: {location_name}.")
+            return None
+
+        df = transform_data(location_name, df, inserted_at=self.inserted_at)
+        if self.row_filter is not None:
+            df = self.row_filter(df)
+            if df.empty:
+                return None
+        if self.rollup is not None:
+            self.rollup.add(df)
+        self._batches.append(df[self.columns_to_keep])
+
+        return self._batches[-1]
+
+    def __len__(self):
+        return sum(len(batch) for batch in self._batches)
+
+    def result(self):
+        """Concatenates the batches added so far.
+        Returns:
+            DataFrame: curated dataset, one row per hashed_id
+        """
+        if not self._batches:
+            return pd.DataFrame(columns=self.columns_to_keep)
+
+        with span("concat"):
+            # The location categories differ between batches
+            df = restore_categories(pd.concat(self._batches, ignore_index=True))
+            if "hashed_id" in df.columns:
+                df = df.drop_duplicates(subset=["hashed_id"], ignore_index=True)
+        self._batches = [df]
+
+        return df
+
+    def clear(self):
+        """Drops the batches added so far."""
+        self._batches = []
+
+
+class SpillingCollector:
+    """Collects the transformed batches with a CuratedCollector, but keeps at
+    most max_memory_bytes of them in memory. Beyond that, the batches are
+    written to a Parquet chunk under spill_path, or handed to on_spill to be
+    loaded right away, so the memory used does not grow with the date range.
+    The rows are read back with iter_chunks(), never in one frame.
+    Args:
+        columns_to_keep: columns of the curated dataset
+        spill_path: directory of the chunks, emptied first, e.g. of the chunks
+            of a run that crashed
+        max_memory_bytes: memory of the batches above which they are spilled
+        key_columns: columns identifying a curated row, every chunk holds each
+            key once, the sink upsert replaces the keys repeated across chunks
+        on_spill: optional function called with every spilled chunk instead
+            of writing it to disk, e.g. to load the curated rows progressively
+        inserted_at: UTC Timestamp of the run, shared by every batch
+        row_filter: optional function returning the transformed rows of a batch
+            to keep
+        rollup: optional EarthquakeRollup updated with the rows of every batch
+    """
+
+    def __init__(
+        self,
+        columns_to_keep,
+        spill_path,
+        max_memory_bytes=256 * 1024**2,
+        key_columns=("id", "location"),
+        on_spill=None,
+        inserted_at=None,
+        row_filter=None,
+        rollup=None,
+    ):
+        self._collector = CuratedCollector(
+            columns_to_keep,
+            inserted_at=inserted_at,
+            row_filter=row_filter,
+            rollup=rollup,
+        )
+        self.spill_path = spill_path
+        self.max_memory_bytes = max_memory_bytes
+        self.key_columns = list(key_columns)
+        self.on_spill = on_spill
+        self._batches_bytes = 0
+        self._chunks = []
+        self._spilled_rows = 0
+        shutil.rmtree(spill_path, ignore_errors=True)
+        os.makedirs(spill_path)
+
+    def add(self, location_name, df):
+        """Transforms the raw data of a location like CuratedCollector.add, and
+        spills the batches once they exceed max_memory_bytes."""
+        batch = self._collector.add(location_name=location_name, df=df)
+        if batch is None:
+            return
+
+        self._batches_bytes += int(batch.memory_usage(index=False, deep=True).sum())
+        if self._batches_bytes >= self.max_memory_bytes:
+            self.spill()
+
+    def __len__(self):
+        return self._spilled_rows + len(self._collector)
+
+    def spill(self):
+        """Writes the batches held in memory to a chunk, or hands them to on_spill."""
+        if not len(self._collector):
+            return
+
+        with span("spill"):
+            df = self._collector.result().drop_duplicates(
+                subset=self.key_columns, keep="last", ignore_index=True
+            )
+            self._collector.clear()
+            self._batches_bytes = 0
+            self._spilled_rows += len(df)
+            if self.on_spill is not None:
+                self.on_spill(df)
+            else:
+                path = os.path.join(
+                    self.spill_path, f"chunk-{len(self._chunks):06d}.parquet"
+                )
+                pq.write_table(to_arrow_table(df), path)
+                self._chunks.append(path)
+                count("spilled_bytes", os.path.getsize(path))
+        count("spilled_rows", len(df))
+        logger.info(f"Spilled {len(df)} curated rows, {len(self)} so far.")
+
+    def iter_chunks(self, chunk_rows=None):
+        """Spills the batches left, then reads the chunks back one at a time.
+        A chunk file is removed once the next one is requested, so a consumer
+        failing half way leaves the chunks it did not process on disk.
+        Args:
+            chunk_rows: maximum number of rows of every yielded frame, a whole
+                chunk by default
+        Yields:
+            DataFrame: curated rows
+        """
+        self.spill()
+        while self._chunks:
+            file = pq.ParquetFile(self._chunks[0])
+            for batch in file.iter_batches(
+                batch_size=chunk_rows or file.metadata.num_rows
+            ):
+                yield restore_categories(
+                    from_arrow_table(pa.Table.from_batches([batch]))
+                )
+            file.close()
+            os.remove(self._chunks.pop(0))
+
+    def close(self):
+        """Removes the spill directory."""
+        shutil.rmtree(self.spill_path, ignore_errors=True)
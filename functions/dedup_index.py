@@ -0,0 +1,180 @@
+"""Local index of the rows already loaded to every destination table"""
+
+import os
+import threading
+import uuid
+from urllib.parse import quote
+
+import numpy as np
+import pandas as pd
+from functions.helper_functions import compute_hashed_id
+from functions.logger import count, get_logger, span
+
+logger = get_logger("dedup-index")
+
+# Updated time of the rows without an updated column
+NO_UPDATED = np.iinfo(np.int64).min
+
+
+def key_hashes(df, key_columns):
+    """int64 hash of the key of every row, the same on every run."""
+    hashes = pd.util.hash_pandas_object(df[list(key_columns)], index=False)
+    return hashes.to_numpy().view("int64")
+
+
+def _content_hashes(df, content_column):
+    if content_column in df.columns:
+        return df[content_column].to_numpy(dtype="int64")
+    return compute_hashed_id(df).to_numpy()
+
+
+def _updated_ns(df):
+    if "updated" not in df.columns:
+        return np.full(len(df), NO_UPDATED, dtype="int64")
+    updated = pd.to_datetime(df["updated"], utc=True, format="ISO8601", cache=False)
+    # NaT is the minimum int64
+    return updated.dt.as_unit("ns").array.asi8
+
+
+class DedupIndex:
+    """Remembers the key, updated time and content hash of every row loaded to
+    the destination tables, in three int64 arrays sorted by key, 24 bytes per
+    row. The rows of a batch are looked up with one searchsorted, so only the
+    new rows and the revisions of loaded rows are sent to the loader.
+    The index of a table is read when it is first used and written by save().
+    Lookups see the rows of the earlier runs only, the rows recorded during
+    the run are merged in by save(). After a destination table is dropped or
+    truncated, its index must be reset, or the rows it holds are never loaded
+    again.
+    Args:
+        path: directory of the index files, one per table
+        content_column: column holding the content hash of the rows, computed
+            with compute_hashed_id for the frames without it
+    """
+
+    def __init__(self, path, content_column="hashed_id"):
+        self.path = path
+        self.content_column = content_column
+        self._lock = threading.Lock()
+        self._tables = {}
+        self._recorded = {}
+
+    def _file(self, table):
+        return os.path.join(self.path, f"{quote(table, safe='')}.npz")
+
+    def _arrays(self, table):
+        """keys, updated and hashes of the loaded rows of the table."""
+        with self._lock:
+            if table not in self._tables:
+                path = self._file(table)
+                if os.path.exists(path):
+                    with np.load(path) as arrays:
+                        self._tables[table] = (
+                            arrays["keys"],
+                            arrays["updated"],
+                            arrays["hashes"],
+                        )
+                else:
+                    empty = np.empty(0, dtype="int64")
+                    self._tables[table] = (empty, empty, empty)
+            return self._tables[table]
+
+    def __len__(self):
+        return sum(len(keys) for keys, _, _ in self._tables.values())
+
+    def new_rows(self, df, table, key_columns):
+        """Keeps the rows of a key never loaded to the table, and the rows
+        whose content changed with an updated time not older than the loaded one.
+        Args:
+            df: DataFrame to load
+            table: destination table, e.g. raw_data.pleo_dk
+            key_columns: columns identifying a row of the table
+        Returns:
+            DataFrame: rows of df to load
+        """
+        if df is None or df.empty:
+            return df
+
+        keys, updated, hashes = self._arrays(table)
+        if len(keys) == 0:
+            count("dedup_new_rows", len(df), table=table)
+            return df
+
+        with span("dedup_lookup", table=table):
+            new_keys = key_hashes(df, key_columns)
+            positions = np.minimum(np.searchsorted(keys, new_keys), len(keys) - 1)
+            found = keys[positions] == new_keys
+            revised = (
+                found
+                & (hashes[positions] != _content_hashes(df, self.content_column))
+                & (_updated_ns(df) >= updated[positions])
+            )
+            keep = ~found | revised
+
+        count("dedup_new_rows", int((~found).sum()), table=table)
+        count("dedup_revised_rows", int(revised.sum()), table=table)
+        count("dedup_skipped_rows", int((~keep).sum()), table=table)
+        if keep.all():
+            return df
+        return df[keep]
+
+    def record(self, df, table, key_columns):
+        """Adds the rows loaded to the table, merged in by save().
+        Args:
+            df: DataFrame loaded
+            table: destination table
+            key_columns: columns identifying a row of the table
+        """
+        if df is None or df.empty:
+            return
+
+        arrays = (
+            key_hashes(df, key_columns),
+            _updated_ns(df),
+            _content_hashes(df, self.content_column),
+        )
+        with self._lock:
+            self._recorded.setdefault(table, []).append(arrays)
+
+    def reset(self, table):
+        """Forgets every row of the table, e.g. after it was dropped."""
+        with self._lock:
+            empty = np.empty(0, dtype="int64")
+            self._tables[table] = (empty, empty, empty)
+            self._recorded.pop(table, None)
+            if os.path.exists(self._file(table)):
+                os.remove(self._file(table))
+                logger.info(f"Dedup index of {table} reset.")
+
+    def save(self):
+        """Merges the recorded rows in the index of their table and writes it.
+        A recorded row replaces the loaded row of the same key, like the
+        upsert of the sinks. The index file is read again first, so the rows
+        saved by other processes in the meantime are kept."""
+        for table in list(self._recorded):
+            with self._lock:
+                self._tables.pop(table, None)
+            keys, updated, hashes = self._arrays(table)
+            with self._lock:
+                recorded = self._recorded.pop(table)
+            parts = [(keys, updated, hashes), *recorded]
+            all_keys, all_updated, all_hashes = (
+                np.concatenate([part[i] for part in parts]) for i in range(3)
+            )
+
+            # Last row of every key, in the order of the records
+            order = np.argsort(all_keys, kind="stable")
+            sorted_keys = all_keys[order]
+            last = np.append(sorted_keys[1:] != sorted_keys[:-1], True)
+            order = order[last]
+            arrays = (all_keys[order], all_updated[order], all_hashes[order])
+
+            os.makedirs(self.path, exist_ok=True)
+            path = self._file(table)
+            tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+            with open(tmp_path, "wb") as file:
+                np.savez(file, keys=arrays[0], updated=arrays[1], hashes=arrays[2])
+            os.replace(tmp_path, path)
+            with self._lock:
+                self._tables[table] = arrays
+            logger.info(f"Dedup index of {table} saved with {len(arrays[0])} rows.")
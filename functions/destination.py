@@ -0,0 +1,183 @@
+"""Writes of a job to its sink, with the local state kept next to it"""
+
+import collections
+import contextlib
+import os
+import threading
+
+import pandas as pd
+from functions.dedup_index import DedupIndex
+from functions.logger import get_logger, span
+from functions.rollups import ROLLUP_KEY_COLUMNS, ROLLUP_TABLE, EarthquakeRollup
+from functions.usgs_schema import CURATED_CATEGORY_COLUMNS, HASH_COLUMNS
+
+logger = get_logger("destination")
+
+# Columns of the raw rows kept in the spatial index, one row per event. They
+# are the ones hashed_id is computed from, the rows the index assigns to a
+# location hash like the extracted ones.
+INDEX_COLUMNS = [col for col in HASH_COLUMNS if col not in CURATED_CATEGORY_COLUMNS]
+
+CURATED_TABLE = "earthquakes"
+CURATED_KEY_COLUMNS = ["id", "location"]
+
+
+class Destination:
+    """Loads the raw and curated rows of a job and maintains the local state
+    of its sink: the dedup index, the rollups and the spatial index. Only
+    the rows new or revised since the last load are written when the dedup
+    index is enabled.
+    Args:
+        sink: Sink of the job
+        dataset_raw, dataset_curated: datasets of the raw and curated tables
+        location_names: locations loaded, the raw table of every location
+        dedup_index_path: directory of the dedup index, None disables it
+        rollup_path: file of the rollup state, None disables the rollups
+        spatial_index_path: file of the spatial index, None disables it
+        local_tables: the sink writes local tables with a table_path(), a
+            table removed since the last run is then loaded again in full
+        write_lock: optional function returning a context manager held during
+            the writes to the local state, when several processes write to it
+    """
+
+    def __init__(
+        self,
+        sink,
+        dataset_raw,
+        dataset_curated,
+        location_names,
+        dedup_index_path=None,
+        rollup_path=None,
+        spatial_index_path=None,
+        local_tables=False,
+        write_lock=None,
+    ):
+        self.sink = sink
+        self.dataset_raw = dataset_raw
+        self.dataset_curated = dataset_curated
+        self.spatial_index_path = spatial_index_path
+        self.local_tables = local_tables
+        self.locked = write_lock or contextlib.nullcontext
+        self.curated_table = f"{dataset_curated}.{CURATED_TABLE}"
+        self.dedup_index = None
+        self.rollup = None
+        # Events of the loaded raw rows, added to the spatial index by save()
+        self._index_frames = []
+        # One write at a time per table, e.g. of the windows of a location
+        # loaded by several workers in spill mode
+        self._table_locks = collections.defaultdict(threading.Lock)
+        self._table_locks_lock = threading.Lock()
+
+        with self.locked():
+            if dedup_index_path is not None:
+                self.dedup_index = DedupIndex(dedup_index_path)
+                if local_tables:
+                    # A table removed since the last run is loaded again in full
+                    for dataset, table in [
+                        (dataset_curated, CURATED_TABLE),
+                        *((dataset_raw, name) for name in location_names),
+                    ]:
+                        if not os.path.isdir(sink.table_path(dataset, table)):
+                            self.dedup_index.reset(f"{dataset}.{table}")
+
+            if rollup_path is not None:
+                if self.dedup_index is not None and not os.path.exists(rollup_path):
+                    # The rows loaded before the rollups existed go through
+                    # them once
+                    self.dedup_index.reset(self.curated_table)
+                self.rollup = EarthquakeRollup(rollup_path)
+
+    @property
+    def row_filter(self):
+        """Function dropping the curated rows already loaded, None without a
+        dedup index, for CuratedCollector."""
+        if self.dedup_index is None:
+            return None
+        return self._new_curated_rows
+
+    def _new_curated_rows(self, df):
+        return self.dedup_index.new_rows(
+            df, self.curated_table, key_columns=CURATED_KEY_COLUMNS
+        )
+
+    def _table_lock(self, table):
+        with self._table_locks_lock:
+            return self._table_locks[table]
+
+    def load_raw(self, location_name, df):
+        """Loads the raw data of a location, revised events replace the loaded
+        ones. The loads of the same location run one after the other.
+        Args:
+            location_name: name of the location, and of its raw table
+            df: extracted events of the location
+        """
+        raw_table = f"{self.dataset_raw}.{location_name}"
+        with self._table_lock(raw_table):
+            if self.dedup_index is not None:
+                df = self.dedup_index.new_rows(df, raw_table, key_columns=["id"])
+            self.sink.write(df, self.dataset_raw, location_name, key_columns=["id"])
+            if self.dedup_index is not None:
+                self.dedup_index.record(df, raw_table, key_columns=["id"])
+        if self.spatial_index_path is not None and len(df):
+            self._index_frames.append(df[INDEX_COLUMNS])
+
+    def load_curated(self, df):
+        """Loads curated rows, the rows of the same event and location replace
+        the loaded ones."""
+        with self._table_lock(self.curated_table):
+            self.sink.write(
+                df,
+                self.dataset_curated,
+                CURATED_TABLE,
+                key_columns=CURATED_KEY_COLUMNS,
+            )
+            if self.dedup_index is not None:
+                self.dedup_index.record(
+                    df, self.curated_table, key_columns=CURATED_KEY_COLUMNS
+                )
+
+    def save_spatial_index(self):
+        """Adds the events loaded since the last call to the spatial index. The
+        index file is rewritten in full."""
+        if self._index_frames:
+            from functions.spatial_index import update_spatial_index
+
+            with span("stage", stage="spatial_index"), self.locked():
+                update_spatial_index(
+                    self.spatial_index_path,
+                    pd.concat(self._index_frames, ignore_index=True),
+                )
+            self._index_frames = []
+
+    def save(self, spatial_index=True):
+        """Adds the loaded events to the spatial index, writes the changed
+        rollups and saves the dedup index. The next loads start from here.
+        Args:
+            spatial_index: False keeps the loaded events for a later
+                save_spatial_index(), e.g. between the micro-batches of the
+                real-time mode
+        """
+        if spatial_index:
+            self.save_spatial_index()
+
+        if self.rollup is not None:
+            with span("stage", stage="rollups"), self.locked():
+                self.rollup.refresh()
+                # A removed local table is written again in full
+                rollup_rows = self.rollup.rows(
+                    changed_only=not self.local_tables
+                    or os.path.isdir(
+                        self.sink.table_path(self.dataset_curated, ROLLUP_TABLE)
+                    )
+                )
+                self.sink.write(
+                    rollup_rows,
+                    self.dataset_curated,
+                    ROLLUP_TABLE,
+                    key_columns=ROLLUP_KEY_COLUMNS,
+                )
+                self.rollup.save()
+
+        if self.dedup_index is not None:
+            with span("stage", stage="dedup_index"), self.locked():
+                self.dedup_index.save()
@@ -0,0 +1,208 @@
+"""Extract many (location, time window) units at once under a shared rate limit"""
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from functions.helper_functions import extract_data_return_df, stitch_frames
+from functions.query_planner import plan_time_windows
+from functions.rate_limiter import TokenBucket
+from functions.region_planner import QueryRegion, assign_locations, plan_query_regions
+from functions.logger import get_logger
+
+logger = get_logger("extraction-engine")
+
+
+def extract_locations(
+    dic_addresses,
+    url_template,
+    count_url_template,
+    start_time,
+    end_time,
+    maxradiuskm,
+    limit,
+    file_format="csv",
+    max_workers=8,
+    requests_per_second=5,
+    merge_regions=True,
+    max_area_ratio=1.25,
+    watermarks=None,
+):
+    """Plans and extracts the earthquakes of every location concurrently.
+    The windows of all the regions are fetched by the same thread pool, so the
+    number of requests in flight never exceeds max_workers and the request rate
+    never exceeds requests_per_second.
+    Args:
+        dic_addresses: location name -> [latitude, longitude]
+        url_template, count_url_template: USGS query and count urls
+        start_time, end_time: ISO8601 date range of the extraction
+        maxradiuskm: radius around every location
+        limit: maximum number of rows returned by one query
+        file_format: format of the USGS response
+        max_workers: maximum number of concurrent requests
+        requests_per_second: sustained request rate to USGS
+        merge_regions: query overlapping locations together, see
+            plan_query_regions
+        max_area_ratio: passed to plan_query_regions
+        watermarks: optional location name -> ISO8601 time of the last load,
+            only the events updated after it are extracted
+    Returns:
+        dict: location name -> DataFrame, in the order of dic_addresses
+    """
+    extracted = dict(
+        iter_extract_locations(
+            dic_addresses=dic_addresses,
+            url_template=url_template,
+            count_url_template=count_url_template,
+            start_time=start_time,
+            end_time=end_time,
+            maxradiuskm=maxradiuskm,
+            limit=limit,
+            file_format=file_format,
+            max_workers=max_workers,
+            requests_per_second=requests_per_second,
+            merge_regions=merge_regions,
+            max_area_ratio=max_area_ratio,
+            watermarks=watermarks,
+        )
+    )
+
+    return {location_name: extracted[location_name] for location_name in dic_addresses}
+
+
+def iter_extract_locations(
+    dic_addresses,
+    url_template,
+    count_url_template,
+    start_time,
+    end_time,
+    maxradiuskm,
+    limit,
+    file_format="csv",
+    max_workers=8,
+    requests_per_second=5,
+    merge_regions=True,
+    max_area_ratio=1.25,
+    watermarks=None,
+    max_pending_units=None,
+    stream_windows=False,
+):
+    """Same as extract_locations, but yields the locations of every region as
+    soon as its windows are fetched. The windows are requested in region
+    order while fewer than max_pending_units are waiting to be yielded, so a
+    slow consumer holds back the extraction instead of letting the frames
+    pile up. Closing the generator cancels the requests not started yet.
+    Args:
+        max_pending_units: maximum number of windows requested and not yet
+            yielded, 2 * max_workers by default
+        stream_windows: yields the locations of every window instead of
+            stitching the windows of a region first. Every frame then holds
+            at most limit rows whatever the date range, and the events on
+            the window boundaries may be yielded twice.
+        the other arguments are the ones of extract_locations
+    Yields:
+        tuple: (location name, DataFrame), grouped by region
+    """
+    if max_pending_units is None:
+        max_pending_units = 2 * max_workers
+    rate_limiter = TokenBucket(rate=requests_per_second)
+    if merge_regions:
+        regions = plan_query_regions(dic_addresses, maxradiuskm, max_area_ratio)
+    else:
+        regions = [
+            QueryRegion(coordinates[0], coordinates[1], maxradiuskm, [location_name])
+            for location_name, coordinates in dic_addresses.items()
+        ]
+
+    # A region is extracted from the oldest watermark of its locations
+    region_filters = []
+    for region in regions:
+        region_watermarks = [
+            (watermarks or {}).get(location_name)
+            for location_name in region.location_names
+        ]
+        if all(region_watermarks):
+            region_filters.append(f"&updatedafter={min(region_watermarks)}")
+        else:
+            region_filters.append("")
+
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        # Plan the windows of every region
+        planned = [
+            executor.submit(
+                plan_time_windows,
+                count_url_template=count_url_template + region_filter,
+                start_time=start_time,
+                end_time=end_time,
+                latitude=region.latitude,
+                longitude=region.longitude,
+                maxradiuskm=region.radiuskm,
+                limit=limit,
+                rate_limiter=rate_limiter,
+            )
+            for region, region_filter in zip(regions, region_filters)
+        ]
+
+        def submit_window(region, region_filter, window):
+            """Fetches one (region, window) unit."""
+            window_start, window_end = window
+            return executor.submit(
+                extract_data_return_df,
+                url=(url_template + region_filter).format(
+                    file_format=file_format,
+                    start_time=window_start,
+                    end_time=window_end,
+                    latitude=region.latitude,
+                    longitude=region.longitude,
+                    maxradiuskm=region.radiuskm,
+                    limit=limit,
+                ),
+                location_name="+".join(region.location_names),
+                rate_limiter=rate_limiter,
+            )
+
+        logger.info(f"Extracting {len(regions)} regions.")
+        to_start = deque(zip(regions, region_filters, planned))
+        # Regions being extracted, in order: [region, filter, windows left,
+        # requested windows, fetched frames]
+        active = deque()
+        n_pending = 0
+        while to_start or active:
+            # The windows are requested in region order, so the first region
+            # always has its next window requested
+            while n_pending < max_pending_units:
+                opened = next((unit for unit in active if unit[2] is not None), None)
+                if opened is None:
+                    if not to_start:
+                        break
+                    region, region_filter, future = to_start.popleft()
+                    active.append(
+                        [region, region_filter, iter(future.result()), deque(), []]
+                    )
+                    continue
+                window = next(opened[2], None)
+                if window is None:
+                    opened[2] = None
+                    continue
+                opened[3].append(submit_window(opened[0], opened[1], window))
+                n_pending += 1
+
+            region, _, windows, futures, frames = active[0]
+            if futures:
+                df = futures.popleft().result()
+                n_pending -= 1
+                if stream_windows:
+                    yield from assign_locations(
+                        df, region, dic_addresses, maxradiuskm
+                    ).items()
+                else:
+                    frames.append(df)
+            elif windows is None:
+                active.popleft()
+                if not stream_windows and frames:
+                    df = stitch_frames(frames)
+                    yield from assign_locations(
+                        df, region, dic_addresses, maxradiuskm
+                    ).items()
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,77 @@
+"""On-disk cache of the geocoded office addresses"""
+
+import json
+import os
+import threading
+import time
+import uuid
+
+from functions.logger import get_logger
+
+logger = get_logger("geocoding-cache")
+
+
+def normalize_address(address):
+    """Lower cases the address and collapses the whitespace, so that the same
+    address written slightly differently hits the same cache entry."""
+    return " ".join(address.lower().split())
+
+
+class GeocodingCache:
+    """JSON file mapping normalized addresses to their coordinates.
+    Args:
+        path: JSON file of the cache, created on first save
+        ttl: seconds after which an entry is geocoded again, None to keep
+            entries forever
+    """
+
+    def __init__(self, path, ttl=None):
+        self.path = path
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = {}
+        if os.path.exists(path):
+            with open(path) as file:
+                self._entries = json.load(file)
+
+    def get(self, address):
+        """Returns [latitude, longitude] of the address, None on a miss or when
+        the entry is older than the ttl."""
+        with self._lock:
+            entry = self._entries.get(normalize_address(address))
+        if entry is None:
+            return None
+        if self.ttl is not None and time.time() - entry["cached_at"] > self.ttl:
+            return None
+
+        return [entry["latitude"], entry["longitude"]]
+
+    def set(self, address, coordinates):
+        """Stores [latitude, longitude] of the address."""
+        with self._lock:
+            self._entries[normalize_address(address)] = {
+                "latitude": coordinates[0],
+                "longitude": coordinates[1],
+                "cached_at": time.time(),
+            }
+
+    def invalidate(self, address=None):
+        """Removes the entry of the address, or every entry if address is None."""
+        with self._lock:
+            if address is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(normalize_address(address), None)
+
+    def save(self):
+        """Writes the cache to disk, replacing the previous file atomically."""
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._lock:
+            # Unique, the jobs running in parallel may save the same cache
+            tmp_path = f"{self.path}.{uuid.uuid4().hex}.tmp"
+            with open(tmp_path, "w") as file:
+                json.dump(self._entries, file, indent=2, sort_keys=True)
+            os.replace(tmp_path, self.path)
+        logger.info(f"Saved {len(self._entries)} geocoded addresses to {self.path}.")
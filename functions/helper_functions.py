@@ -1,83 +1,132 @@
-import requests
-import datetime
-import pandas as pd
+import io
 import time
 import requests
-from io import StringIO
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
 from geopy.geocoders import ArcGIS
-from functions.logger import get_logger
+from functions import http_transport, response_cache
+from functions.rate_limiter import TokenBucket
+from functions.usgs_schema import (
+    HASH_COLUMNS,
+    USGS_DTYPES,
+    constant_column,
+    empty_frame,
+    parse_time_columns,
+    restore_categories,
+)
+from functions.logger import count, get_logger, metrics, span, timed
 
 logger = get_logger("helper-functions")
 
-def get_total_n_earthquakes(url, location_name):
-    """
-    placeholder TBC
+
+def get_coordinates(locations, cache=None, max_workers=4, requests_per_second=2):
+    """Geocodes the addresses of the locations.
+    Args:
+        locations: location name -> address
+        cache: optional GeocodingCache, only the addresses missing in it are
+            sent to the geocoder
+        max_workers: maximum number of concurrent geocoder requests
+        requests_per_second: sustained request rate to the geocoder
+    Returns:
+        dict: location name -> [latitude, longitude], in the order of locations
     """
-    logger.info(
-        f"Getting the total number of earthquakes for location: {location_name}"
-    )
-    dic_number_earthquakes = {}
-    total_number_earthquakes = 0
+    logger.info("Getting the geographical coordinates of the locations.")
+    coordinates = {}
+    misses = {}
+    for location_name, address in locations.items():
+        cached = cache.get(address) if cache is not None else None
+        if cached is not None:
+            coordinates[location_name] = cached
+        else:
+            misses[location_name] = address
 
-    response = requests.get(url)
+    count("geocode_cache_hits", len(coordinates))
+    if misses:
+        logger.info(f"Geocoding {len(misses)} addresses not found in the cache.")
+        count("geocode_requests", len(misses))
+        # Create an instance of the ArcGIS geocoder
+        nom = ArcGIS(
+            timeout=http_transport.settings["read_timeout"],
+            adapter_factory=http_transport.geocoder_adapter_factory,
+        )
+        rate_limiter = TokenBucket(rate=requests_per_second)
 
-    total_number_earthquakes += int(response.text)
+        def geocode(address):
+            rate_limiter.acquire()
+            return nom.geocode(address)
 
-    dic_number_earthquakes[location_name] = [response.text]
+        with span("geocode"), ThreadPoolExecutor(max_workers=max_workers) as executor:
+            geocoded = dict(zip(misses, executor.map(geocode, misses.values())))
 
-    if total_number_earthquakes <= 2000:
-        logger.info(
-            f"{total_number_earthquakes} rows to be extracted from {location_name}."
-        )
-    else:
-        logger.info(
-            "Total number of earthquakes exceeds 2000. Split the extraction in less than 2000 rows."
-        )
+        for location_name, location in geocoded.items():
+            if location:
+                # Store the location name with its latitude and longitude
+                coordinates[location_name] = [location.latitude, location.longitude]
+                if cache is not None:
+                    cache.set(misses[location_name], coordinates[location_name])
+            else:
+                logger.warning(f"Address of {location_name} could not be geocoded.")
 
-    return dic_number_earthquakes
+        if cache is not None:
+            cache.save()
 
+    return {
+        location_name: coordinates[location_name]
+        for location_name in locations
+        if location_name in coordinates
+    }
 
-def get_coordinates(locations):
-    """ 
-    
+
+@timed("hashing")
+def compute_hashed_id(df, hash_columns=HASH_COLUMNS):
+    """Hashes the content columns of every row, the same row gets the same hash
+    on every run.
+    Args:
+        df: DataFrame to hash
+        hash_columns: columns to hash, the ones missing in df are skipped
+    Returns:
+        Series: int64 hash of every row
     """
-    logger.info("Getting the geographical coordinates of the locations.")
-    # Create an instance of the ArcGIS geocoder
-    nom = ArcGIS()
-    dic_addresses = {}
-    # Loop through each location in the dictionary
-    for location_name, address in locations.items():
+    columns = [col for col in hash_columns if col in df.columns]
+    hashes = pd.util.hash_pandas_object(df[columns], index=False)
+
+    # BigQuery integers are signed
+    return pd.Series(hashes.to_numpy().view("int64"), index=df.index)
+
+
+def transform_data(location_name, df, inserted_at=None):
+    """Adds the curated columns to the raw data of one location.
+    Args:
+        location_name: name of the location
+        df: raw DataFrame of the location, left unchanged
+        inserted_at: UTC Timestamp of the load, now by default
+    Returns:
+        DataFrame: raw columns plus location, inserted_at and hashed_id, with
+            one row per event id. location and inserted_at are constant
+            categories of one byte per row.
+    """
+    if inserted_at is None:
+        inserted_at = pd.Timestamp.now(tz="UTC")
+    with span("transform", location=location_name):
+        df = df.drop_duplicates(subset=["id"])
+        df = df.assign(
+            location=constant_column(location_name, len(df)),
+            inserted_at=constant_column(inserted_at, len(df)),
+        )
 
-        # Get the geographical coordinates of the location
-        locations = nom.geocode(address)
-        if locations:
-            # Store the location name with its latitude and longitude
-            dic_addresses[location_name] = [
-                locations[0],
-                locations[1],
-            ]
+        # Create a hash column
+        df["hashed_id"] = compute_hashed_id(df)
+    count("rows_transformed", len(df), location=location_name)
 
-    return dic_addresses
+    return df
 
 
 def combine_transform_data(location_name, df, columns_to_keep, end_combined_df):
-    """
-    
-    """
+    """ """
     logger.info(f"Combining and transforming data for location: {location_name}")
 
     if df is not None:  # Ensure response is not empty or whitespace
-        # Add a column for the location name
-        df["location"] = location_name
-
-        df["inserted_at"] = datetime.datetime.now()
-
-        # Create a hash column
-        df["hashed_id"] = df.apply(
-            lambda x: hash(tuple(x[col] for col in df.columns if col != "id")),
-            axis=1,
-        )
-        df.drop_duplicates(subset=["id"])
+        df = transform_data(location_name, df)
 
         # Append the data to the combined DataFrame
         if end_combined_df is None:
@@ -93,25 +142,133 @@ def combine_transform_data(location_name, df, columns_to_keep, end_combined_df):
         return f"Empty response received for location: {location_name}.\n"
 
 
-def extract_data_return_df(url, location_name):
-    """
-    placeholder
+def stream_data_frames(url, location_name, chunk_rows=50000, rate_limiter=None):
+    """Parses the USGS csv response while it is downloaded.
+    Args:
+        url: formatted query url
+        location_name: name of the location, used for logging
+        chunk_rows: maximum number of rows of every yielded frame
+        rate_limiter: optional TokenBucket shared with the other USGS requests
+    Yields:
+        DataFrame: frames of at most chunk_rows rows typed with USGS_DTYPES
     """
+    logger.info(f"Extracting data for location: {location_name}")
+    cache = response_cache.get_default_cache()
+    if cache is not None:
+        # Past windows are read from disk without any request
+        with cache.open(url, rate_limiter=rate_limiter) as file:
+            yield from _read_frames(file, location_name, chunk_rows, "cache_read")
+        return
+
+    if rate_limiter is not None:
+        rate_limiter.acquire()
+    response = http_transport.get(url, stream=True)
+    try:
+        response.raise_for_status()  # Check for HTTP errors, after the retries
+        response.raw.decode_content = True  # Let urllib3 gunzip the stream
+        yield from _read_frames(response.raw, location_name, chunk_rows, "download")
+    finally:
+        response.close()
+
+
+class _MeteredReader(io.RawIOBase):
+    """Counts the bytes read from a file object and the time spent reading."""
+
+    def __init__(self, file):
+        self.file = file
+        self.bytes = 0
+        self.seconds = 0.0
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        started_at = time.perf_counter()
+        data = self.file.read(len(buffer))
+        self.seconds += time.perf_counter() - started_at
+        buffer[: len(data)] = data
+        self.bytes += len(data)
+        return len(data)
+
 
+def _read_frames(file, location_name, chunk_rows, source):
+    """Parses the csv of file in frames of chunk_rows rows. The time spent in
+    reading file is recorded as the span source, the rest as parse."""
+    reader = _MeteredReader(file)
     try:
-        logger.info(f"Extracting data for location: {location_name}")
-        response = requests.get(url)
-        response.raise_for_status()  # Check for HTTP errors
+        frames = pd.read_csv(
+            io.BufferedReader(reader), dtype=USGS_DTYPES, chunksize=chunk_rows
+        )
+    except pd.errors.EmptyDataError:
+        # A query without any event is answered 204 without a body
+        count("empty_responses", location=location_name)
+        yield empty_frame()
+        return
+    seconds = 0.0
+    try:
+        while True:
+            started_at = time.perf_counter()
+            chunk = next(frames, None)
+            if chunk is not None:
+                chunk = parse_time_columns(chunk)
+                count("rows_parsed", len(chunk), location=location_name)
+            seconds += time.perf_counter() - started_at
+            if chunk is None:
+                return
+            yield chunk
+    finally:
+        frames.close()
+        metrics.record_span(source, reader.seconds, location=location_name)
+        metrics.record_span("parse", seconds - reader.seconds, location=location_name)
+        count(f"{source}_bytes", reader.bytes, location=location_name)
+
 
-        logger.info(
-            f"Sleeping for 1 second."
-        )  # TODO update this to integrate time.sleep()
-        time.sleep(1)
+def extract_data_return_df(url, location_name, rate_limiter=None):
+    """Extracts the earthquakes of one query.
+    Args:
+        url: formatted query url
+        location_name: name of the location, used for logging
+        rate_limiter: optional TokenBucket shared with the other USGS requests
+    Returns:
+        DataFrame: events of the query typed with USGS_DTYPES
+    """
+
+    try:
+        frames = list(
+            stream_data_frames(
+                url=url, location_name=location_name, rate_limiter=rate_limiter
+            )
+        )
 
     except requests.HTTPError as ex:
         logger.error(f"HTTP error occurred for location {location_name}: {ex}")
+        raise
     except requests.Timeout:
         logger.error(f"Request timed out for location {location_name}.")
+        raise
     except requests.RequestException as ex:
         logger.error(f"Request exception occurred for location {location_name}: {ex}")
-    return pd.read_csv(StringIO(response.text))
+        raise
+    return stitch_frames(frames)
+
+
+def stitch_frames(frames):
+    """Concatenates the frames of the windows of one location.
+    Args:
+        frames: DataFrames in window order
+    Returns:
+        DataFrame: events of all frames, without the events repeated on the
+            window boundaries, an empty frame typed with USGS_DTYPES without
+            any frame
+    """
+    if not frames:
+        return empty_frame()
+    with span("concat"):
+        if len(frames) == 1:
+            df = frames[0]
+        else:
+            df = restore_categories(pd.concat(frames, ignore_index=True))
+        if "id" in df.columns:
+            df = df.drop_duplicates(subset=["id"], ignore_index=True)
+
+    return df
@@ -0,0 +1,125 @@
+"""Shared HTTP transport for the USGS and geocoder requests"""
+
+import threading
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from geopy.adapters import RequestsAdapter
+from functions.logger import count, get_logger
+
+logger = get_logger("http-transport")
+
+# Default settings, can be changed with configure()
+settings = {
+    "connect_timeout": 5,  # seconds to open the connection
+    "read_timeout": 60,  # seconds between two bytes of the response
+    "total_retries": 5,
+    "backoff_factor": 0.5,  # sleeps 0.5, 1, 2, 4... seconds between retries
+    "backoff_jitter": 0.5,  # random extra seconds added to every sleep
+    "pool_maxsize": 8,  # maximum number of open connections per host
+}
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def build_retry():
+    """Creates the retry policy: exponential backoff with jitter on 429 and 5xx
+    responses and connection errors, waiting for Retry-After when it is sent.
+    Returns:
+        Object: a urllib3 Retry
+    """
+    return Retry(
+        total=settings["total_retries"],
+        backoff_factor=settings["backoff_factor"],
+        backoff_jitter=settings["backoff_jitter"],
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=["GET"],
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+
+
+def build_session():
+    """Creates a session keeping the connections alive between requests.
+    Returns:
+        Object: a requests Session
+    """
+    session = requests.Session()
+    session.headers.update({"Accept-Encoding": "gzip"})
+
+    # pool_block caps the number of connections per host to pool_maxsize
+    adapter = HTTPAdapter(
+        pool_connections=4,
+        pool_maxsize=settings["pool_maxsize"],
+        pool_block=True,
+        max_retries=build_retry(),
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+
+    return session
+
+
+def get_session():
+    """Returns the session shared by the whole process, creating it on first use."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            logger.info("Create HTTP session.")
+            _session = build_session()
+        return _session
+
+
+def configure(**kwargs):
+    """Overrides the default settings. The shared session is rebuilt on next use.
+    Args:
+        kwargs: any key of settings
+    """
+    global _session
+    unknown = set(kwargs) - set(settings)
+    if unknown:
+        raise ValueError(f"Unknown transport settings: {sorted(unknown)}")
+
+    with _session_lock:
+        settings.update(kwargs)
+        if _session is not None:
+            _session.close()
+            _session = None
+
+
+def get(url, **kwargs):
+    """Sends a GET request through the shared session.
+    Args:
+        url: url to request
+        kwargs: passed to requests, the default timeout is used if none is given
+    Returns:
+        Object: a requests Response
+    """
+    kwargs.setdefault(
+        "timeout", (settings["connect_timeout"], settings["read_timeout"])
+    )
+
+    response = get_session().get(url, **kwargs)
+    host = urlsplit(url).hostname
+    count("http_requests", host=host, status=response.status_code)
+    retries = getattr(response.raw, "retries", None)
+    if retries is not None and retries.history:
+        count("http_retries", len(retries.history), host=host)
+
+    return response
+
+
+def geocoder_adapter_factory(proxies, ssl_context):
+    """geopy adapter factory using the same pooling and retry policy as get()."""
+    return RequestsAdapter(
+        proxies=proxies,
+        ssl_context=ssl_context,
+        pool_maxsize=settings["pool_maxsize"],
+        pool_block=True,
+        max_retries=build_retry(),
+    )
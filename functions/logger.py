@@ -1,7 +1,16 @@
-"""Create the format for logging"""
+"""Create the format for logging, and the per-stage metrics of a run"""
 
+import contextlib
+import contextvars
+import datetime
+import functools
+import json
 import logging
+import os
 import sys
+import threading
+import time
+import uuid
 
 
 logging.basicConfig(
@@ -10,6 +19,11 @@ logging.basicConfig(
     format="%(asctime)s %(levelname)-8s %(name)-20s %(message)s",
 )
 
+# Attributes of every LogRecord, the other ones come from extra=
+_RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+
 
 def get_logger(logger_name):
     """Takes the logger name and creates the logging format.
@@ -19,3 +33,221 @@ def get_logger(logger_name):
         Object: a logging object
     """
     return logging.getLogger(logger_name)
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats every record as one JSON object, with the extra= fields."""
+
+    def format(self, record):
+        entry = {
+            "ts": datetime.datetime.fromtimestamp(
+                record.created, datetime.timezone.utc
+            ).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        entry.update(
+            {
+                key: value
+                for key, value in vars(record).items()
+                if key not in _RECORD_ATTRIBUTES
+            }
+        )
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+
+        return json.dumps(entry, default=str)
+
+
+def configure_logging(log_format="text", level=logging.INFO, trace_spans=False):
+    """Switches the root handlers between the text format and JSON lines.
+    Args:
+        log_format: "text" or "json"
+        level: logging level of the root logger
+        trace_spans: logs every timing span, not only the run summary
+    """
+    if log_format not in ("text", "json"):
+        raise ValueError(f"Unknown log format: {log_format}")
+    root = logging.getLogger()
+    root.setLevel(level)
+    logging.getLogger("metrics").setLevel(logging.DEBUG if trace_spans else level)
+    for handler in root.handlers:
+        if log_format == "json":
+            handler.setFormatter(JsonFormatter())
+        else:
+            handler.setFormatter(
+                logging.Formatter("%(asctime)s %(levelname)-8s %(name)-20s %(message)s")
+            )
+
+
+def _escape(value):
+    """Escapes a Prometheus label value."""
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _label_key(labels):
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+class Metrics:
+    """Counters and timing spans of a run, aggregated per name and labels."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.spans = {}
+
+    def count(self, name, value=1, **labels):
+        """Adds value to the counter name, e.g. count("rows", 500, stage="parse")."""
+        key = (name, _label_key(labels))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def record_span(self, name, seconds, **labels):
+        """Adds one timing of the span name."""
+        key = (name, _label_key(labels))
+        with self._lock:
+            span = self.spans.setdefault(key, {"count": 0, "total": 0.0, "max": 0.0})
+            span["count"] += 1
+            span["total"] += seconds
+            span["max"] = max(span["max"], seconds)
+
+    def reset(self):
+        with self._lock:
+            self.counters.clear()
+            self.spans.clear()
+
+    def summary_table(self):
+        """Formats the spans, slowest first, and the counters as a text table."""
+        with self._lock:
+            spans = sorted(self.spans.items(), key=lambda item: -item[1]["total"])
+            counters = sorted(self.counters.items())
+
+        def labels_text(labels):
+            return ",".join(f"{key}={value}" for key, value in labels)
+
+        lines = [f"{'span':<24}{'labels':<32}{'calls':>8}{'total s':>12}{'max s':>10}"]
+        for (name, labels), span in spans:
+            lines.append(
+                f"{name:<24}{labels_text(labels):<32}{span['count']:>8}"
+                f"{span['total']:>12.3f}{span['max']:>10.3f}"
+            )
+        lines.append(f"{'counter':<24}{'labels':<32}{'value':>30}")
+        for (name, labels), value in counters:
+            lines.append(f"{name:<24}{labels_text(labels):<32}{value:>30,}")
+
+        return "\n".join(lines)
+
+    def to_prometheus(self, prefix="earthquake_pipeline"):
+        """Formats the metrics in the Prometheus text exposition format."""
+
+        def labels_text(labels):
+            if not labels:
+                return ""
+            return (
+                "{"
+                + ",".join(f'{key}="{_escape(value)}"' for key, value in labels)
+                + "}"
+            )
+
+        with self._lock:
+            spans = sorted(self.spans.items())
+            counters = sorted(self.counters.items())
+
+        lines = []
+        for name in sorted({name for (name, _), _ in counters}):
+            lines.append(f"# TYPE {prefix}_{name}_total counter")
+            for (counter, labels), value in counters:
+                if counter == name:
+                    lines.append(f"{prefix}_{name}_total{labels_text(labels)} {value}")
+        for name in sorted({name for (name, _), _ in spans}):
+            metric = f"{prefix}_{name}_seconds"
+            lines.append(f"# TYPE {metric} summary")
+            for (span_name, labels), span in spans:
+                if span_name == name:
+                    lines.append(f"{metric}_sum{labels_text(labels)} {span['total']}")
+                    lines.append(f"{metric}_count{labels_text(labels)} {span['count']}")
+
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path, prefix="earthquake_pipeline"):
+        """Writes to_prometheus() to path, e.g. for the node exporter textfile
+        collector, replacing the previous file atomically."""
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as file:
+            file.write(self.to_prometheus(prefix))
+        os.replace(tmp_path, path)
+
+
+# Metrics of the whole process
+metrics = Metrics()
+_span_logger = get_logger("metrics")
+
+
+@contextlib.contextmanager
+def span(name, **labels):
+    """Times the block as the span name and logs it with its parent span.
+    Args:
+        name: name of the span, e.g. "download"
+        labels: dimensions of the span, e.g. location="pleo_dk"
+    """
+    parent = _current_span.get()
+    span_id = uuid.uuid4().hex[:16]
+    token = _current_span.set(span_id)
+    started_at = time.perf_counter()
+    status = "ok"
+    try:
+        yield
+    except BaseException:
+        status = "error"
+        raise
+    finally:
+        seconds = time.perf_counter() - started_at
+        with contextlib.suppress(ValueError):
+            # A generator closed from another context cannot reset it
+            _current_span.reset(token)
+        metrics.record_span(name, seconds, **labels)
+        _span_logger.debug(
+            f"{name} took {seconds:.3f} s",
+            extra={
+                "event": "span",
+                "span": name,
+                "span_id": span_id,
+                "parent_id": parent,
+                "duration_s": round(seconds, 6),
+                "status": status,
+                **{
+                    key: value
+                    for key, value in labels.items()
+                    if key not in _RECORD_ATTRIBUTES
+                },
+            },
+        )
+
+
+def timed(name):
+    """Decorator timing every call of the function as the span name."""
+
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def count(name, value=1, **labels):
+    """Adds value to a counter of the process metrics."""
+    metrics.count(name, value, **labels)
+
+
+def log_summary(logger=None):
+    """Logs the summary table of the process metrics."""
+    (logger or _span_logger).info("Run summary\n" + metrics.summary_table())
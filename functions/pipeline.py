@@ -0,0 +1,132 @@
+"""Run the pipeline steps concurrently, linked by bounded queues"""
+
+import queue
+import threading
+from collections import namedtuple
+
+from functions.logger import count, get_logger, span
+
+logger = get_logger("pipeline")
+
+# function is called with every item of the previous stage and returns the
+# item handed to the next stage, None to hand nothing
+Stage = namedtuple("Stage", ["name", "function", "workers"])
+
+_END = object()  # marks the end of the items on a queue
+_POLL_SECONDS = 0.1
+
+
+class _Stop(Exception):
+    """Raised in the threads once another stage has failed."""
+
+
+def _put(item_queue, item, stop):
+    # put() with a timeout, so a full queue does not block the shutdown
+    while True:
+        if stop.is_set():
+            raise _Stop()
+        try:
+            item_queue.put(item, timeout=_POLL_SECONDS)
+            return
+        except queue.Full:
+            continue
+
+
+def _get(item_queue, stop):
+    while True:
+        if stop.is_set():
+            raise _Stop()
+        try:
+            return item_queue.get(timeout=_POLL_SECONDS)
+        except queue.Empty:
+            continue
+
+
+def run_pipeline(source, stages, queue_size=2):
+    """Feeds the items of source through the stages, every stage running in its
+    own threads. A stage works on item N while the previous one produces item
+    N+1. The queues between the stages hold at most queue_size items, so a
+    slow stage makes the previous ones wait instead of piling up frames.
+    Args:
+        source: iterable of items, e.g. a generator of extracted frames
+        stages: Stage tuples, in order
+        queue_size: maximum number of items waiting between two stages
+    Raises:
+        Exception: the first error of a stage, after every thread stopped
+    """
+    queues = [queue.Queue(maxsize=queue_size) for _ in stages]
+    stop = threading.Event()
+    errors = []
+    errors_lock = threading.Lock()
+
+    def fail(stage_name, ex):
+        with errors_lock:
+            errors.append(ex)
+        if not stop.is_set():
+            logger.error(f"Stage {stage_name} failed, stopping the pipeline: {ex}")
+        stop.set()
+
+    def produce():
+        try:
+            for item in source:
+                _put(queues[0], item, stop)
+                count("pipeline_items", stage="source")
+            for _ in range(stages[0].workers):
+                _put(queues[0], _END, stop)
+        except _Stop:
+            pass
+        except Exception as ex:
+            fail("source", ex)
+        finally:
+            close = getattr(source, "close", None)
+            if close is not None:
+                # Stops a generator source, e.g. cancels its pending requests
+                close()
+
+    def work(index, stage, finished):
+        next_queue = queues[index + 1] if index + 1 < len(stages) else None
+        try:
+            while True:
+                item = _get(queues[index], stop)
+                if item is _END:
+                    break
+                with span("pipeline_stage", stage=stage.name):
+                    result = stage.function(item)
+                count("pipeline_items", stage=stage.name)
+                if result is not None and next_queue is not None:
+                    _put(next_queue, result, stop)
+            # The last worker of the stage closes the next queue
+            if finished() and next_queue is not None:
+                for _ in range(stages[index + 1].workers):
+                    _put(next_queue, _END, stop)
+        except _Stop:
+            pass
+        except Exception as ex:
+            fail(stage.name, ex)
+
+    threads = [threading.Thread(target=produce, name="pipeline-source")]
+    for index, stage in enumerate(stages):
+        remaining = [stage.workers]
+        remaining_lock = threading.Lock()
+
+        def finished(remaining=remaining, remaining_lock=remaining_lock):
+            with remaining_lock:
+                remaining[0] -= 1
+                return remaining[0] == 0
+
+        threads.extend(
+            threading.Thread(
+                target=work,
+                args=(index, stage, finished),
+                name=f"pipeline-{stage.name}-{worker}",
+            )
+            for worker in range(stage.workers)
+        )
+
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    if errors:
+        raise errors[0]
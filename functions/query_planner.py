@@ -0,0 +1,138 @@
+"""Split the extraction date range in windows that stay under the USGS row limit"""
+
+import datetime
+import math
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+from functions import http_transport, response_cache
+from functions.logger import get_logger, span
+
+logger = get_logger("query-planner")
+
+TIME_FORMAT = "%Y-%m-%dT%H:%M:%S"
+
+
+@lru_cache(maxsize=None)
+def count_window(url, rate_limiter=None):
+    """Asks the USGS count endpoint how many events match the url.
+    Results are cached per url, so the same window is only probed once per run,
+    and in the default response cache across runs.
+    Args:
+        url: formatted count url
+        rate_limiter: optional TokenBucket, acquired only before an actual
+            request, not for the probes answered by a cache
+    Returns:
+        int: number of matching events
+    """
+    with span("count_probe"):
+        cache = response_cache.get_default_cache()
+        if cache is not None:
+            return int(cache.read_text(url, rate_limiter=rate_limiter))
+
+        if rate_limiter is not None:
+            rate_limiter.acquire()
+        response = http_transport.get(url)
+        response.raise_for_status()
+
+        return int(response.text)
+
+
+def _split_window(window_start, window_end, n_events, limit, fill_ratio):
+    """Splits a window in equal parts sized so that each one should hold at most
+    fill_ratio * limit events, assuming the events are evenly spread."""
+    n_parts = max(2, math.ceil(n_events / (limit * fill_ratio)))
+    step = (window_end - window_start) / n_parts
+    boundaries = [window_start + step * i for i in range(n_parts)] + [window_end]
+    boundaries = [boundary.replace(microsecond=0) for boundary in boundaries]
+
+    return [
+        (boundaries[i], boundaries[i + 1])
+        for i in range(n_parts)
+        if boundaries[i] < boundaries[i + 1]
+    ]
+
+
+def plan_time_windows(
+    count_url_template,
+    start_time,
+    end_time,
+    latitude,
+    longitude,
+    maxradiuskm,
+    limit,
+    max_workers=4,
+    fill_ratio=0.8,
+    min_window=datetime.timedelta(minutes=1),
+    rate_limiter=None,
+):
+    """Splits start_time..end_time in windows holding at most limit events.
+    Every window is probed with the count endpoint, the ones above the limit are
+    split again and the ones without any event are dropped. All the probes of
+    one round run in parallel.
+    Args:
+        count_url_template: count url with start_time, end_time, latitude,
+            longitude and maxradiuskm placeholders
+        start_time, end_time: ISO8601 date range of the extraction
+        latitude, longitude, maxradiuskm: circle of the extraction
+        limit: maximum number of rows returned by one query
+        max_workers: number of parallel count probes
+        fill_ratio: share of the limit targeted when splitting a window
+        min_window: windows shorter than this are not split any further
+        rate_limiter: optional TokenBucket shared with the other USGS requests
+    Returns:
+        list: (start_time, end_time) tuples formatted as ISO8601, in time order,
+            empty when no event matches
+    """
+    pending = [
+        (
+            datetime.datetime.fromisoformat(start_time),
+            datetime.datetime.fromisoformat(end_time),
+        )
+    ]
+    windows = []
+
+    def probe(url):
+        return count_window(url, rate_limiter)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while pending:
+            urls = [
+                count_url_template.format(
+                    start_time=window_start.strftime(TIME_FORMAT),
+                    end_time=window_end.strftime(TIME_FORMAT),
+                    latitude=latitude,
+                    longitude=longitude,
+                    maxradiuskm=maxradiuskm,
+                )
+                for window_start, window_end in pending
+            ]
+            counts = list(executor.map(probe, urls))
+
+            next_pending = []
+            for (window_start, window_end), n_events in zip(pending, counts):
+                if n_events == 0:
+                    continue  # nothing to fetch, e.g. no update since a watermark
+                if n_events <= limit:
+                    windows.append((window_start, window_end))
+                elif window_end - window_start <= min_window:
+                    logger.warning(
+                        f"{n_events} events between {window_start} and {window_end}, "
+                        f"only the first {limit} will be extracted."
+                    )
+                    windows.append((window_start, window_end))
+                else:
+                    next_pending.extend(
+                        _split_window(
+                            window_start, window_end, n_events, limit, fill_ratio
+                        )
+                    )
+            pending = next_pending
+
+    windows.sort()
+    logger.info(f"Extraction split in {len(windows)} time windows.")
+
+    return [
+        (window_start.strftime(TIME_FORMAT), window_end.strftime(TIME_FORMAT))
+        for window_start, window_end in windows
+    ]
@@ -0,0 +1,34 @@
+"""Token bucket shared by the requests sent to the same service"""
+
+import threading
+import time
+
+
+class TokenBucket:
+    """Thread safe token bucket shared by every request sent to the same host.
+    Args:
+        rate: tokens added per second
+        capacity: maximum number of tokens, i.e. the allowed burst
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Blocks until a token is available and takes it."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(
+                    self.capacity, self._tokens + (now - self._updated_at) * self.rate
+                )
+                self._updated_at = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
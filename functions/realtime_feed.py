@@ -0,0 +1,147 @@
+"""Poll the USGS real-time GeoJSON summary feeds with conditional requests"""
+
+import hashlib
+import json
+
+import numpy as np
+import pandas as pd
+from functions import http_transport
+from functions.logger import count, get_logger, span
+from functions.region_planner import KM_PER_DEGREE, QueryRegion, assign_locations
+from functions.usgs_schema import CSV_COLUMNS, TIME_COLUMNS, USGS_DTYPES
+
+logger = get_logger("realtime-feed")
+
+# https://earthquake.usgs.gov/earthquakes/feed/v1.0/geojson.php, e.g. all_hour,
+# 2.5_day or significant_week. They are regenerated every minute.
+FEED_PATH = "/earthquakes/feed/v1.0/summary/{feed}.geojson"
+
+# Properties of a feed feature with a column of the csv format. The csv columns
+# missing in the feeds, e.g. the errors and the sources, are left empty.
+FEED_PROPERTIES = [
+    "mag",
+    "magType",
+    "nst",
+    "gap",
+    "dmin",
+    "rms",
+    "net",
+    "updated",
+    "place",
+    "type",
+    "status",
+    "time",
+]
+
+# Circle covering the whole globe, the feeds are not filtered by location
+GLOBE_RADIUS_KM = 180 * KM_PER_DEGREE
+
+
+def feed_url(base_url, feed):
+    """Url of a summary feed of the USGS server at base_url."""
+    return base_url + FEED_PATH.format(feed=feed)
+
+
+def parse_feed(body):
+    """Converts a GeoJSON summary feed to the columns of the csv format.
+    Args:
+        body: bytes of the feed
+    Returns:
+        DataFrame: events of the feed typed with USGS_DTYPES, in CSV_COLUMNS
+            order, with UTC timestamp time columns
+    """
+    features = json.loads(body)["features"]
+    properties = [feature["properties"] for feature in features]
+    coordinates = [feature["geometry"]["coordinates"] for feature in features]
+    columns = {
+        "id": [feature["id"] for feature in features],
+        # GeoJSON positions are longitude, latitude, depth
+        "longitude": [position[0] for position in coordinates],
+        "latitude": [position[1] for position in coordinates],
+        "depth": [position[2] for position in coordinates],
+        **{col: [values.get(col) for values in properties] for col in FEED_PROPERTIES},
+    }
+    df = pd.DataFrame(
+        {col: columns.get(col, [None] * len(features)) for col in CSV_COLUMNS}
+    ).astype({col: USGS_DTYPES[col] for col in CSV_COLUMNS if col not in TIME_COLUMNS})
+    for col in TIME_COLUMNS:
+        # Milliseconds since the epoch
+        df[col] = pd.to_datetime(df[col].astype("float64"), unit="ms", utc=True)
+
+    return df
+
+
+def locate_events(df, dic_addresses, maxradiuskm):
+    """Splits the events of a feed between the locations they are within
+    maxradiuskm of, with one distance matrix of every event to every office.
+    Args:
+        df: events with latitude and longitude columns
+        dic_addresses: location name -> [latitude, longitude]
+        maxradiuskm: radius around every location
+    Returns:
+        dict: location name -> DataFrame, only the locations with events
+    """
+    region = QueryRegion(0.0, 0.0, GLOBE_RADIUS_KM, list(dic_addresses))
+    located = assign_locations(df, region, dic_addresses, maxradiuskm)
+
+    return {name: events for name, events in located.items() if len(events)}
+
+
+class FeedPoller:
+    """Requests a summary feed with the ETag and Last-Modified of the previous
+    response. The feed is only downloaded and parsed when it changed, an
+    unchanged feed is answered 304 without a body, and only the events new or
+    updated since the previous poll are returned. The first poll returns the
+    whole feed.
+    Args:
+        url: url of the GeoJSON feed, see feed_url
+    """
+
+    def __init__(self, url):
+        self.url = url
+        self._etag = None
+        self._last_modified = None
+        self._digest = None
+        # Updated time in milliseconds of the events of the last feed, by id,
+        # the events leaving the feed are forgotten
+        self._seen = pd.Series(dtype="int64")
+
+    def poll(self):
+        """Requests the feed once.
+        Returns:
+            DataFrame: events new or updated since the previous poll, None when
+                the feed did not change
+        """
+        headers = {}
+        if self._etag:
+            headers["If-None-Match"] = self._etag
+        if self._last_modified:
+            headers["If-Modified-Since"] = self._last_modified
+
+        with span("feed_request"):
+            response = http_transport.get(self.url, headers=headers)
+        if response.status_code == 304:
+            count("feed_not_modified")
+            return None
+        response.raise_for_status()  # Check for HTTP errors, after the retries
+        self._etag = response.headers.get("ETag")
+        self._last_modified = response.headers.get("Last-Modified")
+
+        # A server without validators sends the same body again
+        digest = hashlib.sha256(response.content).digest()
+        if digest == self._digest:
+            count("feed_not_modified")
+            return None
+        self._digest = digest
+
+        with span("feed_parse"):
+            df = parse_feed(response.content)
+        count("feed_events", len(df))
+        df = df.drop_duplicates(subset=["id"], keep="last", ignore_index=True)
+        updated = df["updated"].array.asi8 // 10**6
+        previous = self._seen.reindex(df["id"].to_numpy()).to_numpy(dtype="float64")
+        self._seen = pd.Series(updated, index=df["id"].to_numpy())
+        df = df[np.isnan(previous) | (updated > previous)].reset_index(drop=True)
+        count("feed_new_events", len(df))
+
+        return df
@@ -0,0 +1,147 @@
+"""Merge the overlapping location circles in fewer USGS queries"""
+
+from collections import namedtuple
+
+import numpy as np
+from functions.logger import get_logger
+
+logger = get_logger("region-planner")
+
+# The FDSN event service converts maxradiuskm to degrees with 111.12 km per degree
+KM_PER_DEGREE = 111.12
+
+# Circle sent to USGS and the locations whose events it contains
+QueryRegion = namedtuple(
+    "QueryRegion", ["latitude", "longitude", "radiuskm", "location_names"]
+)
+
+
+def haversine_km(latitude_1, longitude_1, latitude_2, longitude_2):
+    """Great circle distance between points, broadcast like numpy arrays.
+    Args:
+        latitude_1, longitude_1, latitude_2, longitude_2: degrees
+    Returns:
+        ndarray: distances in km
+    """
+    lat_1, lon_1, lat_2, lon_2 = (
+        np.radians(np.asarray(value, dtype="float64"))
+        for value in (latitude_1, longitude_1, latitude_2, longitude_2)
+    )
+    a = (
+        np.sin((lat_2 - lat_1) / 2) ** 2
+        + np.cos(lat_1) * np.cos(lat_2) * np.sin((lon_2 - lon_1) / 2) ** 2
+    )
+    return np.degrees(2 * np.arcsin(np.sqrt(np.clip(a, 0, 1)))) * KM_PER_DEGREE
+
+
+def _spherical_center(latitudes, longitudes):
+    """Normalized mean of the points on the unit sphere."""
+    lat, lon = np.radians(latitudes), np.radians(longitudes)
+    x, y, z = (
+        np.mean(np.cos(lat) * np.cos(lon)),
+        np.mean(np.cos(lat) * np.sin(lon)),
+        np.mean(np.sin(lat)),
+    )
+    return (
+        float(np.degrees(np.arctan2(z, np.hypot(x, y)))),
+        float(np.degrees(np.arctan2(y, x))),
+    )
+
+
+def _enclosing_region(dic_addresses, location_names, maxradiuskm):
+    """Smallest circle around the spherical center covering every member circle."""
+    latitudes = np.array([dic_addresses[name][0] for name in location_names])
+    longitudes = np.array([dic_addresses[name][1] for name in location_names])
+    if len(location_names) == 1:
+        return QueryRegion(
+            float(latitudes[0]), float(longitudes[0]), maxradiuskm, location_names
+        )
+
+    latitude, longitude = _spherical_center(latitudes, longitudes)
+    radiuskm = float(haversine_km(latitude, longitude, latitudes, longitudes).max())
+
+    return QueryRegion(latitude, longitude, radiuskm + maxradiuskm, location_names)
+
+
+def plan_query_regions(dic_addresses, maxradiuskm, max_area_ratio=1.25):
+    """Groups the locations whose circles overlap and queries every group with
+    one circle enclosing all of them. A group is only merged when the area of
+    the enclosing circle is at most max_area_ratio times the area of the member
+    circles together, which is what querying them separately downloads since
+    the overlaps are downloaded once per location.
+    Args:
+        dic_addresses: location name -> [latitude, longitude]
+        maxradiuskm: radius around every location
+        max_area_ratio: largest area increase accepted to save requests
+    Returns:
+        list: QueryRegion, every location belongs to exactly one region
+    """
+    names = list(dic_addresses)
+    latitudes = np.array([dic_addresses[name][0] for name in names])
+    longitudes = np.array([dic_addresses[name][1] for name in names])
+    distances = haversine_km(
+        latitudes[:, None], longitudes[:, None], latitudes[None, :], longitudes[None, :]
+    )
+
+    # Union-find over the pairs of overlapping circles
+    parents = list(range(len(names)))
+
+    def find(i):
+        while parents[i] != i:
+            parents[i] = parents[parents[i]]
+            i = parents[i]
+        return i
+
+    for i, j in zip(*np.nonzero(np.triu(distances < 2 * maxradiuskm, k=1))):
+        parents[find(i)] = find(j)
+
+    groups = {}
+    for i, name in enumerate(names):
+        groups.setdefault(find(i), []).append(name)
+
+    regions = []
+    for location_names in groups.values():
+        region = _enclosing_region(dic_addresses, location_names, maxradiuskm)
+        if region.radiuskm**2 <= max_area_ratio * len(location_names) * maxradiuskm**2:
+            regions.append(region)
+        else:
+            regions.extend(
+                _enclosing_region(dic_addresses, [name], maxradiuskm)
+                for name in location_names
+            )
+
+    logger.info(f"{len(names)} locations queried with {len(regions)} regions.")
+
+    return regions
+
+
+def assign_locations(df, region, dic_addresses, maxradiuskm):
+    """Splits the events of a region between its locations. An event goes to
+    every location it is within maxradiuskm of.
+    Args:
+        df: events of the region, with latitude and longitude columns
+        region: QueryRegion the events were extracted with
+        dic_addresses: location name -> [latitude, longitude]
+        maxradiuskm: radius around every location
+    Returns:
+        dict: location name -> DataFrame, in the order of region.location_names
+    """
+    if len(region.location_names) == 1 and region.radiuskm == maxradiuskm:
+        return {region.location_names[0]: df}
+
+    office_latitudes = np.array([dic_addresses[n][0] for n in region.location_names])
+    office_longitudes = np.array([dic_addresses[n][1] for n in region.location_names])
+
+    # (event, office) distance matrix
+    distances = haversine_km(
+        df["latitude"].to_numpy()[:, None],
+        df["longitude"].to_numpy()[:, None],
+        office_latitudes[None, :],
+        office_longitudes[None, :],
+    )
+    within = distances <= maxradiuskm
+
+    return {
+        location_name: df[within[:, i]].reset_index(drop=True)
+        for i, location_name in enumerate(region.location_names)
+    }
@@ -0,0 +1,304 @@
+"""On-disk cache of the USGS query and count responses"""
+
+import datetime
+import gzip
+import hashlib
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+from functions import http_transport
+from functions.logger import count, get_logger, span
+
+logger = get_logger("response-cache")
+
+# Filters on the time of the last update of the events. The events they match
+# change with every update, whatever the age of the window
+OPEN_ENDED_PARAMETERS = ("updatedafter",)
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def normalize_url(url):
+    """Sorts the query parameters and lower cases their names, so that the same
+    query written in another order hits the same cache entry."""
+    parts = urlsplit(url)
+    params = sorted((key.lower(), value) for key, value in parse_qsl(parts.query))
+
+    return f"{parts.scheme}://{parts.netloc.lower()}{parts.path}?{urlencode(params)}"
+
+
+def cache_key(url):
+    """SHA-256 of the normalized url, the name of the cached payload."""
+    return hashlib.sha256(normalize_url(url).encode()).hexdigest()
+
+
+def _query_params(url):
+    return {key.lower(): value for key, value in parse_qsl(urlsplit(url).query)}
+
+
+def window_end(url):
+    """Returns the endtime of the query as a naive UTC datetime, None if the
+    query has no end."""
+    params = _query_params(url)
+    if "endtime" not in params:
+        return None
+    end = datetime.datetime.fromisoformat(params["endtime"].replace("Z", "+00:00"))
+    if end.tzinfo is not None:
+        end = end.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+
+    return end
+
+
+class ResponseCache:
+    """Gzip compressed response bodies stored under root, indexed in SQLite.
+    A window that had already ended immutable_after before it was fetched is
+    never requested again, unless the query filters on the update time of the
+    events (updatedafter). Any other entry is revalidated with a conditional
+    request once it is older than max_age. The least recently used entries
+    are evicted when the payloads exceed max_bytes.
+    Args:
+        root: directory of the cache, created if missing
+        max_bytes: maximum total size of the compressed payloads
+        immutable_after: age of a window after which its events are final
+        max_age: seconds a mutable entry is served without revalidation
+    """
+
+    def __init__(
+        self,
+        root,
+        max_bytes=2 * 1024**3,
+        immutable_after=datetime.timedelta(days=30),
+        max_age=0,
+    ):
+        os.makedirs(os.path.join(root, "objects"), exist_ok=True)
+        self.root = root
+        self.max_bytes = max_bytes
+        self.immutable_after = immutable_after
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(
+            os.path.join(root, "index.sqlite"), check_same_thread=False
+        )
+        with self._connection:
+            self._connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    url TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    immutable INTEGER NOT NULL,
+                    etag TEXT,
+                    last_modified TEXT,
+                    fetched_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL
+                )
+                """
+            )
+
+    def payload_path(self, key):
+        return os.path.join(self.root, "objects", key[:2], f"{key}.gz")
+
+    def _entry(self, key):
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT immutable, etag, last_modified, fetched_at FROM responses "
+                "WHERE key = ?",
+                (key,),
+            ).fetchone()
+        if row is None or not os.path.exists(self.payload_path(key)):
+            return None
+
+        return {
+            "immutable": bool(row[0]),
+            "etag": row[1],
+            "last_modified": row[2],
+            "fetched_at": row[3],
+        }
+
+    def _is_immutable(self, url, fetched_at):
+        if any(param in _query_params(url) for param in OPEN_ENDED_PARAMETERS):
+            return False
+        end = window_end(url)
+        if end is None:
+            return False
+        fetched_at = datetime.datetime.fromtimestamp(
+            fetched_at, datetime.timezone.utc
+        ).replace(tzinfo=None)
+
+        return end <= fetched_at - self.immutable_after
+
+    def _touch(self, key, url=None, fetched_at=None):
+        """Marks an entry as used, and as revalidated at fetched_at when given.
+        A revalidated window may have become old enough to be immutable."""
+        with self._lock, self._connection:
+            if fetched_at is None:
+                self._connection.execute(
+                    "UPDATE responses SET accessed_at = ? WHERE key = ?",
+                    (time.time(), key),
+                )
+            else:
+                self._connection.execute(
+                    "UPDATE responses SET accessed_at = ?, fetched_at = ?, "
+                    "immutable = ? WHERE key = ?",
+                    (
+                        time.time(),
+                        fetched_at,
+                        self._is_immutable(url, fetched_at),
+                        key,
+                    ),
+                )
+
+    def _store(self, key, url, response, fetched_at):
+        path = self.payload_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        try:
+            with gzip.open(tmp_path, "wb", compresslevel=5) as file:
+                for block in response.iter_content(chunk_size=1024 * 1024):
+                    file.write(block)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        with self._lock, self._connection:
+            self._connection.execute(
+                """
+                INSERT OR REPLACE INTO responses
+                (key, url, size, immutable, etag, last_modified, fetched_at,
+                 accessed_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                (
+                    key,
+                    url,
+                    os.path.getsize(path),
+                    self._is_immutable(url, fetched_at),
+                    response.headers.get("ETag"),
+                    response.headers.get("Last-Modified"),
+                    fetched_at,
+                    time.time(),
+                ),
+            )
+        self.evict(keep=key)
+
+    def _fetch(self, key, url, entry, rate_limiter):
+        headers = {}
+        if entry is not None:
+            if entry["etag"]:
+                headers["If-None-Match"] = entry["etag"]
+            if entry["last_modified"]:
+                headers["If-Modified-Since"] = entry["last_modified"]
+        if rate_limiter is not None:
+            rate_limiter.acquire()
+
+        fetched_at = time.time()
+        with span("download"):
+            self._download(key, url, entry, headers, fetched_at)
+
+    def _download(self, key, url, entry, headers, fetched_at):
+        response = http_transport.get(url, headers=headers, stream=True)
+        try:
+            if entry is not None and response.status_code == 304:
+                logger.info(f"Cached response of {url} is still valid.")
+                count("response_cache_revalidated")
+                self._touch(key, url, fetched_at)
+                return
+            response.raise_for_status()  # Check for HTTP errors, after the retries
+            self._store(key, url, response, fetched_at)
+            count(
+                "response_cache_misses" if entry is None else "response_cache_refreshed"
+            )
+        finally:
+            response.close()
+
+    def open(self, url, rate_limiter=None):
+        """Opens the body of the response to url, requesting it only if the
+        cached copy is missing or has to be revalidated.
+        Args:
+            url: url to request
+            rate_limiter: optional TokenBucket, acquired before any request
+        Returns:
+            Object: binary file object of the decoded body
+        """
+        key = cache_key(url)
+        entry = self._entry(key)
+        if entry is not None and (
+            entry["immutable"] or time.time() - entry["fetched_at"] < self.max_age
+        ):
+            count("response_cache_hits")
+            self._touch(key)
+        else:
+            self._fetch(key, url, entry, rate_limiter)
+
+        return gzip.open(self.payload_path(key), "rb")
+
+    def read_text(self, url, rate_limiter=None):
+        """Returns the body of the response to url as text, see open()."""
+        with self.open(url, rate_limiter=rate_limiter) as file:
+            return file.read().decode("utf-8")
+
+    def size(self):
+        """Total size in bytes of the compressed payloads."""
+        with self._lock:
+            return self._connection.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM responses"
+            ).fetchone()[0]
+
+    def evict(self, keep=None):
+        """Removes the least recently used entries until the payloads fit in
+        max_bytes.
+        Args:
+            keep: optional key never evicted, the entry just stored
+        """
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT key, size FROM responses ORDER BY accessed_at DESC"
+            ).fetchall()
+            total = 0
+            evicted = []
+            for key, size in rows:
+                total += size
+                if total > self.max_bytes and key != keep:
+                    evicted.append(key)
+                    total -= size
+            with self._connection:
+                self._connection.executemany(
+                    "DELETE FROM responses WHERE key = ?", [(key,) for key in evicted]
+                )
+        for key in evicted:
+            if os.path.exists(self.payload_path(key)):
+                os.remove(self.payload_path(key))
+        if evicted:
+            logger.info(f"Evicted {len(evicted)} cached responses.")
+
+    def clear(self):
+        """Removes every entry."""
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM responses")
+            shutil.rmtree(os.path.join(self.root, "objects"))
+            os.makedirs(os.path.join(self.root, "objects"))
+
+    def close(self):
+        self._connection.close()
+
+
+def set_default_cache(cache):
+    """Sets the cache used by the USGS requests of the whole process, None to
+    disable caching."""
+    global _default_cache
+    with _default_cache_lock:
+        _default_cache = cache
+
+
+def get_default_cache():
+    """Returns the cache set with set_default_cache(), None if there is none."""
+    with _default_cache_lock:
+        return _default_cache
@@ -0,0 +1,321 @@
+"""Daily rollups of the curated earthquakes, maintained batch by batch"""
+
+import os
+import uuid
+
+import numpy as np
+import pandas as pd
+from functions.dedup_index import key_hashes
+from functions.logger import count, get_logger, span
+
+logger = get_logger("rollups")
+
+# Table of the rollups, in the curated dataset, one row per key
+ROLLUP_TABLE = "earthquakes_daily"
+ROLLUP_KEY_COLUMNS = ["location", "day", "mag_bucket"]
+ROLLUP_COLUMNS = ROLLUP_KEY_COLUMNS + [
+    "n_events",
+    "max_mag",
+    "mean_depth",
+    "sum_depth",
+    "n_depth",
+]
+
+# Bucket of the events without a magnitude, the others are floor(mag)
+UNKNOWN_MAG_BUCKET = -10
+
+# Partial aggregates of a group. They merge by adding n_events, sum_depth and
+# n_depth and by taking the largest max_mag, so a batch is folded in without
+# reading the rows already aggregated.
+SUM_COLUMNS = ["n_events", "sum_depth", "n_depth"]
+
+# A group is one int64: location code, day since 1970 and magnitude bucket
+_DAY_OFFSET = 2**23
+
+
+def _group_ids(location_codes, days, buckets):
+    return (
+        (location_codes.astype("int64") << 32)
+        | ((days.astype("int64") + _DAY_OFFSET) << 8)
+        | (buckets.astype("int64") + 128)
+    )
+
+
+def mag_buckets(mag):
+    """Magnitude bucket of every event, the integer part of its magnitude."""
+    buckets = np.floor(np.asarray(mag, dtype="float64"))
+    return np.where(np.isnan(buckets), UNKNOWN_MAG_BUCKET, buckets).astype("int64")
+
+
+def partial_aggregates(group_ids, mag, depth):
+    """Aggregates events per group.
+    Args:
+        group_ids: int64 group of every event
+        mag: magnitude of every event
+        depth: depth of every event
+    Returns:
+        DataFrame: SUM_COLUMNS and max_mag, indexed by group
+    """
+    grouped = pd.DataFrame({"group": group_ids, "mag": mag, "depth": depth}).groupby(
+        "group", sort=False
+    )
+    return pd.DataFrame(
+        {
+            "n_events": grouped.size(),
+            "sum_depth": grouped["depth"].sum(),
+            "n_depth": grouped["depth"].count(),
+            "max_mag": grouped["mag"].max(),
+        }
+    )
+
+
+def merge_partials(partials):
+    """Merges partial aggregates of the same groups.
+    Args:
+        partials: partial aggregates indexed by group, negative sums remove
+            events
+    Returns:
+        DataFrame: aggregates of the events of all partials
+    """
+    return (
+        pd.concat(partials)
+        .groupby(level=0, sort=False)
+        .agg({**{col: "sum" for col in SUM_COLUMNS}, "max_mag": "max"})
+    )
+
+
+class EarthquakeRollup:
+    """Counts, maximum magnitude and mean depth of the curated events per
+    location, day and magnitude bucket, updated with every transformed batch.
+    The magnitude, depth and group of every aggregated event are kept, 32
+    bytes per event, so a revised event replaces its previous contribution
+    instead of being counted twice, and re-adding the same rows changes
+    nothing. Only the maximum of a group losing its largest magnitude is
+    recomputed, from the kept events of that group.
+    Args:
+        path: file of the rollup state, created by save()
+    """
+
+    def __init__(self, path):
+        self.path = path
+        # Contributions of the batches added since the last save, applied again
+        # by refresh() when another process saved the state in between
+        self._batches = []
+        self._load()
+
+    def _load(self):
+        self._locations = []
+        empty_int, empty_float = np.empty(0, dtype="int64"), np.empty(0)
+        # Aggregated events, sorted by key
+        self._events = {
+            "key": empty_int,
+            "group": empty_int,
+            "mag": empty_float,
+            "depth": empty_float,
+        }
+        self._groups = partial_aggregates(empty_int, empty_float, empty_float)
+        # Partial aggregates of the batches added since the last fold, and the
+        # largest magnitude removed from every group
+        self._added = []
+        self._removed_max = []
+        self._changed = set()
+        self._generation = 0
+        if os.path.exists(self.path):
+            with np.load(self.path) as arrays:
+                self._generation = int(arrays["generation"])
+                self._locations = arrays["locations"].tolist()
+                self._events = {name: arrays[name] for name in self._events}
+                self._groups = pd.DataFrame(
+                    {col: arrays[col] for col in [*SUM_COLUMNS, "max_mag"]},
+                    index=pd.Index(arrays["groups"], name="group"),
+                )
+
+    def __len__(self):
+        self._fold()
+        return len(self._groups)
+
+    def _location_codes(self, locations):
+        locations = pd.Categorical(locations)
+        for location_name in locations.categories:
+            if location_name not in self._locations:
+                self._locations.append(location_name)
+        mapping = np.array(
+            [self._locations.index(name) for name in locations.categories],
+            dtype="int64",
+        )
+        return mapping[locations.codes]
+
+    def add(self, df):
+        """Folds transformed rows in the rollups.
+        Args:
+            df: rows with id, location, time, mag and depth, one curated row
+                per id and location
+        """
+        if df is None or df.empty:
+            return
+
+        with span("rollup"):
+            times = pd.to_datetime(df["time"], utc=True, format="ISO8601", cache=False)
+            batch = pd.DataFrame(
+                {
+                    "key": key_hashes(df, ["id", "location"]),
+                    "location": pd.Categorical(df["location"]),
+                    "day": np.floor_divide(
+                        times.dt.as_unit("ns").array.asi8, 86400 * 10**9
+                    ),
+                    "mag_bucket": mag_buckets(df["mag"]),
+                    "mag": df["mag"].to_numpy(dtype="float64", na_value=np.nan),
+                    "depth": df["depth"].to_numpy(dtype="float64", na_value=np.nan),
+                }
+            )
+            batch = batch.drop_duplicates(subset="key", keep="last").sort_values("key")
+            self._batches.append(batch)
+            self._apply(batch)
+
+    def _apply(self, batch):
+        """Replaces the contributions of the events of batch."""
+        batch_keys = batch["key"].to_numpy()
+        batch_groups = _group_ids(
+            self._location_codes(batch["location"]),
+            batch["day"].to_numpy(),
+            batch["mag_bucket"].to_numpy(),
+        )
+        batch_mag, batch_depth = batch["mag"].to_numpy(), batch["depth"].to_numpy()
+
+        # Contributions of the events already aggregated, replaced by the batch
+        keys = self._events["key"]
+        positions = np.searchsorted(keys, batch_keys)
+        found = positions < len(keys)
+        found[found] = keys[positions[found]] == batch_keys[found]
+        replaced = positions[found]
+        removed = partial_aggregates(
+            self._events["group"][replaced],
+            self._events["mag"][replaced],
+            self._events["depth"][replaced],
+        )
+        added = partial_aggregates(batch_groups, batch_mag, batch_depth)
+
+        kept = np.ones(len(keys), dtype=bool)
+        kept[replaced] = False
+        insert_at = np.searchsorted(keys[kept], batch_keys)
+        new_values = {
+            "key": batch_keys,
+            "group": batch_groups,
+            "mag": batch_mag,
+            "depth": batch_depth,
+        }
+        self._events = {
+            name: np.insert(values[kept], insert_at, new_values[name])
+            for name, values in self._events.items()
+        }
+
+        removed[SUM_COLUMNS] = -removed[SUM_COLUMNS]
+        self._removed_max.append(removed.pop("max_mag"))
+        removed["max_mag"] = np.nan
+        self._added.extend([removed, added])
+        count("rollup_revised_events", int(found.sum()))
+
+    def refresh(self):
+        """Reloads the state saved by another process since this one was
+        loaded, and applies the batches added since then on top of it. Call
+        it with the destination locked, before rows() and save()."""
+        if not os.path.exists(self.path):
+            return
+        with np.load(self.path) as arrays:
+            generation = int(arrays["generation"])
+        if generation == self._generation:
+            return
+
+        logger.info(
+            "Rollup state saved by another process, applying the batches again."
+        )
+        self._load()
+        for batch in self._batches:
+            self._apply(batch)
+
+    def _fold(self):
+        """Merges the partial aggregates of the added batches in the groups."""
+        if not self._added:
+            return
+
+        groups = merge_partials([self._groups, *self._added])
+        self._changed.update(
+            group for partial in self._added for group in partial.index.tolist()
+        )
+        self._added = []
+
+        # The maximum of a group still counts the magnitudes of the replaced
+        # events, it is recomputed for the groups that lost their largest one
+        removed_max = pd.concat(self._removed_max).groupby(level=0).max()
+        self._removed_max = []
+        stale = removed_max.index[
+            (removed_max >= groups["max_mag"].reindex(removed_max.index)).to_numpy()
+        ]
+        if len(stale):
+            events = self._events["group"]
+            in_stale = np.isin(events, stale.to_numpy())
+            maxima = (
+                pd.Series(self._events["mag"][in_stale]).groupby(events[in_stale]).max()
+            )
+            groups.loc[stale, "max_mag"] = maxima.reindex(stale).to_numpy()
+        self._groups = groups
+
+    def rows(self, changed_only=True):
+        """Rollup rows to write to the rollup table.
+        Args:
+            changed_only: only the groups changed since the last save(), every
+                group otherwise, e.g. when the table was removed
+        Returns:
+            DataFrame: ROLLUP_COLUMNS, a group left without events has
+                n_events 0 so the upsert clears it
+        """
+        self._fold()
+        groups = self._groups
+        if changed_only:
+            groups = groups.loc[sorted(self._changed)]
+        group_ids = groups.index.to_numpy(dtype="int64")
+        n_depth = groups["n_depth"].to_numpy()
+
+        return pd.DataFrame(
+            {
+                "location": pd.array(
+                    np.array(self._locations, dtype=object)[group_ids >> 32],
+                    dtype="string[pyarrow]",
+                ),
+                "day": pd.to_datetime(
+                    ((group_ids >> 8) & 0xFFFFFF) - _DAY_OFFSET, unit="D"
+                ).date,
+                "mag_bucket": (group_ids & 0xFF) - 128,
+                "n_events": groups["n_events"].to_numpy(dtype="int64"),
+                "max_mag": groups["max_mag"].to_numpy(),
+                "mean_depth": groups["sum_depth"].to_numpy()
+                / np.where(n_depth > 0, n_depth, np.nan),
+                "sum_depth": groups["sum_depth"].to_numpy(),
+                "n_depth": n_depth.astype("int64"),
+            }
+        )
+
+    def save(self):
+        """Writes the rollup state, the next rows() returns the later changes."""
+        self._fold()
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "wb") as file:
+            np.savez(
+                file,
+                generation=self._generation + 1,
+                locations=np.array(self._locations, dtype=str),
+                groups=self._groups.index.to_numpy(dtype="int64"),
+                **{col: self._groups[col].to_numpy() for col in self._groups},
+                **self._events,
+            )
+        os.replace(tmp_path, self.path)
+        self._generation += 1
+        self._batches = []
+        self._changed = set()
+        logger.info(
+            f"Rollup saved with {len(self._groups)} groups of "
+            f"{len(self._events['key'])} events."
+        )
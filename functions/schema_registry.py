@@ -0,0 +1,181 @@
+"""BigQuery table schemas, fetched once per run, and the pandas type mapping"""
+
+import fnmatch
+import json
+import threading
+
+import pandas as pd
+from pandas.api import types
+from functions.logger import get_logger
+
+logger = get_logger("schema-registry")
+
+# Legacy SQL names used by the BigQuery API -> standard SQL aliases
+TYPE_ALIASES = {
+    "FLOAT64": "FLOAT",
+    "INT64": "INTEGER",
+    "BOOL": "BOOLEAN",
+}
+
+
+def normalize_type(field_type):
+    """Upper cases a BigQuery type and maps the standard SQL aliases."""
+    field_type = field_type.upper()
+    return TYPE_ALIASES.get(field_type, field_type)
+
+
+def bigquery_type(dtype):
+    """BigQuery type a pandas column of this dtype is loaded as."""
+    if isinstance(dtype, pd.CategoricalDtype):
+        # Loaded as its values, the categories are only the encoding
+        return bigquery_type(dtype.categories.dtype)
+    if types.is_bool_dtype(dtype):
+        return "BOOLEAN"
+    if types.is_integer_dtype(dtype):
+        return "INTEGER"
+    if types.is_float_dtype(dtype):
+        return "FLOAT"
+    if isinstance(dtype, pd.DatetimeTZDtype):
+        return "TIMESTAMP"
+    if types.is_datetime64_dtype(dtype):
+        return "DATETIME"
+    return "STRING"
+
+
+def schema_of(df):
+    """BigQuery schema of a frame, column -> type."""
+    return {col: bigquery_type(dtype) for col, dtype in df.dtypes.items()}
+
+
+def _to_string(column):
+    if isinstance(column.dtype, pd.DatetimeTZDtype):
+        # Same format as the USGS csv, e.g. 2023-12-30T23:45:12.345Z
+        formatted = column.dt.tz_convert("UTC").dt.strftime("%Y-%m-%dT%H:%M:%S.%f")
+        return (formatted.str[:-3] + "Z").astype("string")
+    return column.astype("string")
+
+
+def _to_timestamp(column):
+    if isinstance(column.dtype, pd.DatetimeTZDtype):
+        return column.dt.tz_convert("UTC")
+    if types.is_datetime64_dtype(column.dtype):
+        return column.dt.tz_localize("UTC")
+    return pd.to_datetime(column, utc=True, format="ISO8601")
+
+
+def _to_datetime(column):
+    if isinstance(column.dtype, pd.DatetimeTZDtype):
+        return column.dt.tz_convert("UTC").dt.tz_localize(None)
+    return pd.to_datetime(column, format="ISO8601")
+
+
+# BigQuery type -> vectorized conversion of a pandas column
+COERCIONS = {
+    "STRING": _to_string,
+    "FLOAT": lambda column: column.astype("float64"),
+    "INTEGER": lambda column: column.astype("Int64"),
+    "BOOLEAN": lambda column: column.astype("boolean"),
+    "TIMESTAMP": _to_timestamp,
+    "DATETIME": _to_datetime,
+    "DATE": lambda column: pd.to_datetime(column).dt.date,
+}
+
+
+def coerce_to_schema(df, schema):
+    """Converts the columns of df to the types of the BigQuery schema.
+    Args:
+        df: DataFrame to load
+        schema: column -> BigQuery type of the target table
+    Returns:
+        DataFrame: a new frame with the converted columns
+    Raises:
+        ValueError: if a column is missing in the schema or cannot be converted
+    """
+    converted = {}
+    for col, dtype in df.dtypes.items():
+        if col not in schema:
+            raise ValueError(f"Column '{col}' not found in BigQuery table schema.")
+        field_type = normalize_type(schema[col])
+        if bigquery_type(dtype) == field_type or field_type not in COERCIONS:
+            continue
+        column = df[col]
+        if isinstance(dtype, pd.CategoricalDtype):
+            column = column.astype(dtype.categories.dtype)
+        try:
+            converted[col] = COERCIONS[field_type](column)
+        except (TypeError, ValueError) as ex:
+            raise ValueError(
+                f"Column '{col}' has type '{dtype}' in DataFrame and cannot be "
+                f"converted to '{field_type}': {ex}"
+            ) from ex
+
+    return df.assign(**converted) if converted else df
+
+
+class SchemaRegistry:
+    """Schemas of the target tables, each one fetched at most once per run.
+    Args:
+        backend: BigQueryBackend used to fetch the schemas
+        schema_path: optional JSON file with the schemas, looked up before
+            fetching. Its "tables" map dataset.table patterns (e.g. "raw_data.*")
+            to column -> type dictionaries.
+    """
+
+    def __init__(self, backend, schema_path=None):
+        self.backend = backend
+        self._lock = threading.Lock()
+        self._schemas = {}
+        self._exists = {}
+        self._file_schemas = {}
+        if schema_path is not None:
+            with open(schema_path) as file:
+                content = json.load(file)
+            self._file_schemas = content["tables"]
+            logger.info(
+                f"Loaded schemas version {content.get('version')} from {schema_path}."
+            )
+
+    def _from_file(self, table_id):
+        dataset_table = ".".join(table_id.split(".")[-2:])
+        for pattern, schema in self._file_schemas.items():
+            if fnmatch.fnmatchcase(dataset_table, pattern):
+                return schema
+        return None
+
+    def get(self, table_id):
+        """Returns the column -> type schema of the table, None if the table
+        does not exist and the schema file does not describe it."""
+        with self._lock:
+            if table_id in self._schemas:
+                return self._schemas[table_id]
+        schema = self._from_file(table_id)
+        exists = None
+        if schema is None:
+            logger.info(f"Fetching the schema of {table_id}")
+            schema = self.backend.get_schema(table_id)
+            exists = schema is not None
+        with self._lock:
+            self._schemas[table_id] = schema
+            if exists is not None:
+                self._exists[table_id] = exists
+
+        return schema
+
+    def exists(self, table_id):
+        """Returns True if the table exists. Only the tables whose schema comes
+        from the schema file need a request."""
+        self.get(table_id)
+        with self._lock:
+            if table_id in self._exists:
+                return self._exists[table_id]
+        exists = self.backend.table_exists(table_id)
+        with self._lock:
+            self._exists[table_id] = exists
+
+        return exists
+
+    def set(self, table_id, schema):
+        """Records the schema of a table created during the run."""
+        with self._lock:
+            self._schemas[table_id] = schema
+            self._exists[table_id] = True
@@ -0,0 +1,288 @@
+"""Destinations of the raw and curated loads"""
+
+import os
+import shutil
+import threading
+import uuid
+from abc import ABC, abstractmethod
+from urllib.parse import quote
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from functions.logger import count, get_logger, span
+from functions.usgs_schema import to_arrow_table
+
+logger = get_logger("sinks")
+
+# Directory of the files being written, under the root of a ParquetSink
+STAGING_DIR = ".staging"
+
+
+class Sink(ABC):
+    """Destination of the tables written by the pipeline. A table is named by
+    its dataset (raw_data, curated_data) and its table name."""
+
+    @abstractmethod
+    def write(self, df, dataset, table, key_columns=None):
+        """Appends df to the table, or upserts it on key_columns."""
+
+
+class BigQuerySink(Sink):
+    """Writes the tables to BigQuery with a BigQueryLoader.
+    Args:
+        project_id: GCP project of the datasets
+        loader: BigQueryLoader, the process wide one by default
+    """
+
+    def __init__(self, project_id, loader=None):
+        if loader is None:
+            from functions.bigquery_loader import get_default_loader
+
+            loader = get_default_loader()
+        self.project_id = project_id
+        self.loader = loader
+
+    def _table_id(self, dataset, table):
+        return f"{self.project_id}.{dataset}.{table}"
+
+    def write(self, df, dataset, table, key_columns=None):
+        self.loader.load(df, self._table_id(dataset, table), key_columns=key_columns)
+
+
+class ParquetSink(Sink):
+    """Writes every table as a Parquet dataset under root/dataset/table,
+    partitioned hive style by location and by the month of the event time.
+    The files of a write are first written under root/.staging.
+    Args:
+        root: directory of the datasets
+        partition_cols: partition columns, the ones missing in a frame are skipped
+        duckdb_path: optional DuckDB database where a view is created per table,
+            e.g. a view curated_data.earthquakes over the Parquet files
+    """
+
+    def __init__(
+        self,
+        root,
+        partition_cols=("location", "event_month"),
+        duckdb_path=None,
+    ):
+        self.root = root
+        self.partition_cols = list(partition_cols)
+        self.duckdb_path = duckdb_path
+        self._duckdb_lock = threading.Lock()
+
+    def table_path(self, dataset, table):
+        return os.path.join(self.root, dataset, table)
+
+    def _with_partitions(self, df):
+        if "event_month" in self.partition_cols and "time" in df.columns:
+            times = pd.to_datetime(df["time"], utc=True, format="ISO8601")
+            months = pd.Series(times.dt.year * 100 + times.dt.month, index=df.index)
+            # Formatted once per month rather than once per row
+            labels = {
+                month: f"{int(month) // 100:04d}-{int(month) % 100:02d}"
+                for month in months.dropna().unique()
+            }
+            df = df.assign(event_month=months.map(labels))
+        return df, [col for col in self.partition_cols if col in df.columns]
+
+    def _partition_dir(self, path, partition_cols, values):
+        return os.path.join(
+            path,
+            *(
+                f"{col}={quote(str(value), safe='')}"
+                for col, value in zip(partition_cols, values)
+            ),
+        )
+
+    def _groups(self, df, partition_cols):
+        """Rows of every partition of df, without the partition columns, which
+        are only stored in the directory names."""
+        if not partition_cols:
+            return {(): df}
+        return {
+            tuple(str(value) for value in values): group.drop(columns=partition_cols)
+            for values, group in df.groupby(
+                partition_cols, sort=False, observed=True, dropna=False
+            )
+        }
+
+    def _write_file(self, df, directory):
+        os.makedirs(directory, exist_ok=True)
+        file_path = os.path.join(directory, f"part-{uuid.uuid4().hex}.parquet")
+        pq.write_table(to_arrow_table(df), file_path)
+        return file_path
+
+    def _append(self, df, path, staging, partition_cols):
+        """Adds one file per partition. Every file is written aside and moved
+        in place, a reader never sees a partial file."""
+        for values, rows in self._groups(df, partition_cols).items():
+            file_path = self._write_file(rows, staging)
+            directory = self._partition_dir(path, partition_cols, values)
+            os.makedirs(directory, exist_ok=True)
+            os.replace(file_path, os.path.join(directory, os.path.basename(file_path)))
+
+    def _moved_partitions(self, df, path, partition_cols, key_columns, new_keys):
+        """Partitions holding older versions of the rows of df, e.g. of an event
+        whose revised time falls in another month. Only the rows with the
+        first key column of df are read from the table."""
+        if set(partition_cols) <= set(key_columns):
+            return set()  # the key of a row gives its partition
+        first_key = key_columns[0]
+        scanned = (
+            ds.dataset(path, format="parquet", partitioning="hive")
+            .to_table(
+                columns=list(dict.fromkeys(key_columns + partition_cols)),
+                filter=ds.field(first_key)
+                .cast(pa.string())
+                .isin(pa.array(df[first_key].astype(str).unique())),
+            )
+            .to_pandas()
+        )
+        revised = scanned[
+            pd.MultiIndex.from_frame(scanned[key_columns].astype(str)).isin(new_keys)
+        ]
+
+        return set(
+            revised[partition_cols]
+            .astype(str)
+            .drop_duplicates()
+            .itertuples(index=False, name=None)
+        )
+
+    def _upsert(self, df, path, staging, partition_cols, key_columns):
+        """Rewrites the partitions holding the new rows or older versions of
+        them, replacing the rows whose key is in df. A partition is written
+        to the staging directory and swapped with the old one, a failed write
+        leaves the table as it was."""
+        new_keys = pd.MultiIndex.from_frame(df[key_columns].astype(str))
+        groups = self._groups(df, partition_cols)
+        moved = self._moved_partitions(
+            df, path, partition_cols, key_columns, new_keys
+        ) - set(groups)
+
+        # The partitions of the new rows go first, a crash in between leaves
+        # an old version behind rather than losing the new one
+        for values in [*groups, *moved]:
+            directory = self._partition_dir(path, partition_cols, values)
+            frames = [groups[values]] if values in groups else []
+            if os.path.isdir(directory):
+                partition = dict(zip(partition_cols, values))
+                old = pd.read_parquet(directory)
+                old_keys = old.assign(**partition)[key_columns].astype(str)
+                frames.insert(
+                    0, old[~pd.MultiIndex.from_frame(old_keys).isin(new_keys)]
+                )
+            rows = (
+                pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0]
+            )
+
+            staged = None
+            if len(rows):
+                staged = os.path.join(staging, uuid.uuid4().hex)
+                self._write_file(rows, staged)
+            self._replace_dir(staged, directory, staging)
+
+    def _replace_dir(self, staged, directory, staging):
+        """Moves the staged partition in place of directory, removing the
+        directory when staged is None. The old partition stays in the staging
+        directory until the write is done."""
+        if os.path.isdir(directory):
+            os.replace(directory, os.path.join(staging, uuid.uuid4().hex))
+        if staged is not None:
+            os.makedirs(os.path.dirname(directory), exist_ok=True)
+            os.replace(staged, directory)
+
+    def write(self, df, dataset, table, key_columns=None):
+        if df is None or df.empty:
+            logger.info(
+                f"Empty DataFrame received for {dataset}.{table}, nothing to write."
+            )
+            return
+
+        with span("parquet_write", table=f"{dataset}.{table}"):
+            self._write(df, dataset, table, key_columns)
+        count("rows_written", len(df), table=f"{dataset}.{table}")
+
+    def _write(self, df, dataset, table, key_columns):
+        path = self.table_path(dataset, table)
+        df, partition_cols = self._with_partitions(df)
+        staging = os.path.join(self.root, STAGING_DIR, uuid.uuid4().hex)
+        os.makedirs(staging)
+        logger.info(f"Writing {len(df)} rows to {path}")
+        try:
+            if key_columns and os.path.isdir(path):
+                with span("parquet_upsert", table=f"{dataset}.{table}"):
+                    self._upsert(df, path, staging, partition_cols, key_columns)
+            else:
+                self._append(df, path, staging, partition_cols)
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+        if self.duckdb_path is not None:
+            self.register_duckdb(dataset, table)
+
+    def register_duckdb(self, dataset, table):
+        """Creates or replaces the DuckDB view dataset.table over the Parquet files."""
+        import duckdb
+
+        files = os.path.join(
+            os.path.abspath(self.table_path(dataset, table)), "**", "*.parquet"
+        )
+        with self._duckdb_lock:
+            connection = duckdb.connect(self.duckdb_path)
+            try:
+                connection.execute(f'CREATE SCHEMA IF NOT EXISTS "{dataset}"')
+                connection.execute(
+                    f'CREATE OR REPLACE VIEW "{dataset}"."{table}" AS '
+                    f"SELECT * FROM read_parquet('{files}', hive_partitioning = true)"
+                )
+            finally:
+                connection.close()
+
+
+class LockedSink(Sink):
+    """Writes through another sink while holding a lock, e.g. the lock of a
+    destination shared by the workers of a backfill. The other attributes are
+    the ones of the wrapped sink.
+    Args:
+        sink: Sink written to
+        lock: function returning the context manager held during every write
+    """
+
+    def __init__(self, sink, lock):
+        self.sink = sink
+        self.lock = lock
+
+    def __getattr__(self, name):
+        return getattr(self.sink, name)
+
+    def write(self, df, dataset, table, key_columns=None):
+        with self.lock():
+            self.sink.write(df, dataset, table, key_columns)
+
+
+def build_sink(
+    kind, project_id=None, local_path="data", duckdb_path=None, loader_options=None
+):
+    """Creates the sink configured in app.py. BigQuery is only imported, and
+    the credentials only needed, by the bigquery sink.
+    Args:
+        kind: "bigquery" or "parquet"
+        project_id: GCP project, for the bigquery sink
+        local_path: root directory, for the parquet sink
+        duckdb_path: optional DuckDB database, for the parquet sink
+        loader_options: BigQueryLoader arguments, for the bigquery sink
+    Returns:
+        Object: a Sink
+    """
+    if kind == "bigquery":
+        from functions.bigquery_loader import BigQueryLoader
+
+        return BigQuerySink(
+            project_id=project_id, loader=BigQueryLoader(**(loader_options or {}))
+        )
+    if kind == "parquet":
+        return ParquetSink(root=local_path, duckdb_path=duckdb_path)
+    raise ValueError(f"Unknown sink: {kind}")
@@ -0,0 +1,289 @@
+"""Local spatial index over the curated earthquakes, for radius queries and
+new locations without any USGS request"""
+
+import json
+import os
+import uuid
+
+import numpy as np
+import pandas as pd
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from functions.helper_functions import transform_data
+from functions.logger import get_logger, span
+from functions.region_planner import KM_PER_DEGREE, haversine_km
+from functions.usgs_schema import (
+    CURATED_CATEGORY_COLUMNS,
+    from_arrow_table,
+    restore_categories,
+    to_arrow_table,
+)
+
+logger = get_logger("spatial-index")
+
+# Columns of the curated rows that depend on the location or on the run,
+# the index keeps one row per event without them
+LOCATION_COLUMNS = CURATED_CATEGORY_COLUMNS + ["hashed_id", "event_month"]
+
+# Key of the index settings in the metadata of the Parquet file
+_METADATA_KEY = b"spatial_index"
+
+
+class SpatialIndex:
+    """Events bucketed in a latitude/longitude grid of cell_degrees cells and
+    sorted by cell and time. A query only scans the cells of the bounding box
+    of its circle, then checks the exact great circle distance, the same one
+    region_planner uses to assign the events to the locations.
+    Args:
+        events: DataFrame with id, time, latitude and longitude columns, e.g.
+            the curated dataset. The location columns are dropped and every id
+            is kept once, its last version.
+        cell_degrees: size of the grid cells
+    """
+
+    def __init__(self, events, cell_degrees=1.0):
+        self.cell_degrees = cell_degrees
+        self.n_rows = int(np.ceil(180 / cell_degrees))
+        self.n_cols = int(np.ceil(360 / cell_degrees))
+
+        with span("spatial_index_build"):
+            events = _unique_events(events)
+            latitudes = events["latitude"].to_numpy(dtype="float64")
+            longitudes = events["longitude"].to_numpy(dtype="float64")
+            times = _utc_times(events["time"])
+            cells = self._cells(latitudes, longitudes)
+            order = np.lexsort((times.asi8, cells))
+
+            self.events = events.take(order).reset_index(drop=True)
+            self.events["time"] = times.take(order)
+            self._cells_sorted = cells[order]
+            self._latitudes = latitudes[order]
+            self._longitudes = longitudes[order]
+            self._times = times.asi8[order]
+
+        logger.info(
+            f"Spatial index of {len(self.events)} events in "
+            f"{len(np.unique(self._cells_sorted))} cells of {cell_degrees} degrees."
+        )
+
+    def __len__(self):
+        return len(self.events)
+
+    def _rows(self, latitudes):
+        rows = np.floor((np.asarray(latitudes) + 90) / self.cell_degrees)
+        return np.clip(rows, 0, self.n_rows - 1).astype("int64")
+
+    def _cols(self, longitudes):
+        cols = np.floor(np.mod(np.asarray(longitudes) + 180, 360) / self.cell_degrees)
+        return np.clip(cols, 0, self.n_cols - 1).astype("int64")
+
+    def _cells(self, latitudes, longitudes):
+        return self._rows(latitudes) * self.n_cols + self._cols(longitudes)
+
+    def _col_ranges(self, latitude, longitude, radiuskm):
+        """Column ranges of the bounding box of the circle, two when it crosses
+        the antimeridian."""
+        angle = np.radians(radiuskm / KM_PER_DEGREE)
+        latitude_max = abs(latitude) + np.degrees(angle)
+        if latitude_max >= 90:
+            return [(0, self.n_cols - 1)]  # the circle contains a pole
+        # Widest longitude of a circle of angular radius angle
+        ratio = np.sin(angle) / np.cos(np.radians(latitude))
+        if ratio >= 1:
+            return [(0, self.n_cols - 1)]
+        half_width = np.degrees(np.arcsin(ratio))
+
+        start = np.mod(longitude - half_width + 180, 360)
+        end = start + 2 * half_width
+        if end < 360:
+            return [(int(self._cols(start - 180)), int(self._cols(end - 180)))]
+        return [
+            (int(self._cols(start - 180)), self.n_cols - 1),
+            (0, int(self._cols(end - 540))),
+        ]
+
+    def _candidates(self, latitude, longitude, radiuskm):
+        """Positions of the events in the cells of the bounding box."""
+        delta = radiuskm / KM_PER_DEGREE
+        first_row, last_row = self._rows([latitude - delta, latitude + delta])
+        col_ranges = self._col_ranges(latitude, longitude, radiuskm)
+
+        slices = []
+        for row in range(first_row, last_row + 1):
+            for first_col, last_col in col_ranges:
+                start = np.searchsorted(
+                    self._cells_sorted, row * self.n_cols + first_col, side="left"
+                )
+                stop = np.searchsorted(
+                    self._cells_sorted, row * self.n_cols + last_col, side="right"
+                )
+                slices.append(np.arange(start, stop))
+
+        return np.concatenate(slices) if slices else np.array([], dtype="int64")
+
+    def query(self, latitude, longitude, radiuskm, start_time=None, end_time=None):
+        """Events within radiuskm of a point, between two times.
+        Args:
+            latitude, longitude: center of the circle, in degrees
+            radiuskm: radius of the circle
+            start_time: first time included, ISO8601 string or Timestamp,
+                naive times are UTC. No lower bound by default.
+            end_time: last time included, no upper bound by default
+        Returns:
+            DataFrame: the events, with their distance_km to the center, by time
+        """
+        positions = self._candidates(latitude, longitude, radiuskm)
+        if start_time is not None:
+            positions = positions[self._times[positions] >= _utc_ns(start_time)]
+        if end_time is not None:
+            positions = positions[self._times[positions] <= _utc_ns(end_time)]
+
+        distances = haversine_km(
+            latitude,
+            longitude,
+            self._latitudes[positions],
+            self._longitudes[positions],
+        )
+        within = distances <= radiuskm
+        positions, distances = positions[within], distances[within]
+        order = np.argsort(self._times[positions], kind="stable")
+
+        return (
+            self.events.take(positions[order])
+            .assign(distance_km=distances[order])
+            .reset_index(drop=True)
+        )
+
+    def assign_locations(
+        self,
+        dic_addresses,
+        maxradiuskm,
+        start_time=None,
+        end_time=None,
+        inserted_at=None,
+    ):
+        """Builds the curated rows of locations from the index, e.g. for a new
+        office or another maxradiuskm, without querying USGS.
+        Args:
+            dic_addresses: location name -> [latitude, longitude]
+            maxradiuskm: radius around every location
+            start_time, end_time: optional time bounds, as in query
+            inserted_at: UTC Timestamp of the rows, now by default
+        Returns:
+            DataFrame: the events of every location with location, inserted_at
+                and hashed_id as added by transform_data. The index keeps the
+                columns hashed_id is computed from, see INDEX_COLUMNS of
+                functions/destination.py, so it matches the extracted rows.
+        """
+        if inserted_at is None:
+            inserted_at = pd.Timestamp.now(tz="UTC")
+        frames = []
+        for location_name, (latitude, longitude) in dic_addresses.items():
+            events = self.query(latitude, longitude, maxradiuskm, start_time, end_time)
+            frames.append(
+                transform_data(
+                    location_name,
+                    events.drop(columns="distance_km"),
+                    inserted_at=inserted_at,
+                )
+            )
+            logger.info(f"{len(events)} events assigned to location {location_name}.")
+
+        if not frames:
+            return self.events.head(0)
+        return restore_categories(pd.concat(frames, ignore_index=True))
+
+    def update(self, df):
+        """Adds the events of df, e.g. the curated rows of the last run.
+        Args:
+            df: new events, they replace the indexed events with the same id
+        Returns:
+            SpatialIndex: a new index with the events of both
+        """
+        events = pd.concat(
+            [self.events, df.drop(columns=LOCATION_COLUMNS, errors="ignore")],
+            ignore_index=True,
+        )
+        return SpatialIndex(events, cell_degrees=self.cell_degrees)
+
+    def save(self, path):
+        """Writes the events and the grid settings in one Parquet file."""
+        table = to_arrow_table(self.events)
+        metadata = {
+            **(table.schema.metadata or {}),
+            _METADATA_KEY: json.dumps({"cell_degrees": self.cell_degrees}).encode(),
+        }
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # Written aside first, a reader never sees a partial file
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        pq.write_table(table.replace_schema_metadata(metadata), tmp_path)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """Reads an index written by save."""
+        table = pq.read_table(path)
+        settings = json.loads(table.schema.metadata[_METADATA_KEY])
+
+        return cls(from_arrow_table(table), cell_degrees=settings["cell_degrees"])
+
+    @classmethod
+    def from_parquet(cls, path, cell_degrees=1.0):
+        """Builds the index from a Parquet dataset, e.g. the curated table
+        written by ParquetSink.
+        Args:
+            path: Parquet file or hive partitioned directory
+            cell_degrees: size of the grid cells
+        """
+        dataset = ds.dataset(path, format="parquet", partitioning="hive")
+        columns = [col for col in dataset.schema.names if col not in LOCATION_COLUMNS]
+        if "inserted_at" in dataset.schema.names:
+            # Orders the versions of an event, see _unique_events
+            columns.append("inserted_at")
+
+        return cls(from_arrow_table(dataset.to_table(columns=columns)), cell_degrees)
+
+
+def update_spatial_index(path, df, cell_degrees=1.0):
+    """Adds the events of df to the index file at path, created if missing.
+    Args:
+        path: Parquet file of the index
+        df: new events, e.g. the curated rows of the run
+        cell_degrees: size of the grid cells of a new index
+    Returns:
+        SpatialIndex: the updated index
+    """
+    if os.path.exists(path):
+        index = SpatialIndex.load(path).update(df)
+    else:
+        index = SpatialIndex(df, cell_degrees=cell_degrees)
+    index.save(path)
+    logger.info(f"Spatial index of {len(index)} events saved to {path}")
+
+    return index
+
+
+def _unique_events(df):
+    """One row per id, its last version, without the location columns."""
+    for version_col in ("updated", "inserted_at"):
+        if version_col in df.columns:
+            df = df.sort_values(version_col, kind="stable")
+            break
+    df = df.drop(columns=LOCATION_COLUMNS, errors="ignore")
+
+    return df.drop_duplicates(subset=["id"], keep="last")
+
+
+def _utc_times(times):
+    if not isinstance(times.dtype, pd.DatetimeTZDtype):
+        times = pd.to_datetime(times, utc=True, format="ISO8601")
+    return pd.DatetimeIndex(times).tz_convert("UTC").as_unit("ns")
+
+
+def _utc_ns(value):
+    timestamp = pd.Timestamp(value)
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.tz_localize("UTC")
+    return timestamp.tz_convert("UTC").as_unit("ns").value
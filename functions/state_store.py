@@ -0,0 +1,69 @@
+"""Local SQLite store of the extraction watermarks"""
+
+import datetime
+import os
+import sqlite3
+import threading
+
+from functions.logger import get_logger
+
+logger = get_logger("state-store")
+
+
+def watermark_key(location_name, maxradiuskm, start_time, end_time):
+    """Identifies the query of a location. Changing the radius or the date
+    range starts a new full extraction for the location: the events of a
+    widened range last updated before the watermark would never be extracted
+    otherwise. The rows already loaded are skipped by the dedup index."""
+    return f"{location_name}|{maxradiuskm}|{start_time}|{end_time}"
+
+
+class WatermarkStore:
+    """Keeps, per location query, the time of the last successful load.
+    Args:
+        path: SQLite file, created with its directory if missing
+    """
+
+    def __init__(self, path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._connection:
+            self._connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS watermarks (
+                    key TEXT PRIMARY KEY,
+                    watermark TEXT NOT NULL,
+                    saved_at TEXT NOT NULL
+                )
+                """
+            )
+
+    def get(self, key):
+        """Returns the ISO8601 watermark of the key, None if it was never loaded."""
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT watermark FROM watermarks WHERE key = ?", (key,)
+            ).fetchone()
+
+        return row[0] if row else None
+
+    def set(self, key, watermark):
+        """Saves the ISO8601 watermark of the key."""
+        saved_at = datetime.datetime.now(datetime.timezone.utc).isoformat()
+        with self._lock, self._connection:
+            self._connection.execute(
+                """
+                INSERT INTO watermarks (key, watermark, saved_at) VALUES (?, ?, ?)
+                ON CONFLICT (key) DO UPDATE
+                SET watermark = excluded.watermark, saved_at = excluded.saved_at
+                """,
+                (key, watermark, saved_at),
+            )
+        logger.info(f"Watermark of {key} set to {watermark}.")
+
+    def close(self):
+        self._connection.close()
@@ -0,0 +1,201 @@
+"""Column schema of the USGS csv format"""
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+# Columns returned by https://earthquake.usgs.gov/fdsnws/event/1/query?format=csv
+# The coordinates, depth and mag keep float64: they are used for the distances
+# and hashed into hashed_id. The other measurements fit in float32.
+FLOAT64_COLUMNS = ["latitude", "longitude", "depth", "mag"]
+FLOAT32_COLUMNS = [
+    "nst",
+    "gap",
+    "dmin",
+    "rms",
+    "horizontalError",
+    "depthError",
+    "magError",
+    "magNst",
+]
+FLOAT_COLUMNS = FLOAT64_COLUMNS + FLOAT32_COLUMNS
+CATEGORY_COLUMNS = [
+    "net",
+    "magType",
+    "status",
+    "type",
+    "locationSource",
+    "magSource",
+]
+STRING_COLUMNS = ["id", "place"]
+TIME_COLUMNS = ["time", "updated"]
+
+# Column order of the csv format
+CSV_COLUMNS = [
+    "time",
+    "latitude",
+    "longitude",
+    "depth",
+    "mag",
+    "magType",
+    "nst",
+    "gap",
+    "dmin",
+    "rms",
+    "net",
+    "id",
+    "updated",
+    "place",
+    "type",
+    "horizontalError",
+    "depthError",
+    "magError",
+    "magNst",
+    "status",
+    "locationSource",
+    "magSource",
+]
+
+# Strings stored in Arrow buffers instead of one Python object per row
+STRING_DTYPE = "string[pyarrow]"
+
+USGS_DTYPES = {
+    **{col: "float64" for col in FLOAT64_COLUMNS},
+    **{col: "float32" for col in FLOAT32_COLUMNS},
+    **{col: "category" for col in CATEGORY_COLUMNS},
+    **{col: STRING_DTYPE for col in STRING_COLUMNS},
+    # Parsed after reading, see parse_time_columns
+    **{col: str for col in TIME_COLUMNS},
+}
+
+# Columns added by transform_data, holding one value per location or per run
+CURATED_CATEGORY_COLUMNS = ["location", "inserted_at"]
+
+# Columns defining the content of a curated row, hashed into hashed_id.
+# inserted_at is left out so the same event keeps the same hash on every run.
+HASH_COLUMNS = [
+    "id",
+    "time",
+    "updated",
+    "latitude",
+    "longitude",
+    "depth",
+    "mag",
+    "magType",
+    "place",
+    "type",
+    "status",
+    "location",
+]
+
+
+def parse_time_columns(df):
+    """Converts the ISO8601 time columns of a USGS frame to UTC timestamps.
+    Args:
+        df: DataFrame read with USGS_DTYPES
+    Returns:
+        DataFrame: the same frame, with datetime64[ns, UTC] time columns
+    """
+    for col in TIME_COLUMNS:
+        if col in df.columns:
+            df[col] = pd.to_datetime(df[col], format="ISO8601", utc=True)
+
+    return df
+
+
+def empty_frame():
+    """Frame without any event, in CSV_COLUMNS order, typed like a parsed
+    response. USGS answers a query without any match with a 204 and no body."""
+    df = pd.DataFrame({col: pd.Series(dtype=USGS_DTYPES[col]) for col in CSV_COLUMNS})
+
+    return parse_time_columns(df)
+
+
+def restore_categories(df, columns=None):
+    """Casts back to category the columns that pd.concat turned into object
+    because the frames had different categories.
+    Args:
+        df: concatenated DataFrame
+        columns: columns to restore, the USGS and curated categories by default
+    """
+    columns = columns or CATEGORY_COLUMNS + CURATED_CATEGORY_COLUMNS
+    categories = {
+        col: "category"
+        for col in columns
+        if col in df.columns and df[col].dtype != "category"
+    }
+
+    return df.astype(categories) if categories else df
+
+
+def constant_column(value, n_rows):
+    """Column repeating value n_rows times, stored as a category with a single
+    value: one byte per row plus the value once.
+    Args:
+        value: value of every row, e.g. a location name or a Timestamp
+        n_rows: length of the column
+    Returns:
+        Categorical: the column
+    """
+    return pd.Categorical.from_codes(
+        np.zeros(n_rows, dtype="int8"), categories=pd.Index([value])
+    )
+
+
+def to_arrow_table(df):
+    """Converts df to an Arrow table. Arrow drops the time zone of categorical
+    timestamps, e.g. inserted_at, so those columns are expanded first.
+    Args:
+        df: DataFrame to convert
+    Returns:
+        Object: a pyarrow Table, without the index
+    """
+    expanded = {
+        col: df[col].astype(dtype.categories.dtype)
+        for col, dtype in df.dtypes.items()
+        if isinstance(dtype, pd.CategoricalDtype)
+        and isinstance(dtype.categories.dtype, pd.DatetimeTZDtype)
+    }
+
+    return pa.Table.from_pandas(
+        df.assign(**expanded) if expanded else df, preserve_index=False
+    )
+
+
+def from_arrow_table(table):
+    """Converts an Arrow table read back from Parquet to a DataFrame, keeping
+    the strings in Arrow buffers as in the extracted frames.
+    Args:
+        table: pyarrow Table
+    Returns:
+        DataFrame: the rows of the table
+    """
+    return table.to_pandas(
+        types_mapper={
+            pa.string(): pd.StringDtype("pyarrow"),
+            pa.large_string(): pd.StringDtype("pyarrow"),
+        }.get
+    )
+
+
+def memory_report(df):
+    """Measures the memory used by every column of df, strings included.
+    Args:
+        df: DataFrame to measure
+    Returns:
+        DataFrame: dtype, bytes, bytes_per_row and share of every column,
+            largest first, and a total row
+    """
+    usage = df.memory_usage(index=False, deep=True)
+    n_rows = max(len(df), 1)
+    report = pd.DataFrame(
+        {
+            "dtype": df.dtypes.astype(str),
+            "bytes": usage,
+            "bytes_per_row": usage / n_rows,
+            "share": usage / max(usage.sum(), 1),
+        }
+    ).sort_values("bytes", ascending=False)
+    report.loc["total"] = ["", usage.sum(), usage.sum() / n_rows, 1.0]
+
+    return report
@@ -0,0 +1,353 @@
+"""Durable SQLite queue of work units, shared by worker processes and hosts"""
+
+import datetime
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from collections import namedtuple
+from contextlib import contextmanager
+
+from functions.logger import get_logger
+
+logger = get_logger("work-queue")
+
+PENDING, LEASED, DONE, FAILED = "pending", "leased", "done", "failed"
+
+# A claimed unit, attempt counts from 1
+WorkUnit = namedtuple("WorkUnit", ["id", "key", "payload", "attempt"])
+
+
+def _utc_now():
+    return datetime.datetime.now(datetime.timezone.utc).isoformat()
+
+
+def worker_name():
+    """Unique name of a worker of this process, host-pid-random."""
+    return f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+
+def _is_dead(owner):
+    """True for a worker of this host whose process exited, its leases and
+    locks are taken over without waiting for them to expire."""
+    host, pid, _ = owner.rsplit("-", 2) if owner.count("-") >= 2 else ("", "", "")
+    if host != socket.gethostname() or not pid.isdigit():
+        return False
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return True
+    except PermissionError:
+        pass
+    return False
+
+
+class WorkQueue:
+    """Units of work with a status, a lease, a number of attempts and a
+    checkpoint, in a SQLite file. A worker claims a unit by leasing it in one
+    transaction, so every unit is worked on by one worker at a time, in this
+    process, another one or another host sharing the file. The lease is
+    renewed with heartbeat(), the unit of a worker that died is claimed again
+    once its lease expires, or right away when the worker ran on this host and
+    is named with worker_name(). A failed unit is retried until max_attempts.
+    Args:
+        path: SQLite file, created with its directory if missing
+        lease_seconds: duration of a lease
+        max_attempts: attempts of a unit before it is marked failed
+    """
+
+    def __init__(self, path, lease_seconds=900, max_attempts=3):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        self._held = {}
+        # Transactions are explicit, BEGIN IMMEDIATE takes the write lock of
+        # the file before a unit is read, so two workers never claim the same
+        self._connection = sqlite3.connect(
+            path, timeout=60, isolation_level=None, check_same_thread=False
+        )
+        with self._transaction():
+            self._connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS units (
+                    id INTEGER PRIMARY KEY,
+                    key TEXT UNIQUE NOT NULL,
+                    payload TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    owner TEXT,
+                    lease_expires_at REAL,
+                    checkpoint TEXT,
+                    error TEXT,
+                    created_at TEXT NOT NULL,
+                    updated_at TEXT NOT NULL
+                )
+                """
+            )
+            self._connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS locks (
+                    name TEXT PRIMARY KEY,
+                    owner TEXT NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+                """
+            )
+
+    @contextmanager
+    def _transaction(self):
+        with self._lock:
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._connection
+            except BaseException:
+                self._connection.execute("ROLLBACK")
+                raise
+            self._connection.execute("COMMIT")
+
+    def enqueue(self, units):
+        """Adds units, the ones already queued keep their status, except the
+        failed ones which are queued again with no attempt.
+        Args:
+            units: (key, payload) tuples, the payload is JSON serializable
+        Returns:
+            int: number of units added or queued again
+        """
+        now = _utc_now()
+        with self._transaction() as connection:
+            before = connection.total_changes
+            for key, payload in units:
+                connection.execute(
+                    """
+                    INSERT INTO units (key, payload, status, created_at, updated_at)
+                    VALUES (?, ?, ?, ?, ?)
+                    ON CONFLICT (key) DO UPDATE
+                    SET payload = excluded.payload, status = excluded.status,
+                        attempts = 0, error = NULL, updated_at = excluded.updated_at
+                    WHERE status = ?
+                    """,
+                    (key, json.dumps(payload), PENDING, now, now, FAILED),
+                )
+            n_queued = connection.total_changes - before
+        logger.info(f"{n_queued} units queued in {self.path}.")
+
+        return n_queued
+
+    def claim(self, owner):
+        """Leases the first pending unit, or a unit whose lease expired or
+        whose worker died.
+        Args:
+            owner: name of the worker, unique among the workers
+        Returns:
+            WorkUnit: the claimed unit, None if no unit can be claimed now
+        """
+        now = time.time()
+        with self._transaction() as connection:
+            owners = connection.execute(
+                "SELECT DISTINCT owner FROM units WHERE status = ?", (LEASED,)
+            ).fetchall()
+            for (dead,) in filter(lambda row: _is_dead(row[0]), owners):
+                connection.execute(
+                    "UPDATE units SET lease_expires_at = 0 WHERE owner = ?", (dead,)
+                )
+            # Workers that died on their last attempt leave the unit failed
+            connection.execute(
+                """
+                UPDATE units SET status = ?, owner = NULL, lease_expires_at = NULL,
+                    error = 'lease expired', updated_at = ?
+                WHERE status = ? AND lease_expires_at < ? AND attempts >= ?
+                """,
+                (FAILED, _utc_now(), LEASED, now, self.max_attempts),
+            )
+            row = connection.execute(
+                """
+                SELECT id, key, payload, attempts FROM units
+                WHERE status = ? OR (status = ? AND lease_expires_at < ?)
+                ORDER BY id LIMIT 1
+                """,
+                (PENDING, LEASED, now),
+            ).fetchone()
+            if row is None:
+                return None
+            unit_id, key, payload, attempts = row
+            connection.execute(
+                """
+                UPDATE units SET status = ?, owner = ?, lease_expires_at = ?,
+                    attempts = attempts + 1, updated_at = ?
+                WHERE id = ?
+                """,
+                (LEASED, owner, now + self.lease_seconds, _utc_now(), unit_id),
+            )
+
+        return WorkUnit(unit_id, key, json.loads(payload), attempts + 1)
+
+    def heartbeat(self, unit_id, owner, checkpoint=None):
+        """Renews the lease of a unit and the locks of its owner, and
+        optionally saves the checkpoint of the unit.
+        Returns:
+            bool: False if the lease was lost, e.g. it expired and the unit was
+                claimed by another worker
+        """
+        with self._transaction() as connection:
+            cursor = connection.execute(
+                """
+                UPDATE units SET lease_expires_at = ?,
+                    checkpoint = COALESCE(?, checkpoint), updated_at = ?
+                WHERE id = ? AND owner = ? AND status = ?
+                """,
+                (
+                    time.time() + self.lease_seconds,
+                    None if checkpoint is None else json.dumps(checkpoint),
+                    _utc_now(),
+                    unit_id,
+                    owner,
+                    LEASED,
+                ),
+            )
+            connection.execute(
+                "UPDATE locks SET expires_at = ? WHERE owner = ?",
+                (time.time() + self.lease_seconds, owner),
+            )
+
+        return cursor.rowcount == 1
+
+    def complete(self, unit_id, owner, checkpoint=None):
+        """Marks a leased unit done, with its final checkpoint."""
+        self._finish(unit_id, owner, DONE, checkpoint=checkpoint)
+
+    def fail(self, unit_id, owner, error):
+        """Releases a leased unit after an error, it is claimed again until
+        max_attempts."""
+        self._finish(unit_id, owner, None, error=error)
+
+    def release(self, unit_id, owner):
+        """Gives a leased unit back without counting the attempt, e.g. when
+        the worker is interrupted."""
+        with self._transaction() as connection:
+            connection.execute(
+                """
+                UPDATE units SET status = ?, owner = NULL, lease_expires_at = NULL,
+                    attempts = attempts - 1, updated_at = ?
+                WHERE id = ? AND owner = ? AND status = ?
+                """,
+                (PENDING, _utc_now(), unit_id, owner, LEASED),
+            )
+
+    def _finish(self, unit_id, owner, status, checkpoint=None, error=None):
+        with self._transaction() as connection:
+            cursor = connection.execute(
+                """
+                UPDATE units SET
+                    status = COALESCE(?, CASE WHEN attempts >= ? THEN ? ELSE ? END),
+                    owner = NULL, lease_expires_at = NULL,
+                    checkpoint = COALESCE(?, checkpoint), error = ?, updated_at = ?
+                WHERE id = ? AND owner = ? AND status = ?
+                """,
+                (
+                    status,
+                    self.max_attempts,
+                    FAILED,
+                    PENDING,
+                    None if checkpoint is None else json.dumps(checkpoint),
+                    error,
+                    _utc_now(),
+                    unit_id,
+                    owner,
+                    LEASED,
+                ),
+            )
+        if cursor.rowcount == 0:
+            logger.warning(f"Unit {unit_id} was not leased by {owner} anymore.")
+
+    def units(self, key_prefix=""):
+        """Status of the units whose key starts with key_prefix.
+        Returns:
+            list: dicts with the key, status, attempts, checkpoint, error and
+                created_at of every unit, in the order they were queued
+        """
+        with self._lock:
+            rows = self._connection.execute(
+                """
+                SELECT key, status, attempts, checkpoint, error, created_at
+                FROM units WHERE substr(key, 1, ?) = ? ORDER BY id
+                """,
+                (len(key_prefix), key_prefix),
+            ).fetchall()
+
+        return [
+            {
+                "key": key,
+                "status": status,
+                "attempts": attempts,
+                "checkpoint": json.loads(checkpoint) if checkpoint else None,
+                "error": error,
+                "created_at": created_at,
+            }
+            for key, status, attempts, checkpoint, error, created_at in rows
+        ]
+
+    def counts(self):
+        """Number of units per status."""
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT status, COUNT(*) FROM units GROUP BY status"
+            ).fetchall()
+
+        return dict(rows)
+
+    @contextmanager
+    def lock(self, name, owner, poll_seconds=0.1):
+        """Holds a named lock shared by every worker of the queue, e.g. around
+        the writes to a destination. It is reentrant for the same owner,
+        renewed by heartbeat() and taken over from a worker that died, right
+        away on this host and once lease_seconds passed on another one.
+        Args:
+            name: name of the lock
+            owner: name of the worker
+            poll_seconds: wait between two attempts to take the lock
+        """
+        with self._lock:
+            # Holders in this process and their count, the threads of a worker
+            # share its locks
+            holders = self._held.setdefault((name, owner), [0, threading.Lock()])
+        with holders[1]:
+            while holders[0] == 0:
+                now = time.time()
+                with self._transaction() as connection:
+                    holder = connection.execute(
+                        "SELECT owner FROM locks WHERE name = ?", (name,)
+                    ).fetchone()
+                    dead = holder is not None and _is_dead(holder[0])
+                    connection.execute(
+                        "DELETE FROM locks WHERE name = ? AND expires_at < ?",
+                        (name, float("inf") if dead else now),
+                    )
+                    cursor = connection.execute(
+                        "INSERT OR IGNORE INTO locks VALUES (?, ?, ?)",
+                        (name, owner, now + self.lease_seconds),
+                    )
+                if cursor.rowcount == 1:
+                    break
+                time.sleep(poll_seconds)
+            holders[0] += 1
+        try:
+            yield
+        finally:
+            with holders[1]:
+                holders[0] -= 1
+                if holders[0] == 0:
+                    with self._transaction() as connection:
+                        connection.execute(
+                            "DELETE FROM locks WHERE name = ? AND owner = ?",
+                            (name, owner),
+                        )
+
+    def close(self):
+        self._connection.close()
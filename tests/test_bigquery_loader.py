@@ -0,0 +1,80 @@
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+from functions.bigquery_loader import (
+    BigQueryLoader,
+    FakeBigQueryBackend,
+    build_merge_query,
+)
+
+
+class TestBigQueryLoader(unittest.TestCase):
+
+    def setUp(self):
+        self.backend = FakeBigQueryBackend()
+        self.loader = BigQueryLoader(backend=self.backend, chunk_rows=2)
+        self.df = pd.DataFrame(
+            {
+                "id": ["a", "b", "c", "d", "e"],
+                "mag": [1.0, 2.0, 3.0, 4.0, 5.0],
+                "time": pd.to_datetime(["2024-01-01"] * 5, utc=True),
+                "net": pd.Categorical(["us", "us", "ak", "us", "ak"]),
+            }
+        )
+
+    def test_build_merge_query(self):
+        query = build_merge_query("p.d.t", "p.d.t__staging", ["id", "mag"], ["id"])
+
+        self.assertEqual(
+            query,
+            "MERGE `p.d.t` T USING `p.d.t__staging` S ON T.`id` = S.`id` "
+            "WHEN MATCHED THEN UPDATE SET `mag` = S.`mag` "
+            "WHEN NOT MATCHED THEN INSERT (`id`, `mag`) VALUES (S.`id`, S.`mag`)",
+        )
+
+    def test_append_is_split_in_chunks(self):
+        self.loader.load(self.df, "p.d.t")
+
+        self.assertEqual(sorted(rows for _, rows in self.backend.load_jobs), [1, 2, 2])
+        result_df = self.backend.tables["p.d.t"].sort_values("id", ignore_index=True)
+        self.assertListEqual(result_df["id"].tolist(), ["a", "b", "c", "d", "e"])
+        self.assertEqual(str(result_df["time"].dtype), "datetime64[ns, UTC]")
+
+    def test_upsert_is_idempotent(self):
+        self.loader.load(self.df, "p.d.t", key_columns=["id"])
+        self.loader.load(self.df, "p.d.t", key_columns=["id"])
+        revised = pd.DataFrame(
+            {
+                "id": ["b", "f"],
+                "mag": [2.5, 6.0],
+                "time": pd.to_datetime(["2024-01-02"] * 2, utc=True),
+                "net": pd.Categorical(["us", "us"]),
+            }
+        )
+        self.loader.load(revised, "p.d.t", key_columns=["id"])
+
+        result_df = self.backend.tables["p.d.t"].sort_values("id", ignore_index=True)
+        self.assertListEqual(result_df["id"].tolist(), ["a", "b", "c", "d", "e", "f"])
+        self.assertListEqual(result_df["mag"].tolist(), [1.0, 2.5, 3.0, 4.0, 5.0, 6.0])
+        self.assertListEqual(list(self.backend.tables), ["p.d.t"])
+
+    def test_concurrent_upserts_have_their_own_staging_table(self):
+        self.loader.load(self.df, "p.d.t", key_columns=["id"])
+        batches = [self.df.iloc[[i]].assign(mag=10.0 + i) for i in range(len(self.df))]
+
+        with ThreadPoolExecutor(max_workers=len(batches)) as executor:
+            for future in [
+                executor.submit(self.loader.load, batch, "p.d.t", ["id"])
+                for batch in batches
+            ]:
+                future.result()
+
+        result_df = self.backend.tables["p.d.t"].sort_values("id", ignore_index=True)
+        self.assertListEqual(result_df["mag"].tolist(), [10.0, 11.0, 12.0, 13.0, 14.0])
+        staging_tables = {table_id for table_id, _ in self.backend.load_jobs[3:]}
+        self.assertEqual(len(staging_tables), len(batches))
+        self.assertListEqual(list(self.backend.tables), ["p.d.t"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -9,7 +9,7 @@ class TestCombineTransformData(unittest.TestCase):
     def setUp(self):
         # Sample data for testing
         self.df = pd.DataFrame({"id": [1, 2, 3], "value": ["a", "b", "c"]})
-        self.columns_to_keep = ["id", "value", "location", "inserted_at", "new_id"]
+        self.columns_to_keep = ["id", "value", "location", "inserted_at", "hashed_id"]
         self.location_name = "TestLocation"
         self.end_combined_df = pd.DataFrame(
             {
@@ -17,7 +17,7 @@ class TestCombineTransformData(unittest.TestCase):
                 "value": ["d", "e"],
                 "location": ["OtherLocation", "OtherLocation"],
                 "inserted_at": [datetime.datetime.now(), datetime.datetime.now()],
-                "new_id": [12345, 67890],
+                "hashed_id": [12345, 67890],
             }
         )
 
@@ -38,8 +38,8 @@ class TestCombineTransformData(unittest.TestCase):
         # Check if the inserted_at column is added
         self.assertTrue("inserted_at" in result_df.columns)
 
-        # Check if the new_id column is added
-        self.assertTrue("new_id" in result_df.columns)
+        # Check if the hashed_id column is added
+        self.assertTrue("hashed_id" in result_df.columns)
 
         # Check if the data is concatenated correctly
         self.assertEqual(len(result_df), len(self.df) + len(self.end_combined_df))
@@ -55,7 +55,7 @@ class TestCombineTransformData(unittest.TestCase):
         # Check if the columns are as expected
         self.assertListEqual(
             list(result_df.columns),
-            self.df.columns.tolist() + ["location", "inserted_at", "new_id"],
+            self.df.columns.tolist() + ["location", "inserted_at", "hashed_id"],
         )
 
         # Check if the location column is correctly added
@@ -64,8 +64,8 @@ class TestCombineTransformData(unittest.TestCase):
         # Check if the inserted_at column is added
         self.assertTrue("inserted_at" in result_df.columns)
 
-        # Check if the new_id column is added
-        self.assertTrue("new_id" in result_df.columns)
+        # Check if the hashed_id column is added
+        self.assertTrue("hashed_id" in result_df.columns)
 
         # Check if the data is not concatenated
         self.assertEqual(len(result_df), len(self.df))
@@ -0,0 +1,65 @@
+import datetime
+import os
+import subprocess
+import sys
+import unittest
+import pandas as pd
+from functions.helper_functions import compute_hashed_id
+
+HASH_SCRIPT = """
+import pandas as pd
+from functions.helper_functions import compute_hashed_id
+df = pd.DataFrame({"id": ["us1", "us2"], "mag": [1.5, 2.5], "location": "pleo_dk"})
+print(compute_hashed_id(df).tolist())
+"""
+
+
+class TestComputeHashedId(unittest.TestCase):
+
+    def setUp(self):
+        self.df = pd.DataFrame(
+            {
+                "id": ["us1", "us2", "us3"],
+                "mag": [1.5, 2.5, 3.5],
+                "magType": pd.Categorical(["ml", "mb", "ml"]),
+                "location": "pleo_dk",
+            }
+        )
+
+    def test_hash_ignores_inserted_at(self):
+        first = self.df.assign(inserted_at=datetime.datetime(2024, 1, 1))
+        second = self.df.assign(inserted_at=datetime.datetime(2024, 6, 1))
+
+        pd.testing.assert_series_equal(
+            compute_hashed_id(first), compute_hashed_id(second)
+        )
+
+    def test_hash_changes_with_content(self):
+        revised = self.df.assign(mag=[1.5, 2.6, 3.5])
+
+        hashes = compute_hashed_id(self.df)
+        revised_hashes = compute_hashed_id(revised)
+
+        self.assertEqual(hashes.dtype, "int64")
+        self.assertEqual(hashes.nunique(), 3)
+        self.assertListEqual((hashes == revised_hashes).tolist(), [True, False, True])
+
+    def test_hash_is_stable_across_processes(self):
+        outputs = set()
+        for seed in ["1", "2"]:
+            env = dict(os.environ, PYTHONHASHSEED=seed)
+            outputs.add(
+                subprocess.run(
+                    [sys.executable, "-c", HASH_SCRIPT],
+                    env=env,
+                    capture_output=True,
+                    text=True,
+                    check=True,
+                ).stdout
+            )
+
+        self.assertEqual(len(outputs), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
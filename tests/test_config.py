@@ -0,0 +1,175 @@
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+from app import backfill_units
+from functions.config import (
+    DEFAULTS,
+    group_jobs,
+    load_jobs,
+    select_locations,
+)
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CONFIG = {
+    "locations": {
+        "pleo_dk": "Sortedam Dossering 7, 2200 Copenhagen N",
+        "pleo_de": "Karl-Marx-Allee 3, 10178 Berlin",
+    },
+    "maxradiuskm": 300,
+    "sink_kind": "parquet",
+    "jobs": {
+        "recent": {"start_time": "2023-01-01"},
+        "archive": {
+            "start_time": "2000-01-01",
+            "end_time": "2019-12-31",
+            "local_sink_path": "archive",
+        },
+        "canada": {
+            "locations": {"pleo_ca": "4 Place Ville Marie, Montreal"},
+            "local_sink_path": "canada",
+        },
+    },
+}
+
+
+class TestConfig(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, "config.json")
+        self.write_config(CONFIG)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write_config(self, config):
+        with open(self.path, "w") as file:
+            json.dump(config, file)
+
+    def test_jobs_override_the_top_level_settings(self):
+        recent, archive, canada = load_jobs(self.path)
+
+        self.assertEqual(recent.name, "recent")
+        self.assertEqual(recent.start_time, "2023-01-01")
+        self.assertEqual(recent.end_time, DEFAULTS["end_time"])
+        self.assertEqual(archive.maxradiuskm, 300)
+        self.assertListEqual(list(canada.locations), ["pleo_ca"])
+
+    def test_file_without_jobs_is_one_default_job(self):
+        self.write_config({"locations": CONFIG["locations"]})
+
+        (job,) = load_jobs(self.path, overrides={"usgs_base_url": "http://stub"})
+
+        self.assertEqual(job.name, "default")
+        self.assertEqual(job.usgs_base_url, "http://stub")
+        self.assertEqual(job.sink_kind, DEFAULTS["sink_kind"])
+
+    def test_unknown_settings_are_rejected(self):
+        self.write_config({**CONFIG, "jobs": {"recent": {"max_radius": 10}}})
+
+        with self.assertRaisesRegex(ValueError, "max_radius"):
+            load_jobs(self.path)
+
+    def test_spill_turns_off_the_state_held_in_memory(self):
+        self.write_config({**CONFIG, "jobs": {"recent": {"spill": True}}})
+
+        (recent,) = load_jobs(self.path)
+
+        self.assertTrue(recent.spill)
+        self.assertIsNone(recent.dedup_index_path)
+        self.assertIsNone(recent.rollup_path)
+        self.assertFalse(recent.spatial_index)
+
+        self.write_config({**CONFIG, "spill": True, "spatial_index": True})
+        with self.assertRaisesRegex(ValueError, "job recent: spatial_index"):
+            load_jobs(self.path)
+
+    def test_select_locations(self):
+        jobs = select_locations(load_jobs(self.path), ["pleo_de"])
+
+        self.assertListEqual([job.name for job in jobs], ["recent", "archive"])
+        self.assertListEqual(list(jobs[0].locations), ["pleo_de"])
+        with self.assertRaisesRegex(ValueError, "pleo_xx"):
+            select_locations(jobs, ["pleo_xx"])
+
+    def test_jobs_writing_the_same_tables_are_grouped(self):
+        recent, archive, canada = load_jobs(self.path)
+
+        # The three jobs write under different local roots
+        self.assertListEqual(
+            [
+                [job.name for job in group]
+                for group in group_jobs([recent, archive, canada])
+            ],
+            [["recent"], ["archive"], ["canada"]],
+        )
+        same_tables = archive._replace(local_sink_path=recent.local_sink_path)
+        self.assertListEqual(
+            [len(group) for group in group_jobs([recent, same_tables, canada])],
+            [2, 1],
+        )
+
+
+class TestBackfillUnits(unittest.TestCase):
+
+    def test_units_cover_the_date_range_of_every_location(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "config.json")
+            with open(path, "w") as file:
+                json.dump({**CONFIG, "backfill_window_days": 1000}, file)
+            archive = load_jobs(path)[1]
+
+        units = backfill_units(archive)
+
+        # 7304 days in windows of 1000 days, per location
+        self.assertEqual(len(units), 2 * 8)
+        keys = [key for key, _ in units]
+        self.assertEqual(len(set(keys)), len(keys))
+        self.assertEqual(
+            keys[0], "archive|pleo_dk|2000-01-01T00:00:00|2002-09-27T00:00:00"
+        )
+        dk_units = [
+            settings for _, settings in units if "pleo_dk" in settings["locations"]
+        ]
+        self.assertEqual(dk_units[0]["start_time"], "2000-01-01T00:00:00")
+        self.assertEqual(dk_units[-1]["end_time"], "2019-12-31T00:00:00")
+        for previous, unit in zip(dk_units, dk_units[1:]):
+            self.assertEqual(previous["end_time"], unit["start_time"])
+            self.assertDictEqual(
+                unit["locations"], {"pleo_dk": CONFIG["locations"]["pleo_dk"]}
+            )
+
+
+class TestCli(unittest.TestCase):
+
+    def test_dry_run_imports_no_heavy_dependency(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "config.json")
+            with open(path, "w") as file:
+                json.dump(CONFIG, file)
+            script = (
+                f"import sys; sys.path.insert(0, {REPO_ROOT!r}); import app\n"
+                f"app.main(['--config', {path!r}, '--dry-run'])\n"
+                "print(sorted({'pandas', 'geopy', 'google', 'pyarrow', 'requests'}"
+                " & set(sys.modules)))\n"
+            )
+            result = subprocess.run(
+                [sys.executable, "-c", script],
+                cwd=tmp_dir,
+                capture_output=True,
+                text=True,
+                check=True,
+            )
+
+        lines = result.stdout.splitlines()
+        self.assertEqual(lines[-1], "[]")
+        self.assertIn("job archive: 2000-01-01 to 2019-12-31, 300 km", result.stdout)
+        self.assertIn("pleo_ca: not in the geocoding cache", result.stdout)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,120 @@
+import os
+import tempfile
+import unittest
+import pandas as pd
+from functions.curated_collector import CuratedCollector, SpillingCollector
+
+
+class TestCuratedCollector(unittest.TestCase):
+
+    def setUp(self):
+        self.columns_to_keep = ["hashed_id", "id", "location", "inserted_at"]
+        self.collector = CuratedCollector(columns_to_keep=self.columns_to_keep)
+
+    def test_batches_are_projected_and_concatenated(self):
+        self.collector.add("loc_a", pd.DataFrame({"id": ["a", "b"], "mag": [1.0, 2.0]}))
+        self.collector.add("loc_b", pd.DataFrame({"id": ["b", "c"], "mag": [2.0, 3.0]}))
+
+        result_df = self.collector.result()
+
+        self.assertListEqual(list(result_df.columns), self.columns_to_keep)
+        self.assertListEqual(result_df["id"].tolist(), ["a", "b", "b", "c"])
+        self.assertListEqual(
+            result_df["location"].tolist(), ["loc_a", "loc_a", "loc_b", "loc_b"]
+        )
+
+    def test_duplicated_ids_are_dropped(self):
+        self.collector.add(
+            "loc_a", pd.DataFrame({"id": ["a", "a", "b"], "mag": [1.0, 1.0, 2.0]})
+        )
+        self.collector.add("loc_a", pd.DataFrame({"id": ["b"], "mag": [2.0]}))
+
+        result_df = self.collector.result()
+
+        self.assertListEqual(result_df["id"].tolist(), ["a", "b"])
+
+    def test_raw_frame_is_left_unchanged(self):
+        raw_df = pd.DataFrame({"id": ["a"], "mag": [1.0]})
+
+        self.collector.add("loc_a", raw_df)
+
+        self.assertListEqual(list(raw_df.columns), ["id", "mag"])
+
+    def test_empty_batches_are_skipped(self):
+        self.collector.add("loc_a", None)
+        self.collector.add("loc_b", pd.DataFrame({"id": []}))
+
+        result_df = self.collector.result()
+
+        self.assertTrue(result_df.empty)
+        self.assertListEqual(list(result_df.columns), self.columns_to_keep)
+
+
+class TestSpillingCollector(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.spill_path = os.path.join(self.tmp_dir.name, "spill")
+        self.columns_to_keep = ["hashed_id", "id", "location", "inserted_at"]
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def batch(self, start, n_rows):
+        return pd.DataFrame(
+            {"id": [f"ev{i}" for i in range(start, start + n_rows)], "mag": 1.0}
+        )
+
+    def test_batches_above_the_limit_are_spilled_and_read_back(self):
+        collector = SpillingCollector(
+            self.columns_to_keep, self.spill_path, max_memory_bytes=1000
+        )
+        for start in range(0, 500, 50):
+            collector.add("loc_a", self.batch(start, 50))
+        # Same event and location in two chunks, and another location
+        collector.add("loc_a", self.batch(0, 1))
+        collector.add("loc_b", self.batch(0, 1))
+
+        self.assertGreater(len(os.listdir(self.spill_path)), 1)
+        chunks = list(collector.iter_chunks(chunk_rows=40))
+
+        self.assertTrue(all(len(chunk) <= 40 for chunk in chunks))
+        result = pd.concat(chunks, ignore_index=True)
+        self.assertListEqual(list(result.columns), self.columns_to_keep)
+        self.assertEqual(len(result), 502)
+        self.assertEqual(len(result.drop_duplicates(["id", "location"])), 501)
+        self.assertEqual(
+            str(result["inserted_at"].dtype.categories.dtype), "datetime64[ns, UTC]"
+        )
+        self.assertListEqual(os.listdir(self.spill_path), [])
+        collector.close()
+        self.assertFalse(os.path.exists(self.spill_path))
+
+    def test_progressive_spills_are_handed_to_on_spill(self):
+        loaded = []
+        collector = SpillingCollector(
+            self.columns_to_keep,
+            self.spill_path,
+            max_memory_bytes=1000,
+            on_spill=loaded.append,
+        )
+        for start in range(0, 200, 50):
+            collector.add("loc_a", self.batch(start, 50))
+
+        self.assertGreater(len(loaded), 0)
+        self.assertListEqual(list(collector.iter_chunks()), [])
+        self.assertEqual(sum(len(df) for df in loaded), 200)
+        self.assertEqual(len(collector), 200)
+        self.assertListEqual(os.listdir(self.spill_path), [])
+
+    def test_chunks_of_a_previous_run_are_removed(self):
+        os.makedirs(self.spill_path)
+        open(os.path.join(self.spill_path, "chunk-000000.parquet"), "w").close()
+
+        collector = SpillingCollector(self.columns_to_keep, self.spill_path)
+
+        self.assertListEqual(list(collector.iter_chunks()), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,91 @@
+import os
+import tempfile
+import unittest
+import pandas as pd
+from functions.curated_collector import CuratedCollector
+from functions.dedup_index import DedupIndex
+from functions.helper_functions import transform_data
+
+RAW = pd.DataFrame(
+    {
+        "id": pd.array(["ev1", "ev2", "ev3"], dtype="string[pyarrow]"),
+        "time": pd.to_datetime(
+            ["2023-01-01T00:00:00Z", "2023-01-02T00:00:00Z", "2023-01-03T00:00:00Z"]
+        ),
+        "updated": pd.to_datetime(
+            ["2023-01-05T00:00:00Z", "2023-01-05T00:00:00Z", "2023-01-05T00:00:00Z"]
+        ),
+        "mag": [1.0, 2.0, 3.0],
+    }
+)
+
+
+class TestDedupIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, "dedup")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def saved_index(self, df, table="raw_data.pleo_dk", key_columns=("id",)):
+        index = DedupIndex(self.path)
+        index.record(df, table, key_columns)
+        index.save()
+        return DedupIndex(self.path)
+
+    def test_only_new_and_revised_rows_are_kept(self):
+        index = self.saved_index(RAW)
+        self.assertEqual(len(index.new_rows(RAW, "raw_data.pleo_dk", ["id"])), 0)
+
+        revised = RAW.copy()
+        revised.loc[0, ["mag", "updated"]] = [1.5, pd.Timestamp("2023-02-01", tz="UTC")]
+        # An older version of a loaded row is not loaded again
+        revised.loc[1, ["mag", "updated"]] = [2.5, pd.Timestamp("2022-12-01", tz="UTC")]
+        new = RAW.iloc[[0]].assign(id=pd.array(["ev4"], dtype="string[pyarrow]"))
+        rows = index.new_rows(
+            pd.concat([revised, new], ignore_index=True), "raw_data.pleo_dk", ["id"]
+        )
+
+        self.assertListEqual(rows["id"].tolist(), ["ev1", "ev4"])
+        # Other tables have their own index
+        self.assertEqual(len(index.new_rows(RAW, "raw_data.pleo_de", ["id"])), 3)
+
+    def test_recorded_rows_replace_the_saved_ones(self):
+        revised = RAW.assign(mag=[9.0, 2.0, 3.0])
+        index = self.saved_index(RAW)
+        index.record(revised.iloc[[0]], "raw_data.pleo_dk", ["id"])
+        index.save()
+
+        index = DedupIndex(self.path)
+        self.assertEqual(len(index.new_rows(revised, "raw_data.pleo_dk", ["id"])), 0)
+        self.assertEqual(len(index), 3)
+
+        index.reset("raw_data.pleo_dk")
+        self.assertEqual(
+            len(DedupIndex(self.path).new_rows(RAW, "raw_data.pleo_dk", ["id"])), 3
+        )
+
+    def test_curated_rows_are_filtered_in_the_collector(self):
+        table = "curated_data.earthquakes"
+        columns = ["hashed_id", "id", "time", "location", "inserted_at"]
+        loaded = transform_data("pleo_dk", RAW)[columns]
+        index = self.saved_index(loaded, table, ["id", "location"])
+
+        collector = CuratedCollector(
+            columns,
+            inserted_at=pd.Timestamp("2024-01-01", tz="UTC"),
+            row_filter=lambda df: index.new_rows(df, table, ["id", "location"]),
+        )
+        collector.add("pleo_dk", RAW)
+        collector.add("pleo_de", RAW)
+
+        # The same events around another location are new curated rows
+        self.assertListEqual(
+            collector.result()["location"].astype(str).tolist(), ["pleo_de"] * 3
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
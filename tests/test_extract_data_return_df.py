@@ -1,21 +1,19 @@
 import unittest
 from unittest.mock import patch, MagicMock
 import pandas as pd
-from io import StringIO
+from io import BytesIO, StringIO
 import requests
-import time
-from functions.helper_functions import extract_data_return_df
+from functions.helper_functions import extract_data_return_df, stream_data_frames
 
 
 class TestHelperFunctions(unittest.TestCase):
 
-    @patch("helper_functions.requests.get")
-    @patch("helper_functions.time.sleep", return_value=None)
-    def test_extract_data_return_df_success(self, mock_sleep, mock_get):
+    @patch("functions.helper_functions.http_transport.get")
+    def test_extract_data_return_df_success(self, mock_get):
         # Mock the response from requests.get
         mock_response = MagicMock()
         mock_response.raise_for_status = MagicMock()
-        mock_response.text = "col1,col2\nval1,val2\nval3,val4"
+        mock_response.raw = BytesIO(b"col1,col2\nval1,val2\nval3,val4")
         mock_get.return_value = mock_response
 
         url = "http://example.com"
@@ -25,17 +23,39 @@ class TestHelperFunctions(unittest.TestCase):
         result_df = extract_data_return_df(url, location_name)
 
         # Create expected DataFrame
-        expected_df = pd.read_csv(StringIO(mock_response.text))
+        expected_df = pd.read_csv(StringIO("col1,col2\nval1,val2\nval3,val4"))
 
         # Assert the DataFrame is as expected
         pd.testing.assert_frame_equal(result_df, expected_df)
-        mock_get.assert_called_once_with(url)
+        mock_get.assert_called_once_with(url, stream=True)
         mock_response.raise_for_status.assert_called_once()
-        mock_sleep.assert_called_once_with(1)
 
-    @patch("helper_functions.requests.get")
-    @patch("helper_functions.time.sleep", return_value=None)
-    def test_extract_data_return_df_http_error(self, mock_sleep, mock_get):
+    @patch("functions.helper_functions.http_transport.get")
+    def test_extract_data_return_df_usgs_schema(self, mock_get):
+        # Mock a USGS csv response
+        mock_response = MagicMock()
+        mock_response.raw = BytesIO(
+            b"time,latitude,longitude,depth,mag,magType,net,id,updated,place,type,status\n"
+            b"2023-12-30T23:45:12.345Z,55.1,12.3,10,2.5,ml,us,us1,2024-01-02T10:00:00.000Z,Somewhere,earthquake,reviewed\n"
+            b"2023-12-29T01:02:03.000Z,54.9,11.8,5,3,mb,us,us2,2024-01-03T10:00:00.000Z,Elsewhere,earthquake,automatic\n"
+        )
+        mock_get.return_value = mock_response
+
+        result_df = extract_data_return_df("http://example.com", "Test Location")
+
+        self.assertEqual(str(result_df["time"].dtype), "datetime64[ns, UTC]")
+        self.assertEqual(str(result_df["updated"].dtype), "datetime64[ns, UTC]")
+        self.assertEqual(result_df["mag"].dtype, "float64")
+        self.assertEqual(result_df["depth"].dtype, "float64")
+        for col in ["net", "magType", "status", "type"]:
+            self.assertEqual(result_df[col].dtype, "category")
+        self.assertEqual(
+            result_df["time"].iloc[0], pd.Timestamp("2023-12-30T23:45:12.345Z")
+        )
+        mock_response.close.assert_called_once()
+
+    @patch("functions.helper_functions.http_transport.get")
+    def test_extract_data_return_df_http_error(self, mock_get):
         # Mock the response from requests.get to raise an HTTPError
         mock_response = MagicMock()
         mock_response.raise_for_status.side_effect = requests.HTTPError("HTTP Error")
@@ -48,13 +68,11 @@ class TestHelperFunctions(unittest.TestCase):
         with self.assertRaises(requests.HTTPError):
             extract_data_return_df(url, location_name)
 
-        mock_get.assert_called_once_with(url)
+        mock_get.assert_called_once_with(url, stream=True)
         mock_response.raise_for_status.assert_called_once()
-        mock_sleep.assert_not_called()
 
-    @patch("helper_functions.requests.get")
-    @patch("helper_functions.time.sleep", return_value=None)
-    def test_extract_data_return_df_timeout(self, mock_sleep, mock_get):
+    @patch("functions.helper_functions.http_transport.get")
+    def test_extract_data_return_df_timeout(self, mock_get):
         # Mock the response from requests.get to raise a Timeout
         mock_get.side_effect = requests.Timeout("Timeout Error")
 
@@ -65,12 +83,10 @@ class TestHelperFunctions(unittest.TestCase):
         with self.assertRaises(requests.Timeout):
             extract_data_return_df(url, location_name)
 
-        mock_get.assert_called_once_with(url)
-        mock_sleep.assert_not_called()
+        mock_get.assert_called_once_with(url, stream=True)
 
-    @patch("helper_functions.requests.get")
-    @patch("helper_functions.time.sleep", return_value=None)
-    def test_extract_data_return_df_request_exception(self, mock_sleep, mock_get):
+    @patch("functions.helper_functions.http_transport.get")
+    def test_extract_data_return_df_request_exception(self, mock_get):
         # Mock the response from requests.get to raise a RequestException
         mock_get.side_effect = requests.RequestException("Request Exception")
 
@@ -81,8 +97,21 @@ class TestHelperFunctions(unittest.TestCase):
         with self.assertRaises(requests.RequestException):
             extract_data_return_df(url, location_name)
 
-        mock_get.assert_called_once_with(url)
-        mock_sleep.assert_not_called()
+        mock_get.assert_called_once_with(url, stream=True)
+
+    @patch("functions.helper_functions.http_transport.get")
+    def test_stream_data_frames_bounded_chunks(self, mock_get):
+        mock_response = MagicMock()
+        mock_response.raw = BytesIO(
+            b"id,mag\n" + b"".join(b"e%d,1.5\n" % i for i in range(5))
+        )
+        mock_get.return_value = mock_response
+
+        frames = list(
+            stream_data_frames("http://example.com", "Test Location", chunk_rows=2)
+        )
+
+        self.assertListEqual([len(frame) for frame in frames], [2, 2, 1])
 
 
 if __name__ == "__main__":
@@ -0,0 +1,103 @@
+import time
+import unittest
+from unittest.mock import patch
+import pandas as pd
+from functions.extraction_engine import (
+    TokenBucket,
+    extract_locations,
+    iter_extract_locations,
+)
+
+
+class TestTokenBucket(unittest.TestCase):
+
+    def test_burst_is_immediate(self):
+        bucket = TokenBucket(rate=100, capacity=5)
+
+        started_at = time.monotonic()
+        for _ in range(5):
+            bucket.acquire()
+
+        self.assertLess(time.monotonic() - started_at, 0.05)
+
+    def test_rate_is_enforced_after_burst(self):
+        bucket = TokenBucket(rate=50, capacity=1)
+
+        started_at = time.monotonic()
+        for _ in range(6):
+            bucket.acquire()
+
+        # 1 token from the burst, 5 more at 50 tokens per second
+        self.assertGreaterEqual(time.monotonic() - started_at, 0.09)
+
+
+class TestExtractLocations(unittest.TestCase):
+
+    @patch("functions.extraction_engine.extract_data_return_df")
+    @patch("functions.extraction_engine.plan_time_windows")
+    def test_every_unit_is_extracted_and_stitched(self, mock_plan, mock_extract):
+        mock_plan.side_effect = lambda **kwargs: [("t0", "t1"), ("t1", "t2")]
+        mock_extract.side_effect = lambda url, location_name, rate_limiter: (
+            pd.DataFrame({"id": [url], "location": [location_name]})
+        )
+        dic_addresses = {"loc_a": [1.0, 2.0], "loc_b": [3.0, 4.0]}
+
+        result = extract_locations(
+            dic_addresses=dic_addresses,
+            url_template="q?s={start_time}&e={end_time}&lat={latitude}",
+            count_url_template="c",
+            start_time="2020-01-01",
+            end_time="2020-01-02",
+            maxradiuskm=500,
+            limit=20000,
+            merge_regions=False,
+        )
+
+        self.assertListEqual(list(result), ["loc_a", "loc_b"])
+        self.assertListEqual(
+            result["loc_a"]["id"].tolist(),
+            ["q?s=t0&e=t1&lat=1.0", "q?s=t1&e=t2&lat=1.0"],
+        )
+        self.assertListEqual(
+            result["loc_b"]["id"].tolist(),
+            ["q?s=t0&e=t1&lat=3.0", "q?s=t1&e=t2&lat=3.0"],
+        )
+        self.assertEqual(mock_extract.call_count, 4)
+
+    @patch("functions.extraction_engine.extract_data_return_df")
+    @patch("functions.extraction_engine.plan_time_windows")
+    def test_windows_are_streamed_and_requested_on_demand(
+        self, mock_plan, mock_extract
+    ):
+        mock_plan.side_effect = lambda **kwargs: [
+            (f"t{i}", f"t{i + 1}") for i in range(10)
+        ]
+        mock_extract.side_effect = lambda url, location_name, rate_limiter: (
+            pd.DataFrame({"id": [url]})
+        )
+
+        locations = iter_extract_locations(
+            dic_addresses={"loc_a": [1.0, 2.0]},
+            url_template="q?s={start_time}",
+            count_url_template="c",
+            start_time="2020-01-01",
+            end_time="2020-01-02",
+            maxradiuskm=500,
+            limit=20000,
+            merge_regions=False,
+            max_pending_units=2,
+            stream_windows=True,
+        )
+        first = next(locations)
+
+        # Only max_pending_units windows are requested ahead of the consumer
+        self.assertEqual(mock_extract.call_count, 2)
+        items = [first, *locations]
+        self.assertListEqual(
+            [df["id"][0] for _, df in items], [f"q?s=t{i}" for i in range(10)]
+        )
+        self.assertTrue(all(name == "loc_a" for name, _ in items))
+
+
+if __name__ == "__main__":
+    unittest.main()
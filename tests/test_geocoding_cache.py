@@ -0,0 +1,64 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import patch, MagicMock
+from functions.geocoding_cache import GeocodingCache
+from functions.helper_functions import get_coordinates
+
+
+class TestGeocodingCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, "geocoding.json")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_entries_survive_a_reload(self):
+        cache = GeocodingCache(self.path)
+        cache.set("Karl-Marx-Allee 3,  10178 Berlin", [52.5, 13.4])
+        cache.save()
+
+        reloaded = GeocodingCache(self.path)
+
+        self.assertEqual(reloaded.get("karl-marx-allee 3, 10178 berlin"), [52.5, 13.4])
+
+    def test_expired_entries_are_misses(self):
+        cache = GeocodingCache(self.path, ttl=60)
+        cache.set("Berlin", [52.5, 13.4])
+
+        with patch("functions.geocoding_cache.time.time", return_value=10**12):
+            self.assertIsNone(cache.get("Berlin"))
+
+    def test_invalidate(self):
+        cache = GeocodingCache(self.path)
+        cache.set("Berlin", [52.5, 13.4])
+        cache.set("Madrid", [40.4, -3.7])
+
+        cache.invalidate("Berlin")
+        self.assertIsNone(cache.get("Berlin"))
+        self.assertIsNotNone(cache.get("Madrid"))
+
+        cache.invalidate()
+        self.assertIsNone(cache.get("Madrid"))
+
+    @patch("functions.helper_functions.ArcGIS")
+    def test_warm_run_makes_no_geocoder_calls(self, mock_arcgis):
+        mock_geocoder = MagicMock()
+        mock_geocoder.geocode.side_effect = lambda address: MagicMock(
+            latitude=len(address), longitude=-len(address)
+        )
+        mock_arcgis.return_value = mock_geocoder
+        locations = {"short": "Berlin", "long": "Copenhagen"}
+
+        cold = get_coordinates(locations, cache=GeocodingCache(self.path))
+        warm = get_coordinates(locations, cache=GeocodingCache(self.path))
+
+        self.assertEqual(cold, {"short": [6, -6], "long": [10, -10]})
+        self.assertEqual(warm, cold)
+        self.assertEqual(mock_geocoder.geocode.call_count, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,27 +1,11 @@
 import unittest
 from unittest.mock import patch, MagicMock
-from functions.helper_functions import get_total_n_earthquakes, get_coordinates
+from functions.helper_functions import get_coordinates
 
 
 class TestHelperFunctions(unittest.TestCase):
 
-    @patch("helper_functions.requests.get")
-    def test_get_total_n_earthquakes(self, mock_get):
-        # Mock the response from requests.get
-        mock_response = MagicMock()
-        mock_response.text = "5"
-        mock_get.return_value = mock_response
-
-        url = "http://example.com"
-        location_name = "TestLocation"
-
-        result = get_total_n_earthquakes(url, location_name)
-
-        self.assertEqual(result, {location_name: ["5"]})
-        self.assertIn(location_name, result)
-        self.assertEqual(result[location_name], ["5"])
-
-    @patch("helper_functions.ArcGIS")
+    @patch("functions.helper_functions.ArcGIS")
     def test_get_coordinates(self, mock_arcgis):
         # Mock the geocode method
         mock_geocoder = MagicMock()
@@ -0,0 +1,62 @@
+import gzip
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from functions import http_transport
+
+
+class FlakyHandler(BaseHTTPRequestHandler):
+    """Answers 503 to the first two requests, then a gzipped body."""
+
+    calls = []
+
+    def do_GET(self):
+        FlakyHandler.calls.append(self.headers.get("Accept-Encoding"))
+        if len(FlakyHandler.calls) <= 2:
+            self.send_response(503)
+            self.send_header("Retry-After", "0")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        body = gzip.compress(b"42")
+        self.send_response(200)
+        self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestHttpTransport(unittest.TestCase):
+
+    def setUp(self):
+        FlakyHandler.calls = []
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), FlakyHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.server.server_port}/count"
+        http_transport.configure(backoff_factor=0, backoff_jitter=0)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        http_transport.configure(backoff_factor=0.5, backoff_jitter=0.5)
+
+    def test_retries_on_503_and_decodes_gzip(self):
+        response = http_transport.get(self.url)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.text, "42")
+        self.assertEqual(FlakyHandler.calls, ["gzip"] * 3)
+
+    def test_session_is_shared(self):
+        self.assertIs(http_transport.get_session(), http_transport.get_session())
+
+    def test_unknown_setting_is_rejected(self):
+        with self.assertRaises(ValueError):
+            http_transport.configure(retries=3)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,73 @@
+import json
+import logging
+import os
+import shutil
+import tempfile
+import unittest
+from functions.logger import JsonFormatter, Metrics, metrics, span, timed
+
+
+class TestMetrics(unittest.TestCase):
+
+    def setUp(self):
+        metrics.reset()
+
+    def test_span_records_calls_and_errors(self):
+        with span("download", location="loc_a"):
+            pass
+        with self.assertRaises(RuntimeError):
+            with span("download", location="loc_a"):
+                raise RuntimeError("boom")
+
+        recorded = metrics.spans[("download", (("location", "loc_a"),))]
+        self.assertEqual(recorded["count"], 2)
+        self.assertGreaterEqual(recorded["total"], recorded["max"])
+
+    def test_timed_decorator(self):
+        @timed("hashing")
+        def double(value):
+            return value * 2
+
+        self.assertEqual(double(21), 42)
+        self.assertEqual(metrics.spans[("hashing", ())]["count"], 1)
+
+    def test_counters_are_summed_per_labels(self):
+        registry = Metrics()
+        registry.count("rows", 10, location="loc_a")
+        registry.count("rows", 5, location="loc_a")
+        registry.count("rows", 1, location="loc_b")
+
+        self.assertEqual(registry.counters[("rows", (("location", "loc_a"),))], 15)
+        self.assertIn("rows", registry.summary_table())
+
+    def test_prometheus_text_format(self):
+        registry = Metrics()
+        registry.count("rows", 3, location='say "hi"')
+        registry.record_span("parse", 0.5)
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, "metrics.prom")
+
+        registry.write_prometheus(path, prefix="test")
+        with open(path) as file:
+            text = file.read()
+        shutil.rmtree(directory)
+
+        self.assertIn("# TYPE test_rows_total counter", text)
+        self.assertIn('test_rows_total{location="say \\"hi\\""} 3', text)
+        self.assertIn("test_parse_seconds_sum 0.5", text)
+        self.assertIn("test_parse_seconds_count 1", text)
+
+    def test_json_formatter_keeps_extra_fields(self):
+        record = logging.makeLogRecord(
+            {"name": "metrics", "levelname": "INFO", "msg": "done", "rows": 3}
+        )
+
+        entry = json.loads(JsonFormatter().format(record))
+
+        self.assertEqual(entry["message"], "done")
+        self.assertEqual(entry["rows"], 3)
+        self.assertEqual(entry["logger"], "metrics")
+
+
+if __name__ == "__main__":
+    unittest.main()
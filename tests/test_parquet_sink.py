@@ -0,0 +1,159 @@
+import importlib.util
+import os
+import tempfile
+import unittest
+from unittest.mock import MagicMock, patch
+import pandas as pd
+import pyarrow.dataset as ds
+from functions.sinks import BigQuerySink, ParquetSink, build_sink
+
+
+def read_table(path):
+    table = ds.dataset(path, format="parquet", partitioning="hive").to_table()
+    return table.to_pandas().sort_values(["id", "location"], ignore_index=True)
+
+
+class TestParquetSink(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.sink = ParquetSink(root=self.tmp_dir.name)
+        self.df = pd.DataFrame(
+            {
+                "id": ["a", "b", "a"],
+                "time": pd.to_datetime(
+                    [
+                        "2024-01-01T10:00:00Z",
+                        "2024-01-02T10:00:00Z",
+                        "2024-01-01T10:00:00Z",
+                    ]
+                ),
+                "mag": [1.0, 2.0, 1.0],
+                "location": ["pleo_dk", "pleo_dk", "pleo_de"],
+            }
+        )
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_tables_are_partitioned_by_location_and_month(self):
+        self.sink.write(self.df, "curated_data", "earthquakes")
+
+        path = self.sink.table_path("curated_data", "earthquakes")
+        self.assertTrue(
+            os.path.isdir(os.path.join(path, "location=pleo_dk", "event_month=2024-01"))
+        )
+        self.assertEqual(len(read_table(path)), 3)
+
+    def test_appends_keep_previous_rows(self):
+        self.sink.write(self.df, "curated_data", "earthquakes")
+        self.sink.write(self.df, "curated_data", "earthquakes")
+
+        path = self.sink.table_path("curated_data", "earthquakes")
+        self.assertEqual(len(read_table(path)), 6)
+
+    def test_upsert_replaces_revised_rows(self):
+        self.sink.write(self.df, "curated_data", "earthquakes", ["id", "location"])
+        # Event b is revised and moves to another month, event c is new
+        revised = pd.DataFrame(
+            {
+                "id": ["b", "c"],
+                "time": pd.to_datetime(
+                    ["2024-02-03T10:00:00Z", "2024-02-03T11:00:00Z"]
+                ),
+                "mag": [2.5, 3.0],
+                "location": ["pleo_dk", "pleo_dk"],
+            }
+        )
+        self.sink.write(revised, "curated_data", "earthquakes", ["id", "location"])
+        self.sink.write(revised, "curated_data", "earthquakes", ["id", "location"])
+
+        path = self.sink.table_path("curated_data", "earthquakes")
+        result_df = read_table(path)
+        self.assertListEqual(result_df["id"].tolist(), ["a", "a", "b", "c"])
+        self.assertListEqual(result_df["mag"].tolist(), [1.0, 1.0, 2.5, 3.0])
+        january = pd.read_parquet(
+            os.path.join(path, "location=pleo_dk", "event_month=2024-01")
+        )
+        self.assertListEqual(january["id"].tolist(), ["a"])
+        self.assertListEqual(
+            os.listdir(os.path.join(self.tmp_dir.name, ".staging")), []
+        )
+
+    def test_emptied_partitions_are_removed(self):
+        self.sink.write(self.df, "curated_data", "earthquakes", ["id", "location"])
+        self.sink.write(
+            self.df.assign(time=pd.Timestamp("2024-03-01T10:00:00Z")),
+            "curated_data",
+            "earthquakes",
+            ["id", "location"],
+        )
+
+        path = self.sink.table_path("curated_data", "earthquakes")
+        self.assertListEqual(
+            sorted(os.listdir(os.path.join(path, "location=pleo_dk"))),
+            ["event_month=2024-03"],
+        )
+        self.assertEqual(len(read_table(path)), 3)
+
+    def test_failed_upsert_keeps_the_table(self):
+        self.sink.write(self.df, "curated_data", "earthquakes", ["id", "location"])
+        path = self.sink.table_path("curated_data", "earthquakes")
+
+        with patch("functions.sinks.pq.write_table", side_effect=OSError("disk full")):
+            with self.assertRaises(OSError):
+                self.sink.write(
+                    self.df.assign(mag=9.0),
+                    "curated_data",
+                    "earthquakes",
+                    ["id", "location"],
+                )
+
+        self.assertListEqual(read_table(path)["mag"].tolist(), [1.0, 1.0, 2.0])
+
+    def test_raw_tables_are_partitioned_by_month_only(self):
+        self.sink.write(self.df.drop(columns="location"), "raw_data", "pleo_dk", ["id"])
+
+        path = self.sink.table_path("raw_data", "pleo_dk")
+        self.assertListEqual(sorted(os.listdir(path)), ["event_month=2024-01"])
+
+    @unittest.skipUnless(importlib.util.find_spec("duckdb"), "duckdb is not installed")
+    def test_duckdb_view(self):
+        import duckdb
+
+        duckdb_path = os.path.join(self.tmp_dir.name, "catalog.duckdb")
+        sink = ParquetSink(root=self.tmp_dir.name, duckdb_path=duckdb_path)
+        sink.write(self.df, "curated_data", "earthquakes")
+
+        connection = duckdb.connect(duckdb_path)
+        count = connection.execute(
+            "SELECT count(*) FROM curated_data.earthquakes WHERE location = 'pleo_dk'"
+        ).fetchone()[0]
+        connection.close()
+        self.assertEqual(count, 2)
+
+
+class TestBuildSink(unittest.TestCase):
+
+    def test_bigquery_sink_uses_table_ids(self):
+        loader = MagicMock()
+        sink = BigQuerySink(project_id="p", loader=loader)
+
+        sink.write("df", "raw_data", "pleo_dk", ["id"])
+
+        loader.load.assert_called_once_with(
+            "df", "p.raw_data.pleo_dk", key_columns=["id"]
+        )
+
+    def test_unknown_sink(self):
+        with self.assertRaises(ValueError):
+            build_sink("csv")
+
+    def test_parquet_sink(self):
+        self.assertIsInstance(
+            build_sink("parquet", local_path="somewhere"), ParquetSink
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
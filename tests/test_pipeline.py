@@ -0,0 +1,87 @@
+import threading
+import time
+import unittest
+from functions.pipeline import Stage, run_pipeline
+
+
+class TestRunPipeline(unittest.TestCase):
+
+    def test_every_item_goes_through_every_stage(self):
+        loaded = []
+        lock = threading.Lock()
+
+        def load(item):
+            with lock:
+                loaded.append(item)
+            return item * 10
+
+        transformed = []
+        run_pipeline(
+            range(20),
+            [Stage("load", load, workers=3), Stage("transform", transformed.append, 1)],
+        )
+
+        self.assertListEqual(sorted(loaded), list(range(20)))
+        self.assertListEqual(sorted(transformed), [i * 10 for i in range(20)])
+
+    def test_stages_overlap(self):
+        def slow(item):
+            time.sleep(0.05)
+            return item
+
+        started_at = time.monotonic()
+        run_pipeline(
+            (slow(i) for i in range(8)),
+            [Stage("a", slow, workers=1), Stage("b", slow, workers=1)],
+        )
+
+        # 3 stages of 8 * 0.05 s, close to one stage when they overlap
+        self.assertLess(time.monotonic() - started_at, 0.9)
+
+    def test_slow_stage_holds_the_source_back(self):
+        produced = []
+        consumed = []
+        ahead = []
+
+        def source():
+            for i in range(30):
+                produced.append(i)
+                ahead.append(len(produced) - len(consumed))
+                yield i
+
+        def consume(item):
+            time.sleep(0.005)
+            consumed.append(item)
+
+        run_pipeline(source(), [Stage("consume", consume, workers=1)], queue_size=2)
+
+        # The queue, the item being consumed and the one being put
+        self.assertLessEqual(max(ahead), 4)
+        self.assertEqual(len(consumed), 30)
+
+    def test_failure_stops_every_stage(self):
+        closed = threading.Event()
+
+        def source():
+            try:
+                for i in range(1000):
+                    yield i
+            finally:
+                closed.set()
+
+        def fail(item):
+            if item == 3:
+                raise ValueError("bad item")
+            return item
+
+        with self.assertRaises(ValueError):
+            run_pipeline(
+                source(),
+                [Stage("fail", fail, workers=2), Stage("sink", lambda _: None, 1)],
+            )
+
+        self.assertTrue(closed.is_set())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,128 @@
+import datetime
+import unittest
+from unittest.mock import ANY, MagicMock, patch
+from urllib.parse import urlparse, parse_qs
+import pandas as pd
+from functions.query_planner import plan_time_windows, count_window
+from functions.extraction_engine import extract_locations
+
+COUNT_URL = "http://example.com/count?starttime={start_time}&endtime={end_time}&latitude={latitude}&longitude={longitude}&maxradiuskm={maxradiuskm}"
+
+
+def fake_count(url):
+    # One earthquake per hour in the requested window
+    query = parse_qs(urlparse(url).query)
+    window_start = datetime.datetime.fromisoformat(query["starttime"][0])
+    window_end = datetime.datetime.fromisoformat(query["endtime"][0])
+    mock_response = MagicMock()
+    mock_response.text = str(int((window_end - window_start).total_seconds() // 3600))
+    return mock_response
+
+
+class TestPlanTimeWindows(unittest.TestCase):
+
+    def setUp(self):
+        count_window.cache_clear()
+
+    @patch("functions.query_planner.http_transport.get", side_effect=fake_count)
+    def test_single_window_under_limit(self, mock_get):
+        windows = plan_time_windows(
+            COUNT_URL, "2020-01-01", "2020-01-02", 1.0, 2.0, 500, limit=100
+        )
+
+        self.assertEqual(windows, [("2020-01-01T00:00:00", "2020-01-02T00:00:00")])
+        mock_get.assert_called_once()
+
+    @patch("functions.query_planner.http_transport.get", side_effect=fake_count)
+    def test_windows_are_contiguous_and_under_limit(self, mock_get):
+        windows = plan_time_windows(
+            COUNT_URL, "2020-01-01", "2020-03-01", 1.0, 2.0, 500, limit=100
+        )
+
+        self.assertGreater(len(windows), 1)
+        self.assertEqual(windows[0][0], "2020-01-01T00:00:00")
+        self.assertEqual(windows[-1][1], "2020-03-01T00:00:00")
+        for previous, current in zip(windows, windows[1:]):
+            self.assertEqual(previous[1], current[0])
+        for window_start, window_end in windows:
+            hours = (
+                datetime.datetime.fromisoformat(window_end)
+                - datetime.datetime.fromisoformat(window_start)
+            ).total_seconds() // 3600
+            self.assertLessEqual(hours, 100)
+
+    @patch("functions.query_planner.http_transport.get")
+    def test_windows_without_events_are_dropped(self, mock_get):
+        # Events only in the first 50 hours
+        def count_first_hours(url):
+            query = parse_qs(urlparse(url).query)
+            window_start = datetime.datetime.fromisoformat(query["starttime"][0])
+            window_end = min(
+                datetime.datetime.fromisoformat(query["endtime"][0]),
+                datetime.datetime(2020, 1, 3, 2),
+            )
+            return MagicMock(
+                text=str(
+                    max(0, int((window_end - window_start).total_seconds()) // 3600)
+                )
+            )
+
+        mock_get.side_effect = count_first_hours
+        windows = plan_time_windows(
+            COUNT_URL, "2020-01-01", "2020-03-01", 1.0, 2.0, 500, limit=10
+        )
+
+        self.assertEqual(windows[0][0], "2020-01-01T00:00:00")
+        self.assertLess(windows[-1][1], "2020-01-10")
+        self.assertListEqual(
+            plan_time_windows(
+                COUNT_URL, "2021-01-01", "2021-03-01", 1.0, 2.0, 500, limit=100
+            ),
+            [],
+        )
+
+    @patch("functions.query_planner.http_transport.get", side_effect=fake_count)
+    def test_count_probes_are_cached(self, mock_get):
+        plan_time_windows(COUNT_URL, "2020-01-01", "2020-01-02", 1.0, 2.0, 500, 100)
+        plan_time_windows(COUNT_URL, "2020-01-01", "2020-01-02", 1.0, 2.0, 500, 100)
+
+        mock_get.assert_called_once()
+
+
+class TestExtractLocationsWindows(unittest.TestCase):
+
+    @patch("functions.extraction_engine.extract_data_return_df")
+    @patch("functions.extraction_engine.plan_time_windows")
+    def test_windows_are_stitched_without_duplicates(self, mock_plan, mock_extract):
+        mock_plan.side_effect = lambda **kwargs: [
+            ("2020-01-01", "2020-01-02"),
+            ("2020-01-02", "2020-01-03"),
+        ]
+        mock_extract.side_effect = [
+            pd.DataFrame({"id": ["a", "b"], "mag": [1.0, 2.0]}),
+            pd.DataFrame({"id": ["b", "c"], "mag": [2.0, 3.0]}),
+        ]
+
+        result = extract_locations(
+            dic_addresses={"TestLocation": [1.0, 2.0]},
+            url_template="http://example.com?start={start_time}&end={end_time}"
+            "&lat={latitude}",
+            count_url_template="c",
+            start_time="2020-01-01",
+            end_time="2020-01-03",
+            maxradiuskm=500,
+            limit=20000,
+            merge_regions=False,
+            max_workers=1,
+        )
+
+        self.assertListEqual(result["TestLocation"]["id"].tolist(), ["a", "b", "c"])
+        mock_extract.assert_any_call(
+            url="http://example.com?start=2020-01-02&end=2020-01-03&lat=1.0",
+            location_name="TestLocation",
+            rate_limiter=ANY,
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
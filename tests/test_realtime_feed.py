@@ -0,0 +1,141 @@
+import os
+import tempfile
+import threading
+import time
+import unittest
+from unittest.mock import patch
+import pandas as pd
+from app import run_realtime, spatial_index_path
+from bench.stub_usgs import Catalog, build_server
+from functions import http_transport
+from functions.config import DEFAULTS, JobConfig
+from functions.destination import Destination
+from functions.geocoding_cache import GeocodingCache
+from functions.realtime_feed import FeedPoller, feed_url, locate_events, parse_feed
+from functions.spatial_index import SpatialIndex, update_spatial_index
+from functions.usgs_schema import CSV_COLUMNS
+
+OFFICES = {"pleo_de": [52.52, 13.41], "pleo_pt": [38.72, -9.14]}
+
+EVENTS = [
+    {"id": "us001", "latitude": 52.0, "longitude": 13.0, "depth": 10.0, "mag": 2.5},
+    {"id": "us002", "latitude": 39.0, "longitude": -9.0, "depth": 5.0, "mag": 4.1},
+    # More than 500 km from both offices
+    {"id": "us003", "latitude": 0.0, "longitude": 0.0, "depth": 33.0, "mag": 5.0},
+]
+
+
+class TestRealtimeFeed(unittest.TestCase):
+
+    def setUp(self):
+        self.server = build_server(Catalog(10))
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.base_url = f"http://127.0.0.1:{self.server.server_port}"
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        # Closes the kept alive connections, the next server may get the port
+        http_transport.configure()
+
+    def test_only_changed_feeds_are_parsed(self):
+        poller = FeedPoller(feed_url(self.base_url, "all_hour"))
+        self.server.feed.publish(EVENTS)
+
+        df = poller.poll()
+        self.assertListEqual(list(df.columns), CSV_COLUMNS)
+        self.assertListEqual(sorted(df["id"]), ["us001", "us002", "us003"])
+        self.assertEqual(df.loc[df["id"] == "us002", "latitude"].item(), 39.0)
+        self.assertEqual(str(df["time"].dtype), "datetime64[ns, UTC]")
+
+        # Unchanged, answered 304 without a body
+        self.assertIsNone(poller.poll())
+        self.assertEqual(self.server.stats["not_modified"], 1)
+
+        # A revision and a new event, the other events are not returned again
+        self.server.feed.publish(
+            [
+                {**EVENTS[0], "mag": 2.7, "updated": time.time() + 1},
+                {**EVENTS[1], "id": "us004"},
+            ]
+        )
+        self.assertListEqual(sorted(poller.poll()["id"]), ["us001", "us004"])
+
+    def test_events_go_to_the_offices_within_the_radius(self):
+        self.server.feed.publish(EVENTS)
+        df = parse_feed(self.server.feed.body)
+
+        located = locate_events(df, OFFICES, maxradiuskm=500)
+
+        self.assertListEqual(located["pleo_de"]["id"].tolist(), ["us001"])
+        self.assertListEqual(located["pleo_pt"]["id"].tolist(), ["us002"])
+
+    def realtime_job(self, tmp_dir):
+        cache = GeocodingCache(os.path.join(tmp_dir, "geocoding.json"))
+        for name, coordinates in OFFICES.items():
+            cache.set(name, coordinates)
+        cache.save()
+        return JobConfig(
+            name="realtime",
+            **{
+                **DEFAULTS,
+                "locations": {name: name for name in OFFICES},
+                "usgs_base_url": self.base_url,
+                "sink_kind": "parquet",
+                "local_sink_path": os.path.join(tmp_dir, "data"),
+                "geocoding_cache_path": cache.path,
+                "dedup_index_path": os.path.join(tmp_dir, "dedup"),
+                "rollup_path": os.path.join(tmp_dir, "rollups"),
+                "realtime_poll_seconds": 0.01,
+            },
+        )
+
+    def test_new_events_are_loaded_once(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            job = self.realtime_job(tmp_dir)
+            self.server.feed.publish(EVENTS)
+            self.assertEqual(run_realtime(job, max_polls=2), 2)
+
+            # A restarted process only loads the events it did not load yet
+            self.server.feed.publish([{**EVENTS[0], "id": "us005"}])
+            self.assertEqual(run_realtime(job, max_polls=1), 1)
+
+            curated = pd.read_parquet(
+                os.path.join(tmp_dir, "data", "curated_data", "earthquakes")
+            )
+            self.assertListEqual(sorted(curated["id"]), ["us001", "us002", "us005"])
+            daily = pd.read_parquet(
+                os.path.join(tmp_dir, "data", "curated_data", "earthquakes_daily")
+            )
+            self.assertEqual(daily["n_events"].sum(), 3)
+
+    def test_spatial_index_is_saved_when_the_polling_stops(self):
+        load_curated = Destination.load_curated
+
+        def load_and_publish(destination, df):
+            load_curated(destination, df)
+            # The next poll gets a new event, loaded in a second micro-batch
+            if "us005" not in set(df["id"]):
+                self.server.feed.publish([{**EVENTS[0], "id": "us005"}])
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            job = self.realtime_job(tmp_dir)
+            self.server.feed.publish(EVENTS)
+            with patch.object(
+                Destination, "load_curated", autospec=True, side_effect=load_and_publish
+            ) as loads, patch(
+                "functions.spatial_index.update_spatial_index",
+                wraps=update_spatial_index,
+            ) as updates:
+                self.assertEqual(run_realtime(job, max_polls=3), 3)
+
+            self.assertEqual(loads.call_count, 2)
+            self.assertEqual(updates.call_count, 1)
+            index = SpatialIndex.load(spatial_index_path(job))
+            self.assertListEqual(
+                sorted(index.events["id"]), ["us001", "us002", "us005"]
+            )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,116 @@
+import unittest
+from unittest.mock import patch
+from urllib.parse import urlparse, parse_qs
+import numpy as np
+import pandas as pd
+from functions.extraction_engine import extract_locations
+from functions.region_planner import (
+    QueryRegion,
+    assign_locations,
+    haversine_km,
+    plan_query_regions,
+)
+
+DIC_ADDRESSES = {
+    "pleo_dk": [55.69, 12.56],
+    "pleo_de": [52.52, 13.41],
+    "pleo_es": [40.42, -3.70],
+    "pleo_pt": [38.71, -9.14],
+    "pleo_ca": [45.50, -73.57],
+}
+
+rng = np.random.default_rng(0)
+CATALOG = pd.DataFrame(
+    {
+        "id": [f"ev{i}" for i in range(5000)],
+        "latitude": rng.uniform(30, 65, 5000),
+        "longitude": rng.uniform(-80, 25, 5000),
+    }
+)
+
+
+def fake_extract(url, location_name, rate_limiter):
+    # Events of the synthetic catalog inside the circle of the url
+    query = parse_qs(urlparse(url).query)
+    latitude, longitude, radiuskm = (
+        float(query[key][0]) for key in ("latitude", "longitude", "maxradiuskm")
+    )
+    distances = haversine_km(
+        latitude, longitude, CATALOG["latitude"], CATALOG["longitude"]
+    )
+    return CATALOG[distances <= radiuskm].reset_index(drop=True)
+
+
+class TestRegionPlanner(unittest.TestCase):
+
+    def test_haversine_km(self):
+        # One degree along the equator
+        self.assertAlmostEqual(float(haversine_km(0, 0, 0, 1)), 111.12, places=6)
+        distances = haversine_km([0, 0], [0, 0], [0, 90], [90, 0])
+        self.assertEqual(distances.shape, (2,))
+
+    def test_overlapping_locations_are_merged(self):
+        regions = plan_query_regions(DIC_ADDRESSES, 500)
+
+        grouped = sorted(sorted(region.location_names) for region in regions)
+        self.assertIn(["pleo_es", "pleo_pt"], grouped)
+        self.assertIn(["pleo_ca"], grouped)
+        self.assertEqual(sum(len(group) for group in grouped), len(DIC_ADDRESSES))
+        for region in regions:
+            for name in region.location_names:
+                distance = haversine_km(
+                    region.latitude, region.longitude, *DIC_ADDRESSES[name]
+                )
+                self.assertLessEqual(distance + 500, region.radiuskm + 1e-6)
+
+    def test_no_merge_when_area_grows_too_much(self):
+        # Madrid and Lisbon need a circle 13% larger than both circles together
+        regions = plan_query_regions(DIC_ADDRESSES, 500, max_area_ratio=1.0)
+
+        grouped = [sorted(region.location_names) for region in regions]
+        self.assertIn(["pleo_es"], grouped)
+        self.assertIn(["pleo_pt"], grouped)
+
+    def test_assign_locations_keeps_events_within_radius(self):
+        region = QueryRegion(39.6, -6.4, 800, ["pleo_es", "pleo_pt"])
+
+        assigned = assign_locations(CATALOG, region, DIC_ADDRESSES, 500)
+
+        for name, df in assigned.items():
+            self.assertTrue(
+                (
+                    haversine_km(*DIC_ADDRESSES[name], df["latitude"], df["longitude"])
+                    <= 500
+                ).all()
+            )
+
+    @patch("functions.extraction_engine.plan_time_windows", return_value=[("t0", "t1")])
+    @patch(
+        "functions.extraction_engine.extract_data_return_df", side_effect=fake_extract
+    )
+    def test_merged_extraction_matches_per_location(self, mock_extract, mock_plan):
+        kwargs = dict(
+            dic_addresses=DIC_ADDRESSES,
+            url_template="q?latitude={latitude}&longitude={longitude}&maxradiuskm={maxradiuskm}",
+            count_url_template="c",
+            start_time="2020-01-01",
+            end_time="2020-01-02",
+            maxradiuskm=500,
+            limit=20000,
+        )
+
+        per_location = extract_locations(merge_regions=False, **kwargs)
+        n_requests = mock_extract.call_count
+        merged = extract_locations(merge_regions=True, **kwargs)
+
+        self.assertLess(mock_extract.call_count - n_requests, n_requests)
+        self.assertListEqual(list(merged), list(per_location))
+        for name in DIC_ADDRESSES:
+            pd.testing.assert_frame_equal(
+                merged[name].sort_values("id", ignore_index=True),
+                per_location[name].sort_values("id", ignore_index=True),
+            )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,130 @@
+import datetime
+import shutil
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from functions.response_cache import ResponseCache, cache_key, normalize_url
+
+
+class CountHandler(BaseHTTPRequestHandler):
+    """Answers the request path as body, with an ETag honoured by If-None-Match."""
+
+    calls = []
+
+    def do_GET(self):
+        CountHandler.calls.append(self.headers.get("If-None-Match"))
+        if self.headers.get("If-None-Match") == '"v1"':
+            self.send_response(304)
+            self.end_headers()
+            return
+        body = self.path.encode()
+        self.send_response(200)
+        self.send_header("ETag", '"v1"')
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestResponseCache(unittest.TestCase):
+
+    def setUp(self):
+        CountHandler.calls = []
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), CountHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.base_url = f"http://127.0.0.1:{self.server.server_port}/count"
+        self.directory = tempfile.mkdtemp()
+        self.cache = ResponseCache(self.directory)
+
+    def tearDown(self):
+        self.cache.close()
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.directory)
+
+    def url(self, endtime):
+        return f"{self.base_url}?starttime=2020-01-01&endtime={endtime}"
+
+    def test_normalized_urls_share_a_key(self):
+        self.assertEqual(
+            normalize_url("http://h/q?b=2&A=1"), normalize_url("http://h/q?a=1&b=2")
+        )
+        self.assertEqual(
+            cache_key("http://h/q?b=2&a=1"), cache_key("http://h/q?a=1&b=2")
+        )
+
+    def test_old_window_is_never_requested_again(self):
+        url = self.url("2020-02-01")
+
+        first = self.cache.read_text(url)
+        second = self.cache.read_text(url)
+
+        self.assertEqual(first, second)
+        self.assertEqual(CountHandler.calls, [None])
+
+    def test_recent_window_is_revalidated(self):
+        url = self.url(datetime.date.today().isoformat())
+
+        first = self.cache.read_text(url)
+        second = self.cache.read_text(url)
+
+        self.assertEqual(first, second)
+        self.assertEqual(CountHandler.calls, [None, '"v1"'])
+
+    def test_revalidated_window_becomes_immutable(self):
+        url = self.url(datetime.date.today().isoformat())
+        self.cache.max_age = 0
+        self.cache.read_text(url)
+
+        # The window is final by the time it is revalidated
+        self.cache.immutable_after = datetime.timedelta(0)
+        self.cache.read_text(url)
+        self.cache.read_text(url)
+
+        self.assertEqual(CountHandler.calls, [None, '"v1"'])
+
+    def test_old_window_updated_after_is_revalidated(self):
+        # The events updated after a time change with every update
+        url = f"{self.url('2020-02-01')}&updatedafter=2024-01-01T00:00:00"
+        self.cache.read_text(url)
+        self.cache.read_text(url)
+
+        # Also when the revalidated window is old enough to be final
+        self.cache.immutable_after = datetime.timedelta(0)
+        self.cache.read_text(url)
+
+        self.assertEqual(CountHandler.calls, [None, '"v1"', '"v1"'])
+
+    def test_entries_survive_a_new_instance(self):
+        url = self.url("2020-02-01")
+        self.cache.read_text(url)
+
+        reopened = ResponseCache(self.directory)
+        text = reopened.read_text(url)
+        reopened.close()
+
+        self.assertIn("endtime=2020-02-01", text)
+        self.assertEqual(len(CountHandler.calls), 1)
+
+    def test_least_recently_used_entries_are_evicted(self):
+        old_url, used_url, new_url = (self.url(f"2020-02-0{day}") for day in (1, 2, 3))
+        self.cache.read_text(old_url)
+        self.cache.read_text(used_url)
+        # Room for two entries, their sizes differ by a few bytes
+        self.cache.max_bytes = self.cache.size() + 16
+        self.cache.read_text(used_url)
+
+        self.cache.read_text(new_url)
+        self.cache.read_text(used_url)
+        self.cache.read_text(old_url)
+
+        # old_url was evicted and requested again, used_url never was
+        self.assertEqual(len(CountHandler.calls), 4)
+        self.assertLessEqual(self.cache.size(), self.cache.max_bytes)
+
+
+if __name__ == "__main__":
+    unittest.main()
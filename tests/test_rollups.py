@@ -0,0 +1,106 @@
+import os
+import tempfile
+import unittest
+import numpy as np
+import pandas as pd
+from functions.helper_functions import transform_data
+from functions.rollups import ROLLUP_COLUMNS, EarthquakeRollup
+
+rng = np.random.default_rng(0)
+N_EVENTS = 3000
+EVENTS = pd.DataFrame(
+    {
+        "id": pd.array([f"ev{i}" for i in range(N_EVENTS)], dtype="string[pyarrow]"),
+        "time": pd.Timestamp("2023-01-01", tz="UTC")
+        + pd.to_timedelta(rng.uniform(0, 30, N_EVENTS), unit="D"),
+        "mag": np.where(
+            rng.uniform(size=N_EVENTS) < 0.05, np.nan, rng.uniform(0, 6, N_EVENTS)
+        ),
+        "depth": rng.uniform(0, 100, N_EVENTS),
+    }
+)
+
+
+def expected_rollups(frames):
+    """Rollups recomputed from the last version of every event and location."""
+    df = pd.concat(frames, ignore_index=True).drop_duplicates(
+        subset=["id", "location"], keep="last"
+    )
+    df = df.assign(
+        location=df["location"].astype(str),
+        day=df["time"].dt.date,
+        mag_bucket=np.floor(df["mag"]).fillna(-10).astype("int64"),
+    )
+    return (
+        df.groupby(["location", "day", "mag_bucket"])
+        .agg(
+            n_events=("id", "size"),
+            max_mag=("mag", "max"),
+            mean_depth=("depth", "mean"),
+        )
+        .reset_index()
+    )
+
+
+def sorted_rows(df):
+    df = df[df["n_events"] > 0].assign(location=df["location"].astype(str))
+    return df.sort_values(["location", "day", "mag_bucket"], ignore_index=True)[
+        ["location", "day", "mag_bucket", "n_events", "max_mag", "mean_depth"]
+    ]
+
+
+class TestEarthquakeRollup(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, "rollups", "curated_data.npz")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_batches_and_revisions_match_a_full_recomputation(self):
+        frames = []
+        rollup = EarthquakeRollup(self.path)
+        for location_name, batch in [
+            ("pleo_dk", EVENTS.iloc[:1000]),
+            ("pleo_de", EVENTS.iloc[500:2000]),
+            ("pleo_dk", EVENTS.iloc[1000:3000]),
+        ]:
+            frames.append(transform_data(location_name, batch))
+            rollup.add(frames[-1])
+        rollup.save()
+
+        # A later run revises events, re-adds unchanged ones and adds new ones
+        revised = EVENTS.iloc[::7].assign(
+            mag=lambda df: df["mag"] - 1.5, depth=lambda df: df["depth"] + 10
+        )
+        frames.append(transform_data("pleo_dk", revised))
+        rollup = EarthquakeRollup(self.path)
+        rollup.add(frames[-1])
+        frames.append(transform_data("pleo_de", EVENTS.iloc[600:700]))
+        rollup.add(frames[-1])
+
+        pd.testing.assert_frame_equal(
+            sorted_rows(rollup.rows(changed_only=False)),
+            sorted_rows(expected_rollups(frames)),
+            check_dtype=False,
+        )
+
+    def test_only_changed_groups_are_returned(self):
+        rollup = EarthquakeRollup(self.path)
+        rollup.add(transform_data("pleo_dk", EVENTS))
+        rollup.save()
+        self.assertEqual(len(rollup.rows()), 0)
+
+        event = EVENTS.iloc[[0]].assign(mag=9.5)
+        rollup.add(transform_data("pleo_dk", event))
+        rows = rollup.rows()
+
+        self.assertListEqual(list(rows.columns), ROLLUP_COLUMNS)
+        # The group the event left and the group it joined
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(rows["max_mag"].max(), 9.5)
+
+
+if __name__ == "__main__":
+    unittest.main()
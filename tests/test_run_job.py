@@ -0,0 +1,172 @@
+import copy
+import os
+import tempfile
+import threading
+import time
+import unittest
+from unittest.mock import patch
+import pandas as pd
+from app import run_job, run_reassign
+from bench.stub_usgs import Catalog, build_server
+from functions import http_transport
+from functions.config import DEFAULTS, JobConfig
+from functions.destination import Destination
+from functions.geocoding_cache import GeocodingCache
+from functions.query_planner import count_window
+from functions.response_cache import set_default_cache
+
+OFFICES = {"pleo_de": [52.52, 13.41], "pleo_de_2": [52.52, 13.41]}
+
+
+class TestRunJob(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.catalog = Catalog(
+            20000,
+            start_time="2020-01-01",
+            end_time="2024-01-01",
+            centers=[(52.0, 13.0)],
+        )
+        cls.server = build_server(cls.catalog)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        http_transport.configure()
+
+    def setUp(self):
+        count_window.cache_clear()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        cache = GeocodingCache(os.path.join(self.tmp_dir.name, "geocoding.json"))
+        for name, coordinates in OFFICES.items():
+            cache.set(name, coordinates)
+        cache.save()
+        self.job = JobConfig(
+            name="test",
+            **{
+                **DEFAULTS,
+                "locations": {"pleo_de": "pleo_de"},
+                "usgs_base_url": f"http://127.0.0.1:{self.server.server_port}",
+                "requests_per_second": 1000,
+                "sink_kind": "parquet",
+                **{
+                    setting: os.path.join(self.tmp_dir.name, os.path.basename(path))
+                    for setting, path in DEFAULTS.items()
+                    if setting.endswith("_path") and isinstance(path, str)
+                },
+                "geocoding_cache_path": cache.path,
+            },
+        )
+
+    def tearDown(self):
+        # run_job sets the response cache of the process, under tmp_dir
+        set_default_cache(None)
+        self.tmp_dir.cleanup()
+
+    def expected_ids(self, start_time, end_time):
+        selected = self.catalog.select(
+            {
+                "starttime": start_time,
+                "endtime": end_time,
+                "latitude": "52.52",
+                "longitude": "13.41",
+                "maxradiuskm": "500",
+            }
+        )
+        lines = self.catalog.lines[selected]
+        return sorted(line.split(",")[11] for line in lines)
+
+    def curated_ids(self, location_name="pleo_de"):
+        df = pd.read_parquet(
+            os.path.join(self.job.local_sink_path, "curated_data", "earthquakes")
+        )
+        self.assertFalse(df.duplicated(subset=["id", "location"]).any())
+        return sorted(df.loc[df["location"] == location_name, "id"])
+
+    def test_widened_range_is_extracted_in_full(self):
+        run_job(self.job._replace(start_time="2020-01-01", end_time="2021-12-31"))
+        # The events of the new range were all updated before the first run
+        run_job(self.job._replace(start_time="2020-01-01", end_time="2023-12-31"))
+
+        self.assertListEqual(
+            self.curated_ids(), self.expected_ids("2020-01-01", "2023-12-31")
+        )
+
+    def test_new_location_is_assigned_from_the_spatial_index(self):
+        job = self.job._replace(start_time="2020-01-01", end_time="2021-12-31")
+        run_job(job)
+        n_requests = self.server.stats["requests"]
+
+        # The events of the extracted location hash as extracted, none is new
+        self.assertEqual(run_reassign(job), 0)
+        n_rows = run_reassign(job._replace(locations={"pleo_de_2": "pleo_de_2"}))
+
+        self.assertEqual(self.server.stats["requests"], n_requests)
+        expected_ids = self.expected_ids("2020-01-01", "2021-12-31")
+        self.assertEqual(n_rows, len(expected_ids))
+        self.assertListEqual(self.curated_ids("pleo_de_2"), expected_ids)
+
+    def test_spilled_windows_of_a_location_are_loaded_once(self):
+        # Every window of the location is loaded on its own, by several workers
+        job = self.job._replace(
+            start_time="2020-01-01",
+            end_time="2021-12-31",
+            limit=200,
+            spill=True,
+            spill_memory_bytes=64 * 1024,
+            spatial_index=False,
+            rollup_path=None,
+        )
+        run_job(job)
+
+        expected_ids = self.expected_ids("2020-01-01", "2021-12-31")
+        self.assertListEqual(self.curated_ids(), expected_ids)
+        raw = pd.read_parquet(os.path.join(job.local_sink_path, "raw_data", "pleo_de"))
+        self.assertListEqual(sorted(raw["id"]), expected_ids)
+
+    def test_events_updated_before_a_retry_are_loaded(self):
+        job = self.job._replace(start_time="2020-01-01", end_time="2021-12-31")
+        run_job(job)
+        # Revisions of the served catalog only, the other tests share it
+        catalog = copy.deepcopy(self.catalog)
+        self.server.catalog = catalog
+        self.addCleanup(setattr, self.server, "catalog", self.catalog)
+        positions = catalog.select(
+            {
+                "starttime": "2020-01-01",
+                "endtime": "2021-12-31",
+                "latitude": "52.52",
+                "longitude": "13.41",
+                "maxradiuskm": "500",
+            }
+        )
+
+        def revise(revised):
+            updated = int(time.time()) + 60
+            for position in revised:
+                fields = catalog.lines[position].split(",", 5)
+                fields[4] = "9.9"  # mag
+                catalog.lines[position] = ",".join(fields)
+                catalog.updated[position] = updated
+
+        # The first retry fails after the extraction, the watermark stays
+        revise(positions[:5])
+        with patch.object(Destination, "load_curated", side_effect=OSError):
+            with self.assertRaises(OSError):
+                run_job(job)
+        revise(positions[5:10])
+        run_job(job)
+
+        raw = pd.read_parquet(os.path.join(job.local_sink_path, "raw_data", "pleo_de"))
+        revised_ids = sorted(
+            line.split(",")[11] for line in catalog.lines[positions[:10]]
+        )
+        self.assertListEqual(sorted(raw.loc[raw["mag"] == 9.9, "id"]), revised_ids)
+        self.assertFalse(raw["id"].duplicated().any())
+
+
+if __name__ == "__main__":
+    unittest.main()
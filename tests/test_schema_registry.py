@@ -0,0 +1,94 @@
+import json
+import os
+import tempfile
+import unittest
+from unittest.mock import MagicMock
+import pandas as pd
+from functions.schema_registry import (
+    SchemaRegistry,
+    bigquery_type,
+    coerce_to_schema,
+    schema_of,
+)
+
+
+class TestSchemaRegistry(unittest.TestCase):
+
+    def setUp(self):
+        self.backend = MagicMock()
+        self.backend.get_schema.return_value = {"id": "STRING", "mag": "FLOAT64"}
+
+    def test_schema_is_fetched_once(self):
+        registry = SchemaRegistry(self.backend)
+
+        for _ in range(3):
+            self.assertEqual(registry.get("p.d.t"), {"id": "STRING", "mag": "FLOAT64"})
+            self.assertTrue(registry.exists("p.d.t"))
+
+        self.backend.get_schema.assert_called_once_with("p.d.t")
+        self.backend.table_exists.assert_not_called()
+
+    def test_schema_file_avoids_the_fetch(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "schemas.json")
+            with open(path, "w") as file:
+                json.dump(
+                    {"version": 2, "tables": {"raw_data.*": {"id": "STRING"}}}, file
+                )
+
+            registry = SchemaRegistry(self.backend, schema_path=path)
+
+        self.assertEqual(registry.get("p.raw_data.pleo_dk"), {"id": "STRING"})
+        self.backend.get_schema.assert_not_called()
+
+    def test_dtype_mapping(self):
+        df = pd.DataFrame(
+            {
+                "mag": [1.0],
+                "hashed_id": [1],
+                "time": pd.to_datetime(["2024-01-01"], utc=True),
+                "inserted_at": pd.to_datetime(["2024-01-01"]),
+                "net": pd.Categorical(["us"]),
+                "place": ["Somewhere"],
+            }
+        )
+
+        self.assertEqual(
+            schema_of(df),
+            {
+                "mag": "FLOAT",
+                "hashed_id": "INTEGER",
+                "time": "TIMESTAMP",
+                "inserted_at": "DATETIME",
+                "net": "STRING",
+                "place": "STRING",
+            },
+        )
+        self.assertEqual(bigquery_type(pd.BooleanDtype()), "BOOLEAN")
+
+    def test_coerce_to_schema(self):
+        df = pd.DataFrame(
+            {
+                "time": pd.to_datetime(["2023-12-30T23:45:12.345Z"], utc=True),
+                "nst": [12.0],
+                "net": pd.Categorical(["us"]),
+                "mag": [1.5],
+            }
+        )
+
+        result_df = coerce_to_schema(
+            df, {"time": "STRING", "nst": "INT64", "net": "STRING", "mag": "FLOAT"}
+        )
+
+        self.assertEqual(result_df["time"].iloc[0], "2023-12-30T23:45:12.345Z")
+        self.assertEqual(str(result_df["nst"].dtype), "Int64")
+        self.assertEqual(result_df["mag"].dtype, "float64")
+        self.assertEqual(str(df["time"].dtype), "datetime64[ns, UTC]")
+
+    def test_coerce_to_schema_rejects_unknown_columns(self):
+        with self.assertRaises(ValueError):
+            coerce_to_schema(pd.DataFrame({"depth": [1.0]}), {"mag": "FLOAT"})
+
+
+if __name__ == "__main__":
+    unittest.main()
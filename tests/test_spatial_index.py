@@ -0,0 +1,135 @@
+import os
+import tempfile
+import unittest
+import numpy as np
+import pandas as pd
+from functions.helper_functions import transform_data
+from functions.region_planner import QueryRegion, assign_locations, haversine_km
+from functions.sinks import ParquetSink
+from functions.spatial_index import SpatialIndex, update_spatial_index
+
+rng = np.random.default_rng(0)
+N_EVENTS = 20000
+EVENTS = pd.DataFrame(
+    {
+        "id": pd.array([f"ev{i}" for i in range(N_EVENTS)], dtype="string[pyarrow]"),
+        "time": pd.Timestamp("2020-01-01", tz="UTC")
+        + pd.to_timedelta(rng.uniform(0, 4 * 365, N_EVENTS), unit="D"),
+        "latitude": np.degrees(np.arcsin(rng.uniform(-1, 1, N_EVENTS))),
+        "longitude": rng.uniform(-180, 180, N_EVENTS),
+        "place": pd.array(["somewhere"] * N_EVENTS, dtype="string[pyarrow]"),
+    }
+)
+
+
+def brute_force(latitude, longitude, radiuskm, start_time=None, end_time=None):
+    distances = haversine_km(
+        latitude, longitude, EVENTS["latitude"], EVENTS["longitude"]
+    )
+    within = distances <= radiuskm
+    if start_time is not None:
+        within &= EVENTS["time"] >= pd.Timestamp(start_time, tz="UTC")
+    if end_time is not None:
+        within &= EVENTS["time"] <= pd.Timestamp(end_time, tz="UTC")
+    return set(EVENTS["id"][within])
+
+
+class TestSpatialIndex(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.index = SpatialIndex(EVENTS, cell_degrees=2.0)
+
+    def test_query_matches_brute_force(self):
+        circles = [
+            (55.69, 12.56, 500),
+            (0.0, 179.8, 900),  # crosses the antimeridian
+            (-10.0, -179.5, 300),
+            (88.0, 40.0, 600),  # contains the north pole
+            (-45.0, 60.0, 9000),
+            (30.0, 0.0, 25000),  # the whole earth
+        ]
+        for latitude, longitude, radiuskm in circles:
+            result = self.index.query(latitude, longitude, radiuskm)
+            self.assertSetEqual(
+                set(result["id"]), brute_force(latitude, longitude, radiuskm)
+            )
+            self.assertTrue((result["distance_km"] <= radiuskm).all())
+
+    def test_query_time_bounds(self):
+        result = self.index.query(40.0, -3.7, 3000, "2021-03-01", "2022-06-30T12:00")
+
+        self.assertSetEqual(
+            set(result["id"]),
+            brute_force(40.0, -3.7, 3000, "2021-03-01", "2022-06-30T12:00"),
+        )
+        self.assertTrue(result["time"].is_monotonic_increasing)
+
+    def test_assign_locations_matches_region_planner(self):
+        dic_addresses = {"pleo_dk": [55.69, 12.56], "pleo_de": [52.52, 13.41]}
+        region = QueryRegion(54.0, 13.0, 700, list(dic_addresses))
+        expected = assign_locations(EVENTS, region, dic_addresses, 500)
+        inserted_at = pd.Timestamp("2024-01-01", tz="UTC")
+
+        curated = self.index.assign_locations(
+            dic_addresses, 500, inserted_at=inserted_at
+        )
+
+        for location_name, df in expected.items():
+            rows = curated[curated["location"] == location_name]
+            self.assertSetEqual(set(rows["id"]), set(df["id"]))
+            # Same rows, same hash as the pipeline
+            pd.testing.assert_series_equal(
+                rows.set_index("id")["hashed_id"].sort_index(),
+                transform_data(location_name, df, inserted_at=inserted_at)
+                .set_index("id")["hashed_id"]
+                .sort_index(),
+            )
+
+    def test_update_replaces_events_with_the_same_id(self):
+        revised = EVENTS.head(2).assign(latitude=[10.0, 10.0], longitude=[20.0, 20.0])
+        curated = transform_data("pleo_dk", revised)
+
+        index = self.index.update(curated)
+
+        self.assertEqual(len(index), N_EVENTS)
+        self.assertNotIn("location", index.events.columns)
+        self.assertSetEqual(set(index.query(10.0, 20.0, 1)["id"]), set(revised["id"]))
+
+    def test_save_and_load(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "index", "earthquakes_index.parquet")
+            update_spatial_index(path, transform_data("pleo_dk", EVENTS.head(100)))
+            index = update_spatial_index(
+                path, transform_data("pleo_de", EVENTS.iloc[50:200])
+            )
+            loaded = SpatialIndex.load(path)
+
+        self.assertEqual(len(index), 200)
+        self.assertEqual(loaded.cell_degrees, 1.0)
+        pd.testing.assert_frame_equal(loaded.events, index.events)
+
+    def test_from_parquet_curated_table(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            sink = ParquetSink(root=tmp_dir)
+            curated = pd.concat(
+                [
+                    transform_data("pleo_dk", EVENTS.head(300)),
+                    transform_data("pleo_de", EVENTS.iloc[200:400]),
+                ],
+                ignore_index=True,
+            )
+            sink.write(curated, "curated_data", "earthquakes")
+            index = SpatialIndex.from_parquet(
+                sink.table_path("curated_data", "earthquakes")
+            )
+
+        self.assertEqual(len(index), 400)
+        self.assertListEqual(
+            list(index.events.columns), ["id", "time", "latitude", "longitude", "place"]
+        )
+        self.assertEqual(str(index.events["time"].dtype), "datetime64[ns, UTC]")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,141 @@
+import tempfile
+import threading
+import unittest
+from unittest.mock import MagicMock
+from bench.stub_usgs import Catalog, build_server
+from functions import http_transport
+from functions.extraction_engine import extract_locations
+from functions.helper_functions import extract_data_return_df
+from functions.query_planner import count_window, plan_time_windows
+from functions.response_cache import ResponseCache, set_default_cache
+from functions.usgs_schema import CSV_COLUMNS
+
+QUERY_PARAMS = (
+    "starttime=2020-01-01&endtime=2024-01-01"
+    "&latitude=50.0&longitude=10.0&maxradiuskm=500"
+)
+
+
+class TestStubUsgs(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.catalog = Catalog(5000, centers=[(50.0, 10.0)], seed=1)
+        cls.server = build_server(cls.catalog)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.base_url = f"http://127.0.0.1:{cls.server.server_port}/fdsnws/event/1"
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        count_window.cache_clear()
+
+    def test_count_matches_the_catalog(self):
+        expected = len(
+            self.catalog.select(
+                {"latitude": "50.0", "longitude": "10.0", "maxradiuskm": "500"}
+            )
+        )
+
+        count = count_window(f"{self.base_url}/count?{QUERY_PARAMS}")
+
+        self.assertEqual(count, expected)
+        self.assertGreater(count, 1000)
+
+    def test_cached_count_probes_take_no_token(self):
+        rate_limiter = MagicMock()
+
+        def plan():
+            count_window.cache_clear()
+            return plan_time_windows(
+                self.base_url + "/count?starttime={start_time}&endtime={end_time}"
+                "&latitude={latitude}&longitude={longitude}"
+                "&maxradiuskm={maxradiuskm}",
+                "2020-01-01",
+                "2021-01-01",
+                50.0,
+                10.0,
+                500,
+                limit=300,
+                rate_limiter=rate_limiter,
+            )
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            cache = ResponseCache(tmp_dir)
+            set_default_cache(cache)
+            try:
+                n_requests = self.server.stats["requests"]
+                windows = plan()
+                n_probes = self.server.stats["requests"] - n_requests
+                # The windows of 2020 are final, the second plan reads them all
+                # from the cache
+                self.assertListEqual(plan(), windows)
+            finally:
+                set_default_cache(None)
+                cache.close()
+
+        self.assertGreater(n_probes, 1)
+        self.assertEqual(self.server.stats["requests"], n_requests + n_probes)
+        self.assertEqual(rate_limiter.acquire.call_count, n_probes)
+
+    def test_query_without_events_is_an_empty_frame(self):
+        # Far from the events of the catalog, answered 204 without a body
+        url = (
+            f"{self.base_url}/query?starttime=2020-01-01&endtime=2024-01-01"
+            "&latitude=-50.0&longitude=-100.0&maxradiuskm=10"
+        )
+        self.assertEqual(http_transport.get(url).status_code, 204)
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            cache = ResponseCache(tmp_dir)
+            try:
+                frames = [extract_data_return_df(url, "loc_a")]
+                set_default_cache(cache)
+                frames.append(extract_data_return_df(url, "loc_a"))
+                frames.append(extract_data_return_df(url, "loc_a"))
+            finally:
+                set_default_cache(None)
+                cache.close()
+
+        for df in frames:
+            self.assertEqual(len(df), 0)
+            self.assertListEqual(list(df.columns), CSV_COLUMNS)
+            self.assertEqual(str(df["time"].dtype), "datetime64[ns, UTC]")
+            self.assertEqual(df["mag"].dtype, "float64")
+
+    def test_query_over_the_limit_is_rejected(self):
+        response = http_transport.get(f"{self.base_url}/query?{QUERY_PARAMS}&limit=10")
+
+        self.assertEqual(response.status_code, 400)
+
+    def test_extraction_returns_every_event_once(self):
+        expected = count_window(f"{self.base_url}/count?{QUERY_PARAMS}")
+
+        result = extract_locations(
+            dic_addresses={"loc_a": [50.0, 10.0]},
+            url_template=(
+                self.base_url + "/query?format={file_format}&starttime={start_time}"
+                "&endtime={end_time}&latitude={latitude}&longitude={longitude}"
+                "&maxradiuskm={maxradiuskm}&limit={limit}"
+            ),
+            count_url_template=(
+                self.base_url + "/count?starttime={start_time}&endtime={end_time}"
+                "&latitude={latitude}&longitude={longitude}&maxradiuskm={maxradiuskm}"
+            ),
+            start_time="2020-01-01",
+            end_time="2024-01-01",
+            maxradiuskm=500,
+            limit=1000,
+            requests_per_second=1000,
+        )
+
+        df = result["loc_a"]
+        self.assertEqual(len(df), expected)
+        self.assertTrue(df["id"].is_unique)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,76 @@
+import io
+import unittest
+import pandas as pd
+from functions.helper_functions import compute_hashed_id, transform_data
+from functions.usgs_schema import (
+    USGS_DTYPES,
+    constant_column,
+    memory_report,
+    parse_time_columns,
+    to_arrow_table,
+)
+
+CSV = (
+    "time,latitude,longitude,depth,mag,magType,nst,gap,net,id,updated,place,"
+    "type,status,locationSource,magSource\n"
+    "2023-12-30T23:45:12.345Z,55.1,12.2,10.5,2.3,ml,12,80,us,us1,"
+    "2024-01-02T10:00:00.000Z,10 km N of A,earthquake,reviewed,us,us\n"
+    "2023-12-29T01:02:03.004Z,54.9,11.8,7.25,3.1,mb,,95,us,us2,"
+    "2024-01-01T09:00:00.000Z,5 km S of B,earthquake,automatic,us,us\n"
+)
+
+
+class TestUsgsSchema(unittest.TestCase):
+
+    def setUp(self):
+        self.df = parse_time_columns(pd.read_csv(io.StringIO(CSV), dtype=USGS_DTYPES))
+
+    def test_compact_dtypes(self):
+        dtypes = self.df.dtypes
+
+        self.assertEqual(dtypes["latitude"], "float64")
+        self.assertEqual(dtypes["gap"], "float32")
+        self.assertEqual(dtypes["magSource"], "category")
+        self.assertEqual(dtypes["id"], "string")
+        self.assertEqual(str(dtypes["time"]), "datetime64[ns, UTC]")
+
+    def test_hashed_id_does_not_depend_on_the_representation(self):
+        compact = transform_data("pleo_dk", self.df)
+        plain = compact.astype(
+            {"id": object, "place": object, "location": object, "magType": object}
+        )
+
+        pd.testing.assert_series_equal(
+            compute_hashed_id(compact), compute_hashed_id(plain)
+        )
+
+    def test_curated_columns_are_constant_categories(self):
+        inserted_at = pd.Timestamp("2024-01-03T00:00:00", tz="UTC")
+
+        df = transform_data("pleo_dk", self.df, inserted_at=inserted_at)
+
+        self.assertListEqual(df["location"].cat.categories.tolist(), ["pleo_dk"])
+        self.assertTrue((df["inserted_at"] == inserted_at).all())
+        self.assertEqual(df["location"].cat.codes.dtype, "int8")
+
+    def test_arrow_table_keeps_the_time_zone(self):
+        df = pd.DataFrame(
+            {"inserted_at": constant_column(pd.Timestamp("2024-01-03", tz="UTC"), 3)}
+        )
+
+        table = to_arrow_table(df)
+
+        self.assertEqual(
+            str(table.schema.field("inserted_at").type), "timestamp[ns, tz=UTC]"
+        )
+
+    def test_memory_report(self):
+        report = memory_report(self.df)
+
+        self.assertEqual(report.index[-1], "total")
+        self.assertEqual(report.loc["total", "bytes"], report["bytes"].iloc[:-1].sum())
+        self.assertAlmostEqual(report["share"].iloc[:-1].sum(), 1.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,77 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+import pandas as pd
+from functions.extraction_engine import extract_locations
+from functions.state_store import WatermarkStore, watermark_key
+
+
+class TestWatermarkStore(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, "state", "state.sqlite")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_watermarks_survive_a_reopen(self):
+        key = watermark_key("pleo_dk", 500, "2020-01-01", "2023-12-31")
+        store = WatermarkStore(self.path)
+        self.assertIsNone(store.get(key))
+
+        store.set(key, "2024-01-01T00:00:00")
+        store.set(key, "2024-01-02T00:00:00")
+        store.close()
+
+        self.assertEqual(WatermarkStore(self.path).get(key), "2024-01-02T00:00:00")
+
+    def test_key_changes_with_the_query(self):
+        key = watermark_key("pleo_dk", 500, "2020-01-01", "2023-12-31")
+        self.assertNotEqual(
+            key, watermark_key("pleo_dk", 300, "2020-01-01", "2023-12-31")
+        )
+        # A widened range is extracted in full, not only its updates
+        self.assertNotEqual(
+            key, watermark_key("pleo_dk", 500, "2020-01-01", "2024-12-31")
+        )
+
+
+class TestExtractLocationsWatermarks(unittest.TestCase):
+
+    @patch("functions.extraction_engine.extract_data_return_df")
+    @patch("functions.extraction_engine.plan_time_windows")
+    def test_only_updates_are_requested(self, mock_plan, mock_extract):
+        mock_plan.return_value = [("t0", "t1")]
+        mock_extract.side_effect = lambda url, location_name, rate_limiter: (
+            pd.DataFrame({"id": [url]})
+        )
+
+        result = extract_locations(
+            dic_addresses={"loc_a": [1.0, 2.0], "loc_b": [50.0, 60.0]},
+            url_template="q?lat={latitude}",
+            count_url_template="c?lat={latitude}",
+            start_time="2020-01-01",
+            end_time="2020-01-02",
+            maxradiuskm=500,
+            limit=20000,
+            watermarks={"loc_a": "2024-01-01T00:00:00", "loc_b": None},
+        )
+
+        self.assertEqual(
+            result["loc_a"]["id"].tolist(),
+            ["q?lat=1.0&updatedafter=2024-01-01T00:00:00"],
+        )
+        self.assertEqual(result["loc_b"]["id"].tolist(), ["q?lat=50.0"])
+        count_templates = sorted(
+            call.kwargs["count_url_template"] for call in mock_plan.call_args_list
+        )
+        self.assertEqual(
+            count_templates,
+            ["c?lat={latitude}", "c?lat={latitude}&updatedafter=2024-01-01T00:00:00"],
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
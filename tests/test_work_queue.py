@@ -0,0 +1,108 @@
+import os
+import tempfile
+import threading
+import time
+import unittest
+from functions.work_queue import DONE, FAILED, LEASED, PENDING, WorkQueue
+
+UNITS = [(f"job|pleo_dk|{i}", {"window": i}) for i in range(20)]
+
+
+class TestWorkQueue(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, "queue", "queue.sqlite")
+        self.queue = WorkQueue(self.path, lease_seconds=60, max_attempts=2)
+
+    def tearDown(self):
+        self.queue.close()
+        self.tmp_dir.cleanup()
+
+    def test_every_unit_is_claimed_once_by_concurrent_workers(self):
+        self.queue.enqueue(UNITS)
+        claimed = []
+
+        def worker(owner):
+            # Every worker has its own connection, like another process
+            queue = WorkQueue(self.path)
+            while (unit := queue.claim(owner)) is not None:
+                claimed.append(unit.key)
+                queue.complete(unit.id, owner, checkpoint={"rows": 1})
+            queue.close()
+
+        threads = [threading.Thread(target=worker, args=(f"w{i}",)) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertListEqual(sorted(claimed), sorted(key for key, _ in UNITS))
+        self.assertDictEqual(self.queue.counts(), {DONE: 20})
+        # Queuing the same units again leaves the done ones alone
+        self.assertEqual(self.queue.enqueue(UNITS), 0)
+
+    def test_failed_units_are_retried_until_max_attempts(self):
+        self.queue.enqueue(UNITS[:1])
+
+        unit = self.queue.claim("w1")
+        self.assertEqual(unit.payload, {"window": 0})
+        self.queue.fail(unit.id, "w1", error="timeout")
+        self.assertEqual(self.queue.units()[0]["status"], PENDING)
+        unit = self.queue.claim("w2")
+        self.assertEqual(unit.attempt, 2)
+        self.queue.fail(unit.id, "w2", error="timeout")
+
+        (status,) = self.queue.units(key_prefix="job|")
+        self.assertEqual(status["status"], FAILED)
+        self.assertEqual(status["error"], "timeout")
+        self.assertIsNone(self.queue.claim("w3"))
+        # A new backfill queues the failed units again
+        self.assertEqual(self.queue.enqueue(UNITS[:1]), 1)
+        self.assertEqual(self.queue.claim("w3").attempt, 1)
+
+    def test_expired_lease_is_claimed_again(self):
+        queue = WorkQueue(self.path, lease_seconds=0.2, max_attempts=3)
+        queue.enqueue(UNITS[:1])
+
+        unit = queue.claim("died")
+        self.assertIsNone(queue.claim("w2"))
+        self.assertEqual(queue.counts(), {LEASED: 1})
+        time.sleep(0.3)
+        self.assertEqual(queue.claim("w2").id, unit.id)
+        # The worker that lost the lease cannot finish the unit
+        self.assertFalse(queue.heartbeat(unit.id, "died"))
+        queue.complete(unit.id, "died")
+        self.assertEqual(queue.counts(), {LEASED: 1})
+        queue.close()
+
+    def test_lock_is_exclusive_across_connections(self):
+        other = WorkQueue(self.path)
+        events = []
+
+        def hold(queue, owner):
+            with queue.lock("parquet:data", owner, poll_seconds=0.01):
+                events.append(("enter", owner))
+                time.sleep(0.05)
+                # Reentrant for the same owner
+                with queue.lock("parquet:data", owner):
+                    pass
+                events.append(("exit", owner))
+
+        threads = [
+            threading.Thread(target=hold, args=(self.queue, "w1")),
+            threading.Thread(target=hold, args=(other, "w2")),
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        other.close()
+
+        self.assertEqual(events[0][1], events[1][1])
+        self.assertEqual(events[2][1], events[3][1])
+        self.assertListEqual([event for event, _ in events], ["enter", "exit"] * 2)
+
+
+if __name__ == "__main__":
+    unittest.main()